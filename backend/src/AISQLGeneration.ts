@@ -26,7 +26,7 @@ Relevant columns within 'filtered_crashes' and their types/notes:
 - crash_month (text - e.g., 'January', 'February')
 - crash_day_of_week (text - e.g., 'Monday')
 - crash_hour (integer - 0-23)
-- crash_date (timestamp without time zone - NOTE: only year and month are accurate)
+- crash_date (date - first day of the crash month; only year and month are meaningful)
 - crash_nature (text)
 - crash_type (text)
 - crash_roadway_feature (text)
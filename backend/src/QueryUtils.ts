@@ -12,6 +12,20 @@ export const CRASH_QUERY_COLUMNS = [
   "crash_latitude",
 ];
 
+// Map zoom thresholds for the simplified locality shapes written by download_data.py
+export function detailForZoom(zoom: number): string {
+  if (zoom <= 8) return "low";
+  if (zoom <= 12) return "medium";
+  return "high";
+}
+
+// Hexagon sizes of the crash_heatmap table (HEATMAP_CELL_SIZES in download_data.py), in Web Mercator metres
+export function heatmapCellSizeForZoom(zoom: number): number {
+  if (zoom <= 7) return 16000;
+  if (zoom <= 10) return 4000;
+  return 1000;
+}
+
 export function getLocationList(
   input: string | string[] | undefined
 ): string[] {
@@ -27,13 +41,14 @@ export function buildLocalitiesFilter(locations: string[]): SQLStatement {
     return query;
   }
 
-  query.append(SQL`(ST_Within(C.geom, L.geom) AND (`);
+  // crashes.locality is assigned at ingest (download_data.py), so no spatial join is needed.
+  query.append(SQL`(`);
   for (const [index, loc] of localities.entries()) {
     const value = loc.slice("locality:".length);
     if (index > 0) query.append(SQL` OR `);
-    query.append(SQL`LOWER(L.locality) = ${value.toLowerCase()}`);
+    query.append(SQL`LOWER(C.locality) = ${value.toLowerCase()}`);
   }
-  query.append(SQL`))`);
+  query.append(SQL`)`);
 
   return query;
 }
@@ -69,10 +84,13 @@ export function buildDateFilter(
   startDate: string,
   endDate: string
 ): SQLStatement {
+  // crash_date is a DATE on the first of the crash month, indexed at load time. It is also the
+  // partition key when crashes is loaded with --partitioned; TO_DATE is STABLE, so Postgres
+  // prunes the yearly partitions outside the window when the query starts executing.
   return SQL`
-      DATE_TRUNC('month', TO_DATE(crash_month || ' ' || crash_year, 'Month YYYY'))
-      BETWEEN DATE_TRUNC('month', TO_DATE(${startDate}, 'YYYY-MM'))
-      AND DATE_TRUNC('month', TO_DATE(${endDate}, 'YYYY-MM'))
+      crash_date
+      BETWEEN TO_DATE(${startDate}, 'YYYY-MM')
+      AND TO_DATE(${endDate}, 'YYYY-MM')
     `;
 }
 
@@ -93,9 +111,7 @@ export function buildCrashQuery(
   if (localitiesFilter.query.length > 0) {
     const q = SQL`SELECT `;
     q.append(colSQL);
-    q.append(
-      SQL` FROM crashes C JOIN localities L ON ST_Within(C.geom, L.geom) WHERE `
-    );
+    q.append(SQL` FROM crashes C WHERE `);
     q.append(dateFilter);
     q.append(SQL`AND (`);
     q.append(localitiesFilter);
@@ -106,9 +122,7 @@ export function buildCrashQuery(
   if (bboxFilter.query.length > 0) {
     const q = SQL`SELECT `;
     q.append(colSQL);
-    q.append(
-      SQL` FROM crashes C JOIN localities L ON ST_Within(C.geom, L.geom) WHERE `
-    );
+    q.append(SQL` FROM crashes C WHERE C.locality IS NOT NULL AND `);
     q.append(dateFilter);
     q.append(SQL`AND (`);
     q.append(bboxFilter);
@@ -128,6 +142,59 @@ export function buildCrashQuery(
   return finalQuery;
 }
 
+// Dimensions of the crash_rollup table (built by load_to_db.py) that can be grouped on.
+export const ROLLUP_GROUP_COLUMNS = [
+  "crash_severity",
+  "crash_hour",
+  "crash_day_of_week",
+  "crash_date",
+];
+
+export function buildRollupQuery(
+  startDate: string,
+  endDate: string,
+  locationList: string[],
+  groupBy: string
+): SQLStatement {
+  const localitiesFilter = buildLocalitiesFilter(locationList);
+
+  const q = SQL`SELECT `;
+  q.append(groupBy); // Whitelisted against ROLLUP_GROUP_COLUMNS by the caller
+  q.append(SQL` AS key, SUM(crash_count)::integer AS count FROM crash_rollup C WHERE `);
+  q.append(buildDateFilter(startDate, endDate));
+  if (localitiesFilter.query.length > 0) {
+    q.append(SQL`AND (`);
+    q.append(localitiesFilter);
+    q.append(SQL`)`);
+  }
+  q.append(SQL` GROUP BY 1 ORDER BY 1`);
+  return q;
+}
+
+export function buildHeatmapQuery(
+  startDate: string,
+  endDate: string,
+  cellSize: number,
+  locationList: string[],
+  severities: string[]
+): SQLStatement {
+  const bboxFilter = buildBboxFilter(locationList);
+
+  // crash_heatmap (built by download_data.py) holds one row per hexagon x month x severity.
+  const q = SQL`SELECT cell_q, cell_r, ST_X(geom) AS longitude, ST_Y(geom) AS latitude, SUM(crash_count)::integer AS count FROM crash_heatmap C WHERE cell_size = ${cellSize} AND `;
+  q.append(buildDateFilter(startDate, endDate));
+  if (severities.length > 0) {
+    q.append(SQL` AND crash_severity = ANY(${severities})`);
+  }
+  if (bboxFilter.query.length > 0) {
+    q.append(SQL` AND (`);
+    q.append(bboxFilter);
+    q.append(SQL`)`);
+  }
+  q.append(SQL` GROUP BY cell_q, cell_r, geom ORDER BY count DESC`);
+  return q;
+}
+
 export function buildFilteredCrashCTEQuery(cte: SQLStatement) {
   const baseQuery = SQL`WITH filtered_crashes AS (`;
   baseQuery.append(cte);
@@ -1,4 +1,5 @@
 import { Response } from "express";
+import { ROLLUP_GROUP_COLUMNS } from "./QueryUtils";
 
 export function validateCrashQueryParams(
   startDate: unknown,
@@ -75,3 +76,110 @@ export function validateChartQueryParams(
     prompt,
   };
 }
+
+export function validateRollupQueryParams(
+  startDate: unknown,
+  endDate: unknown,
+  location: unknown,
+  groupBy: unknown,
+  res: Response
+):
+  | {
+      isValid: true;
+      startDate: string;
+      endDate: string;
+      location: string | string[] | undefined;
+      groupBy: string;
+    }
+  | { isValid: false } {
+  if (typeof startDate !== "string" || typeof endDate !== "string") {
+    res
+      .status(400)
+      .json({ error: "startDate and endDate required in YYYY-MM format" });
+    return { isValid: false };
+  }
+
+  // Location is optional here: without it the rollup covers the whole state.
+  const isLocationValid =
+    location === undefined ||
+    typeof location === "string" ||
+    Array.isArray(location);
+  if (!isLocationValid) {
+    res.status(400).json({ error: "location must be a string or list" });
+    return { isValid: false };
+  }
+
+  if (typeof groupBy !== "string" || !ROLLUP_GROUP_COLUMNS.includes(groupBy)) {
+    res.status(400).json({
+      error: `groupBy must be one of: ${ROLLUP_GROUP_COLUMNS.join(", ")}`,
+    });
+    return { isValid: false };
+  }
+
+  return {
+    isValid: true,
+    startDate,
+    endDate,
+    location: location as string | string[] | undefined,
+    groupBy,
+  };
+}
+
+export function validateHeatmapQueryParams(
+  startDate: unknown,
+  endDate: unknown,
+  zoom: unknown,
+  location: unknown,
+  severity: unknown,
+  res: Response
+):
+  | {
+      isValid: true;
+      startDate: string;
+      endDate: string;
+      zoom: number;
+      location: string | string[] | undefined;
+      severity: string | string[] | undefined;
+    }
+  | { isValid: false } {
+  if (typeof startDate !== "string" || typeof endDate !== "string") {
+    res
+      .status(400)
+      .json({ error: "startDate and endDate required in YYYY-MM format" });
+    return { isValid: false };
+  }
+
+  const zoomLevel = Number(zoom);
+  if (typeof zoom !== "string" || !Number.isFinite(zoomLevel)) {
+    res.status(400).json({ error: "zoom is required" });
+    return { isValid: false };
+  }
+
+  // Location and severity are optional: without them the heatmap covers every crash statewide.
+  const isLocationValid =
+    location === undefined ||
+    typeof location === "string" ||
+    Array.isArray(location);
+  if (!isLocationValid) {
+    res.status(400).json({ error: "location must be a string or list" });
+    return { isValid: false };
+  }
+
+  const isSeverityValid =
+    severity === undefined ||
+    typeof severity === "string" ||
+    Array.isArray(severity);
+  if (!isSeverityValid) {
+    res.status(400).json({ error: "severity must be a string or list" });
+    return { isValid: false };
+  }
+
+  return {
+    isValid: true,
+    startDate,
+    endDate,
+    zoom: zoomLevel,
+    location: location as string | string[] | undefined,
+    severity: severity as string | string[] | undefined,
+  };
+}
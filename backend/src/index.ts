@@ -6,14 +6,20 @@ import SQL from "sql-template-strings";
 import {
   buildCrashQuery,
   buildFilteredCrashCTEQuery,
+  buildHeatmapQuery,
+  buildRollupQuery,
   CRASH_QUERY_COLUMNS,
+  detailForZoom,
   getLocationList,
+  heatmapCellSizeForZoom,
 } from "./QueryUtils";
 import { GoogleGenAI, Type } from "@google/genai";
 import { generateAggregationSql } from "./AISQLGeneration";
 import {
   validateChartQueryParams,
   validateCrashQueryParams,
+  validateHeatmapQueryParams,
+  validateRollupQueryParams,
 } from "./ValidateUtils";
 import { generateChartData } from "./AIChartDataGeneration";
 
@@ -81,6 +87,75 @@ app.get("/crashes", async (req, res) => {
   }
 });
 
+app.get("/crashes/rollup", async (req, res) => {
+  const validation = validateRollupQueryParams(
+    req.query.startDate,
+    req.query.endDate,
+    req.query.location,
+    req.query.groupBy,
+    res
+  );
+
+  if (!validation.isValid) return;
+  const { startDate, endDate, location, groupBy } = validation;
+
+  const locationList: string[] = getLocationList(location);
+  if (locationList.some((loc) => loc.startsWith("bbox:"))) {
+    res
+      .status(400)
+      .json({ error: "Rollups are per locality; bbox filters use /crashes" });
+    return;
+  }
+
+  try {
+    const result = await pg.query(
+      buildRollupQuery(startDate, endDate, locationList, groupBy)
+    );
+    res.json(result.rows);
+  } catch (err) {
+    console.error("Database error:", err);
+    res.status(500).json({ error: "Could not retrieve rollup" });
+  }
+});
+
+app.get("/crashes/heatmap", async (req, res) => {
+  const validation = validateHeatmapQueryParams(
+    req.query.startDate,
+    req.query.endDate,
+    req.query.zoom,
+    req.query.location,
+    req.query.severity,
+    res
+  );
+
+  if (!validation.isValid) return;
+  const { startDate, endDate, zoom, location, severity } = validation;
+
+  const locationList: string[] = getLocationList(location);
+  if (locationList.some((loc) => loc.startsWith("locality:"))) {
+    res
+      .status(400)
+      .json({ error: "Heatmaps filter by bbox; locality filters use /crashes" });
+    return;
+  }
+
+  try {
+    const result = await pg.query(
+      buildHeatmapQuery(
+        startDate,
+        endDate,
+        heatmapCellSizeForZoom(zoom),
+        locationList,
+        getLocationList(severity)
+      )
+    );
+    res.json(result.rows);
+  } catch (err) {
+    console.error("Database error:", err);
+    res.status(500).json({ error: "Could not retrieve heatmap" });
+  }
+});
+
 app.get("/localities/names", async (req, res) => {
   try {
     const result = await pg.query(
@@ -95,9 +170,12 @@ app.get("/localities/names", async (req, res) => {
 
 app.get("/localities/geodata", async (req, res) => {
   try {
-    const { locality } = req.query;
+    const { locality, zoom } = req.query;
+    const zoomLevel = Number(zoom);
     const result = await pg.query(
-      SQL`SELECT ST_AsGeoJSON(geom)::json as geom FROM localities WHERE locality = ${locality}`
+      zoom !== undefined && Number.isFinite(zoomLevel)
+        ? SQL`SELECT ST_AsGeoJSON(geom)::json as geom FROM localities_simplified WHERE locality = ${locality} AND detail = ${detailForZoom(zoomLevel)}`
+        : SQL`SELECT ST_AsGeoJSON(geom)::json as geom FROM localities WHERE locality = ${locality}`
     );
     res.json(result.rows[0].geom);
   } catch (err) {
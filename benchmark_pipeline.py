@@ -0,0 +1,472 @@
+import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
+import shapely
+
+import download_cache
+import download_data
+import geo_files
+import load_to_db
+
+# =============================================================================
+# End-to-end benchmark of the ingest and load pipeline on synthetic data.
+#
+# Synthetic crash CSVs and locality shapefiles are generated at multiples of the current
+# statewide volume, then every stage of download_data.py (and optionally load_to_db.py against
+# a local PostGIS) is run on them. Each stage runs in a freshly spawned process so its peak RSS
+# is its own and not inherited from earlier stages. Wall time, CPU time, peak RSS and rows per
+# second are written to a JSON file named after the commit, for comparison across commits.
+#
+# Layout under the work directory:
+#   inputs/         generated crashes_<scale>x_<seed>.csv and localities_<scale>x_<seed>.zip,
+#                   reused by later runs with the same scale and seed
+#   run_<scale>x/   outputs of one benchmark run (cleared before each run)
+# =============================================================================
+
+# --- Configuration ---
+DEFAULT_WORK_DIR = ".benchmark"
+DEFAULT_RESULTS_DIR = "benchmark_results"
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_SEED = 0
+
+# --- Statewide Volume at Scale 1 ---
+BASELINE_CRASH_ROWS = 400_000 # Rows in the upstream crash locations CSV (all years, before the cutoff filter)
+BASELINE_LOCALITIES = 3_200 # Features in the Locality_Boundaries shapefile
+BASELINE_LOCALITY_VERTICES = 600 # Average vertices per locality boundary
+
+# --- Synthetic Data Shape ---
+SYNTHETIC_CSV_BLOCK_ROWS = 250_000 # Rows generated and appended to the CSV at a time
+SYNTHETIC_MISSING_COORDINATE_SHARE = 0.002 # Rows with blank longitude/latitude
+SYNTHETIC_OUT_OF_EXTENT_SHARE = 0.0005 # Rows geocoded to (0, 0), as seen upstream
+SYNTHETIC_DUPLICATE_LOCALITY_SHARE = 0.03 # Localities sharing a name with another (exercises disambiguation)
+SYNTHETIC_COUNCILS = 77 # Distinct ADMINAREAN values
+SYNTHETIC_YEARS = (2001, 2024) # Inclusive; years before download_data.CRASHES_CUTOFF_DATE are filtered out
+# Population centres crashes and localities cluster around: (longitude, latitude, spread in degrees, weight)
+SYNTHETIC_CENTRES = [
+    (153.02, -27.47, 0.25, 0.45), # Brisbane
+    (153.40, -28.00, 0.15, 0.12), # Gold Coast
+    (153.07, -26.65, 0.15, 0.08), # Sunshine Coast
+    (146.80, -19.26, 0.15, 0.05), # Townsville
+    (145.77, -16.92, 0.15, 0.05), # Cairns
+    (151.95, -27.56, 0.10, 0.04), # Toowoomba
+    (149.19, -21.14, 0.10, 0.03), # Mackay
+    (150.51, -23.38, 0.10, 0.03), # Rockhampton
+    (144.0, -22.0, 4.0, 0.15), # Statewide background
+]
+# Value vocabularies for the categorical crash columns, with relative weights where it matters
+SYNTHETIC_CATEGORIES = {
+    'Crash_Severity': (['Property damage only', 'Minor injury', 'Medical treatment', 'Hospitalisation', 'Fatal'], [0.25, 0.2, 0.2, 0.33, 0.02]),
+    'Crash_Month': (['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'], None),
+    'Crash_Day_Of_Week': (['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], None),
+    'Crash_Nature': (['Rear-end', 'Angle', 'Hit fixed obstruction/temporary object', 'Sideswipe', 'Overturned', 'Hit pedestrian', 'Head-on', 'Fall from vehicle', 'Other'], None),
+    'Crash_Type': (['Multi-Vehicle', 'Single Vehicle', 'Hit pedestrian', 'Other'], [0.6, 0.3, 0.07, 0.03]),
+    'Crash_Roadway_Feature': (['No Roadway Feature', 'Intersection - T-Junction', 'Intersection - Cross', 'Intersection - Roundabout', 'Bridge/Causeway', 'Median Opening', 'Other'], None),
+    'Crash_Traffic_Control': (['No traffic control', 'Operating traffic lights', 'Give way sign', 'Stop sign', 'Railway - lights and boom gate', 'Other'], None),
+    'Crash_Speed_Limit': (['0 - 50 km/h', '60 km/h', '70 km/h', '80 - 90 km/h', '100 - 110 km/h'], [0.2, 0.4, 0.1, 0.15, 0.15]),
+    'Crash_Road_Surface_Condition': (['Sealed - Dry', 'Sealed - Wet', 'Unsealed - Dry', 'Unsealed - Wet'], [0.8, 0.14, 0.05, 0.01]),
+    'Crash_Atmospheric_Condition': (['Clear', 'Raining', 'Fog', 'Smoke/Dust'], [0.86, 0.12, 0.01, 0.01]),
+    'Crash_Lighting_Condition': (['Daylight', 'Darkness - Lighted', 'Darkness - Not lighted', 'Dawn/Dusk'], [0.7, 0.15, 0.08, 0.07]),
+}
+# Upstream columns download_data.py does not keep; written so CSV parsing costs what it does for real
+SYNTHETIC_EXTRA_TEXT_COLUMNS = [
+    'Crash_Street', 'Crash_Street_Intersecting', 'Loc_Suburb', 'Loc_Local_Government_Area',
+    'Loc_Police_Division', 'Loc_Police_District', 'Loc_Police_Region', 'Loc_ABS_Statistical_Area_2',
+    'Loc_State_Electorate', 'Loc_Federal_Electorate', 'Crash_Controlling_Authority', 'Crash_DCA_Description',
+]
+SYNTHETIC_EXTRA_COUNT_COLUMNS = [
+    'Loc_Post_Code', 'Crash_DCA_Code', 'Count_Casualty_Fatality', 'Count_Casualty_Hospitalised',
+    'Count_Casualty_MedicallyTreated', 'Count_Casualty_MinorInjury', 'Count_Casualty_Total',
+    'Count_Unit_Car', 'Count_Unit_Motorcycle_Moped', 'Count_Unit_Truck', 'Count_Unit_Bus',
+    'Count_Unit_Bicycle', 'Count_Unit_Pedestrian', 'Count_Unit_Other',
+]
+
+
+# =============================================================================
+# Helper Functions: Synthetic Data
+# =============================================================================
+def sample_coordinates(rng, n):
+    """Samples n lon/lat pairs around SYNTHETIC_CENTRES, clipped to download_data.QLD_EXTENT."""
+    lon0, lat0, spread, weight = (np.array(values) for values in zip(*SYNTHETIC_CENTRES))
+    centre = rng.choice(len(SYNTHETIC_CENTRES), size=n, p=weight / weight.sum())
+    min_lon, min_lat, max_lon, max_lat = download_data.QLD_EXTENT
+    lon = np.clip(rng.normal(lon0[centre], spread[centre]), min_lon, max_lon)
+    lat = np.clip(rng.normal(lat0[centre], spread[centre]), min_lat, max_lat)
+    return lon, lat
+
+
+def synthetic_crash_block(rng, first_ref_number, n):
+    """Returns one block of n synthetic rows in the upstream crash locations CSV layout."""
+    data = {'Crash_Ref_Number': np.arange(first_ref_number, first_ref_number + n)}
+    for column, (values, weights) in SYNTHETIC_CATEGORIES.items():
+        p = np.array(weights) / np.sum(weights) if weights else None
+        data[column] = pd.Categorical.from_codes(rng.choice(len(values), size=n, p=p), categories=values)
+    data['Crash_Year'] = rng.integers(SYNTHETIC_YEARS[0], SYNTHETIC_YEARS[1] + 1, size=n)
+    data['Crash_Hour'] = rng.integers(0, 24, size=n)
+
+    lon, lat = sample_coordinates(rng, n)
+    outside = rng.random(n) < SYNTHETIC_OUT_OF_EXTENT_SHARE
+    lon[outside], lat[outside] = 0.0, 0.0
+    missing = rng.random(n) < SYNTHETIC_MISSING_COORDINATE_SHARE
+    lon[missing], lat[missing] = np.nan, np.nan
+    data['Crash_Longitude'], data['Crash_Latitude'] = lon, lat
+
+    labels = np.array([f"Area {i}" for i in range(500)], dtype=object)
+    for column in SYNTHETIC_EXTRA_TEXT_COLUMNS:
+        data[column] = labels[rng.integers(0, len(labels), size=n)]
+    for column in SYNTHETIC_EXTRA_COUNT_COLUMNS:
+        data[column] = rng.integers(0, 5, size=n)
+    return pd.DataFrame(data)
+
+
+def generate_crash_csv(path, rows, seed):
+    """Writes a synthetic crash CSV with rows rows to path, in SYNTHETIC_CSV_BLOCK_ROWS blocks."""
+    log_prefix = "[Benchmark]"
+    rng = np.random.default_rng(seed)
+    tmp_path = path + ".tmp"
+    written = 0
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        while written < rows:
+            n = min(SYNTHETIC_CSV_BLOCK_ROWS, rows - written)
+            synthetic_crash_block(rng, written + 1, n).to_csv(f, header=written == 0, index=False, float_format='%.9f')
+            written += n
+            logging.info(f"{log_prefix} Generated {written}/{rows} crash rows...")
+    os.replace(tmp_path, path)
+
+
+def generate_locality_zip(path, count, vertices, seed):
+    """Writes a zipped synthetic locality shapefile to path.
+
+    Localities are the Voronoi cells of count seed points drawn like crash locations (so they
+    are small where crashes are dense), clipped to download_data.QLD_EXTENT and densified to
+    about vertices vertices each. The archive uses download_data.LOCALITIES_SHAPEFILE_INTERNAL_PATH
+    so process_locality_data reads it unchanged.
+    """
+    log_prefix = "[Benchmark]"
+    rng = np.random.default_rng(seed)
+    lon, lat = sample_coordinates(rng, count)
+    extent = shapely.box(*download_data.QLD_EXTENT)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(np.column_stack([lon, lat])), extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    cells = cells[~shapely.is_empty(cells)]
+    cells = shapely.segmentize(cells, shapely.length(cells) / vertices)
+
+    names = np.array([f"LOCALITY {i}" for i in range(len(cells))], dtype=object)
+    duplicates = rng.random(len(cells)) < SYNTHETIC_DUPLICATE_LOCALITY_SHARE
+    names[duplicates] = names[rng.integers(0, len(cells), size=duplicates.sum())]
+    names[0] = None # Upstream has one unnamed feature (the Gulf of Carpentaria)
+    councils = np.array([f"QUEENSLAND, COUNCIL {i} REGIONAL" for i in range(SYNTHETIC_COUNCILS)], dtype=object)
+    gdf = gpd.GeoDataFrame(
+        {'LOCALITY': names, 'ADMINAREAN': councils[rng.integers(0, SYNTHETIC_COUNCILS, size=len(cells))]},
+        geometry=cells, crs=download_data.CRS_GDA2020,
+    )
+
+    shapefile_dir = os.path.join(os.path.dirname(path), "localities_shp")
+    shutil.rmtree(shapefile_dir, ignore_errors=True)
+    shapefile_path = os.path.join(shapefile_dir, download_data.LOCALITIES_SHAPEFILE_INTERNAL_PATH)
+    os.makedirs(os.path.dirname(shapefile_path))
+    gdf.to_file(shapefile_path, engine='pyogrio')
+    tmp_path = path + ".tmp"
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for root, _, files in os.walk(shapefile_dir):
+            for name in files:
+                member = os.path.join(root, name)
+                archive.write(member, os.path.relpath(member, shapefile_dir))
+    shutil.rmtree(shapefile_dir)
+    os.replace(tmp_path, path)
+    logging.info(f"{log_prefix} Generated {len(gdf)} localities (~{vertices} vertices each): {path}")
+    return len(gdf)
+
+
+def prepare_inputs(inputs_dir, scale, seed):
+    """Generates (or reuses) the synthetic inputs for one scale.
+
+    Returns {'crashes_csv', 'localities_zip', 'crash_rows', 'localities', 'generation_seconds'}.
+    """
+    os.makedirs(inputs_dir, exist_ok=True)
+    stem = f"{scale:g}x_{seed}"
+    csv_path = os.path.abspath(os.path.join(inputs_dir, f"crashes_{stem}.csv"))
+    zip_path = os.path.abspath(os.path.join(inputs_dir, f"localities_{stem}.zip"))
+    crash_rows = int(round(BASELINE_CRASH_ROWS * scale))
+    start_time = time.perf_counter()
+    if not os.path.exists(csv_path):
+        generate_crash_csv(csv_path, crash_rows, seed)
+    if not os.path.exists(zip_path):
+        generate_locality_zip(zip_path, max(int(round(BASELINE_LOCALITIES * scale)), 2), BASELINE_LOCALITY_VERTICES, seed)
+    return {
+        'crashes_csv': csv_path,
+        'localities_zip': zip_path,
+        'crash_rows': crash_rows,
+        'localities': pyogrio.read_info(f"/vsizip/{zip_path}/{download_data.LOCALITIES_SHAPEFILE_INTERNAL_PATH}")['features'],
+        'generation_seconds': round(time.perf_counter() - start_time, 3),
+    }
+
+
+# =============================================================================
+# Helper Functions: Running One Stage in Its Own Process
+# =============================================================================
+def peak_rss_bytes():
+    """Returns this process's peak resident set size in bytes (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_table(file_name, table_name, method, input_format):
+    """Loads one processed file into PostGIS the way load_to_db.main does; returns success."""
+    engine = load_to_db.create_db_engine()
+    load_to_db.load_file_into_table(engine, load_to_db.LOADERS[method], geo_files.with_format(file_name, input_format), table_name)
+    if table_name == load_to_db.INCREMENTAL_TABLE:
+        load_to_db.build_crash_rollup(engine)
+    return True
+
+
+def run_stage(run_dir, func, kwargs, db_url=None):
+    """Runs func(**kwargs) inside run_dir and returns its measurements.
+
+    Meant to be the only task of a freshly spawned worker, so peak_rss_bytes covers this stage
+    alone; baseline_rss_bytes is the peak after imports, before func starts.
+    """
+    os.chdir(run_dir)
+    if db_url:
+        load_to_db.db_url = db_url
+    baseline_rss = peak_rss_bytes()
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    try:
+        success = bool(func(**kwargs))
+    except BaseException as e: # create_db_engine exits via sys.exit on connection failures
+        logging.error(f"[Benchmark] Stage raised {type(e).__name__}: {e}")
+        success = False
+    return {
+        'success': success,
+        'wall_seconds': round(time.perf_counter() - start_time, 3),
+        'cpu_seconds': round(time.process_time() - cpu_start, 3),
+        'baseline_rss_bytes': baseline_rss,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def run_stage_in_process(run_dir, func, kwargs, db_url=None):
+    """Runs run_stage in a new spawned process; a worker that dies counts as a failed stage."""
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        try:
+            return executor.submit(run_stage, run_dir, func, kwargs, db_url).result()
+        except Exception as e:
+            logging.error(f"[Benchmark] Stage worker failed: {e}")
+            return {'success': False}
+
+
+# =============================================================================
+# Main Function: Benchmark One Scale
+# =============================================================================
+def stage_plan(inputs, args):
+    """Returns [(stage name, func, kwargs, rows processed)] in pipeline order for one scale."""
+    crash_file = geo_files.with_format(download_data.CRASHES_OUTPUT_FILENAME, args.format)
+    locality_file = geo_files.with_format(download_data.LOCALITIES_OUTPUT_FILENAME, args.format)
+    stages = [
+        ('localities', download_data.process_locality_data, {'zip_path': inputs['localities_zip'], 'output_format': args.format}, lambda: inputs['localities']),
+        ('crashes', download_data.process_crash_data, {'chunk_size': args.chunk_size, 'csv_source': inputs['crashes_csv'], 'output_format': args.format}, lambda: inputs['crash_rows']),
+        ('geometry_validation', download_data.validate_locality_geometries, {'output_format': args.format, 'workers': args.jobs}, lambda: geo_files.read_info(locality_file)['features']),
+        ('crash_localities', download_data.assign_crash_localities, {'batch_size': args.chunk_size, 'output_format': args.format}, lambda: geo_files.read_info(crash_file)['features']),
+        ('crash_changes', download_data.diff_crash_snapshot, {'batch_size': args.chunk_size, 'output_format': args.format}, lambda: geo_files.read_info(crash_file)['features']),
+        ('crash_heatmaps', download_data.build_crash_heatmaps, {'batch_size': args.chunk_size, 'output_format': args.format}, lambda: geo_files.read_info(crash_file)['features']),
+    ]
+    if not args.skip_tiles:
+        stages.append(('vector_tiles', download_data.build_vector_tiles, {'batch_size': args.chunk_size, 'output_format': args.format}, lambda: geo_files.read_info(crash_file)['features']))
+    if args.db_url:
+        for file_name, table_name in load_to_db.FILES_TO_LOAD:
+            kwargs = {'file_name': file_name, 'table_name': table_name, 'method': args.load_method, 'input_format': args.format}
+            path = geo_files.with_format(file_name, args.format)
+            stages.append((f"load_{table_name}", load_table, kwargs, lambda path=path: geo_files.read_info(path)['features']))
+    return stages
+
+
+def benchmark_scale(scale, args):
+    """Generates inputs for one scale, runs every stage on them and returns the run's results."""
+    log_prefix = "[Benchmark]"
+    inputs = prepare_inputs(os.path.join(args.work_dir, 'inputs'), scale, args.seed)
+    run_dir = os.path.abspath(os.path.join(args.work_dir, f"run_{scale:g}x"))
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+
+    stages = {}
+    for name, func, kwargs, count_rows in stage_plan(inputs, args):
+        logging.info(f"{log_prefix} [{scale:g}x] Running stage '{name}'...")
+        result = run_stage_in_process(run_dir, func, kwargs, args.db_url)
+        if result['success']:
+            cwd = os.getcwd()
+            os.chdir(run_dir)
+            try:
+                result['rows'] = int(count_rows())
+            finally:
+                os.chdir(cwd)
+            result['rows_per_second'] = round(result['rows'] / max(result['wall_seconds'], 1e-9), 1)
+            logging.info(
+                f"{log_prefix} [{scale:g}x] '{name}': {result['wall_seconds']:.1f}s, "
+                f"peak RSS {result['peak_rss_bytes'] / 1_048_576:.0f} MiB, {result['rows_per_second']:.0f} rows/s."
+            )
+        stages[name] = result
+        if not result['success']:
+            logging.error(f"{log_prefix} [{scale:g}x] Stage '{name}' failed; skipping the stages after it.")
+            break
+
+    if not args.keep_outputs:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return {
+        'scale': scale,
+        'crash_rows': inputs['crash_rows'],
+        'localities': inputs['localities'],
+        'generation_seconds': inputs['generation_seconds'],
+        'stages': stages,
+    }
+
+
+# =============================================================================
+# Helper Functions: Results Files
+# =============================================================================
+def git_revision():
+    """Returns (commit, dirty) for the working tree, or (None, None) outside a git checkout."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment_info():
+    """Describes the machine and library versions the benchmark ran with."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+        'geopandas': gpd.__version__,
+        'shapely': shapely.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def compare_results(baseline_path, candidate_path):
+    """Logs per-stage wall time and peak RSS of candidate relative to baseline."""
+    log_prefix = "[Benchmark]"
+    baseline = download_cache.read_json(baseline_path, {})
+    candidate = download_cache.read_json(candidate_path, {})
+    logging.info(f"{log_prefix} {str(baseline.get('commit'))[:12]} -> {str(candidate.get('commit'))[:12]}")
+    baseline_runs = {run['scale']: run for run in baseline.get('runs', [])}
+    for run in candidate.get('runs', []):
+        old_run = baseline_runs.get(run['scale'])
+        if old_run is None:
+            continue
+        for name, result in run['stages'].items():
+            old = old_run['stages'].get(name)
+            if not (old and old.get('success') and result.get('success')):
+                continue
+            logging.info(
+                f"{log_prefix} [{run['scale']:g}x] {name:<24} "
+                f"wall {old['wall_seconds']:8.1f}s -> {result['wall_seconds']:8.1f}s ({result['wall_seconds'] / max(old['wall_seconds'], 1e-9):5.2f}x)  "
+                f"peak RSS {old['peak_rss_bytes'] / 1_048_576:6.0f} -> {result['peak_rss_bytes'] / 1_048_576:6.0f} MiB"
+            )
+
+
+# =============================================================================
+# Main Execution
+# =============================================================================
+def parse_args(argv=None):
+    """Parses command-line options for the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark download_data.py and load_to_db.py stages on synthetic data.")
+    parser.add_argument(
+        '--scales', type=float, nargs='+', default=DEFAULT_SCALES,
+        help=f"Multiples of the statewide volume ({BASELINE_CRASH_ROWS} crashes, {BASELINE_LOCALITIES} localities) to run (default: {DEFAULT_SCALES})",
+    )
+    parser.add_argument(
+        '--format', choices=sorted(geo_files.FORMAT_EXTENSIONS), default=geo_files.DEFAULT_FORMAT,
+        help=f"Intermediate file format passed to every stage (default: {geo_files.DEFAULT_FORMAT})",
+    )
+    parser.add_argument(
+        '--chunk-size', type=int, default=download_data.CRASHES_CSV_CHUNK_SIZE,
+        help=f"Rows per crash CSV chunk and post-processing batch (default: {download_data.CRASHES_CSV_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=download_data.DEFAULT_JOBS,
+        help=f"Threads for geometry validation (default: {download_data.DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        '--skip-tiles', action='store_true',
+        help="Do not benchmark the vector tile stage",
+    )
+    parser.add_argument(
+        '--db-url',
+        help="SQLAlchemy URL of a local PostGIS database to benchmark load_to_db.py against; its tables are replaced (default: skip the load stages)",
+    )
+    parser.add_argument(
+        '--load-method', choices=sorted(load_to_db.LOADERS), default=load_to_db.LOAD_METHOD,
+        help=f"Loader used for the load stages (default: {load_to_db.LOAD_METHOD})",
+    )
+    parser.add_argument(
+        '--seed', type=int, default=DEFAULT_SEED,
+        help=f"Random seed for the synthetic data; keep it fixed when comparing commits (default: {DEFAULT_SEED})",
+    )
+    parser.add_argument(
+        '--work-dir', default=DEFAULT_WORK_DIR,
+        help=f"Directory for generated inputs and stage outputs (default: {DEFAULT_WORK_DIR})",
+    )
+    parser.add_argument(
+        '--results-dir', default=DEFAULT_RESULTS_DIR,
+        help=f"Directory the JSON results file is written to (default: {DEFAULT_RESULTS_DIR})",
+    )
+    parser.add_argument(
+        '--keep-outputs', action='store_true',
+        help="Keep each run's output files in the work directory",
+    )
+    parser.add_argument(
+        '--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+        help="Compare two results files instead of running the benchmark",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Runs the benchmark at every requested scale and writes the results to JSON."""
+    args = parse_args(argv)
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    commit, dirty = git_revision()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment_info(),
+        'settings': {
+            'format': args.format, 'chunk_size': args.chunk_size, 'jobs': args.jobs, 'seed': args.seed,
+            'skip_tiles': args.skip_tiles, 'load_method': args.load_method if args.db_url else None,
+        },
+        'runs': [],
+    }
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, f"{time.strftime('%Y%m%dT%H%M%S')}_{(commit or 'nogit')[:12]}.json")
+    for scale in args.scales:
+        logging.info(f"===== Benchmarking scale {scale:g}x =====")
+        results['runs'].append(benchmark_scale(scale, args))
+        download_cache.write_json(results_path, results) # Keep finished scales if a later one runs out of memory
+    logging.info(f"[Benchmark] Results written to {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import numpy as np
+
+import vector_tiles
+
+# =============================================================================
+# Hexagonal density grids for crash heatmaps.
+#
+# Points are binned into pointy-top hexagons laid out in Web Mercator metres (the projection
+# the map is drawn in, so cells look regular on screen) and addressed by axial coordinates
+# (q, r). Cell lookup and centre computation are closed-form NumPy expressions, so binning
+# costs a few array passes per batch and no spatial index.
+#
+# Counts are accumulated per (q, r, group) where group is any small non-negative integer code
+# (e.g. month x severity). The triple is packed into one int64 key so a batch is reduced with
+# a single np.unique, and batches are merged by reducing their keys again.
+# =============================================================================
+
+# --- Configuration ---
+KEY_COORDINATE_BITS = 21 # Bits per axial coordinate in a packed key (|q|, |r| < 2**20)
+KEY_GROUP_BITS = 21 # Bits for the group code in a packed key
+KEY_COORDINATE_OFFSET = 1 << (KEY_COORDINATE_BITS - 1)
+SQRT3 = np.sqrt(3.0)
+
+
+# =============================================================================
+# Helper Functions: Projection
+# =============================================================================
+def web_mercator(lon, lat):
+    """Projects lon/lat degrees to EPSG:3857 metres (latitude clipped to the projection's limit)."""
+    lat = np.clip(lat, -vector_tiles.WEB_MERCATOR_MAX_LATITUDE, vector_tiles.WEB_MERCATOR_MAX_LATITUDE)
+    x = vector_tiles.WEB_MERCATOR_RADIUS * np.radians(lon)
+    y = vector_tiles.WEB_MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+
+def inverse_web_mercator(x, y):
+    """Converts EPSG:3857 metres back to lon/lat degrees."""
+    lon = np.degrees(x / vector_tiles.WEB_MERCATOR_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(y / vector_tiles.WEB_MERCATOR_RADIUS)) - np.pi / 2)
+    return lon, lat
+
+
+# =============================================================================
+# Helper Functions: Hexagon Addressing
+# =============================================================================
+def hex_cells(x, y, size):
+    """Returns the axial (q, r) int64 coordinates of the pointy-top hexagons containing x/y.
+
+    size is the hexagon circumradius (centre to corner) in the units of x/y. Fractional axial
+    coordinates are rounded through cube coordinates, which picks the nearest hexagon centre.
+    """
+    qf = (SQRT3 / 3 * x - y / 3) / size
+    rf = (2 / 3 * y) / size
+    sf = -qf - rf
+    q, r, s = np.rint(qf), np.rint(rf), np.rint(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def hex_centres(q, r, size):
+    """Returns the x/y centres of axial hexagons (q, r) of circumradius size."""
+    x = size * SQRT3 * (q + r / 2)
+    y = size * 1.5 * r
+    return x, y
+
+
+# =============================================================================
+# Helper Functions: Packed Cell Keys
+# =============================================================================
+def pack_keys(q, r, group):
+    """Packs axial coordinates and a group code into one int64 key per point."""
+    if len(group) and (group.min() < 0 or group.max() >= 1 << KEY_GROUP_BITS):
+        raise ValueError(f"Group codes must be in [0, {1 << KEY_GROUP_BITS}).")
+    return (
+        ((q + KEY_COORDINATE_OFFSET) << (KEY_COORDINATE_BITS + KEY_GROUP_BITS))
+        | ((r + KEY_COORDINATE_OFFSET) << KEY_GROUP_BITS)
+        | group
+    )
+
+
+def unpack_keys(keys):
+    """Splits packed keys back into (q, r, group) int64 arrays."""
+    coordinate_mask = (1 << KEY_COORDINATE_BITS) - 1
+    q = ((keys >> (KEY_COORDINATE_BITS + KEY_GROUP_BITS)) & coordinate_mask) - KEY_COORDINATE_OFFSET
+    r = ((keys >> KEY_GROUP_BITS) & coordinate_mask) - KEY_COORDINATE_OFFSET
+    group = keys & ((1 << KEY_GROUP_BITS) - 1)
+    return q, r, group
+
+
+def merge_counts(keys, counts):
+    """Sums counts that share a key; returns (sorted unique keys, int64 counts)."""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64)
+
+
+# =============================================================================
+# Main Function: Bin One Batch of Points
+# =============================================================================
+def hexbin_counts(lon, lat, group, size):
+    """Counts points per (hexagon, group) for hexagons of circumradius size Web Mercator metres.
+
+    group holds one non-negative integer code per point. Returns (keys, counts) with one entry
+    per non-empty (hexagon, group); combine batches with merge_counts and decode with
+    unpack_keys.
+    """
+    x, y = web_mercator(lon, lat)
+    q, r = hex_cells(x, y, size)
+    keys, counts = np.unique(pack_keys(q, r, np.asarray(group, dtype=np.int64)), return_counts=True)
+    return keys, counts.astype(np.int64)
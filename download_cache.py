@@ -0,0 +1,228 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    import fcntl
+except ImportError: # Windows has no flock; index updates from parallel fetches are then not serialized
+    fcntl = None
+
+# =============================================================================
+# Local content-addressed cache for upstream downloads.
+#
+# Layout under the cache directory:
+#   objects/<sha256><ext> raw artifacts, named by the SHA-256 of their content and
+#                         the URL's file extension (GDAL needs it to open e.g. .zip)
+#   partial/<key>.part    interrupted transfers, resumed with HTTP Range
+#   partial/<key>.json    validators (ETag/Last-Modified) the partial was fetched under
+#   index.json            url -> {sha256, filename, etag, last_modified, size}
+#   index.lock            held while a fetch publishes its object and updates the index, so
+#                         fetches of different URLs can run in parallel processes
+#   last_run.json         dataset -> sha256 of the inputs of the last successful run
+# =============================================================================
+
+# --- Configuration ---
+DEFAULT_CACHE_DIR = ".download_cache"
+DOWNLOAD_BLOCK_SIZE = 1_048_576 # Bytes per streamed block written to disk
+DOWNLOAD_PROGRESS_LOG_BYTES = 25 * 1_048_576 # Log download progress every N bytes
+INDEX_FILENAME = "index.json"
+RUN_STATE_FILENAME = "last_run.json"
+INDEX_LOCK_FILENAME = "index.lock"
+
+
+# =============================================================================
+# Helper Function: Write a Streamed Response to an Open File
+# =============================================================================
+def write_response_to_file(response, target, log_prefix, hasher=None, bytes_already=0):
+    """Writes a streamed requests response to target in DOWNLOAD_BLOCK_SIZE blocks.
+
+    Logs progress every DOWNLOAD_PROGRESS_LOG_BYTES and throughput at the end. If hasher is
+    given it is updated with every block. bytes_already is the size of any resumed prefix.
+    Returns the number of bytes written by this call.
+    """
+    start_time = time.perf_counter()
+    bytes_written = 0
+    content_length = int(response.headers.get('Content-Length') or 0)
+    total_bytes = bytes_already + content_length if content_length else 0
+    next_progress_log = bytes_already + DOWNLOAD_PROGRESS_LOG_BYTES
+
+    for block in response.iter_content(chunk_size=DOWNLOAD_BLOCK_SIZE):
+        target.write(block)
+        if hasher is not None:
+            hasher.update(block)
+        bytes_written += len(block)
+        if bytes_already + bytes_written >= next_progress_log:
+            total_msg = f" of {total_bytes / 1_048_576:.1f} MiB" if total_bytes else ""
+            logging.info(f"{log_prefix} Downloaded {(bytes_already + bytes_written) / 1_048_576:.1f} MiB{total_msg}...")
+            next_progress_log += DOWNLOAD_PROGRESS_LOG_BYTES
+
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    logging.info(
+        f"{log_prefix} Downloaded {bytes_written / 1_048_576:.1f} MiB in {elapsed:.1f}s "
+        f"({bytes_written / 1_048_576 / elapsed:.2f} MiB/s)."
+    )
+    return bytes_written
+
+
+# =============================================================================
+# Helper Functions: JSON State Files
+# =============================================================================
+def read_json(path, default):
+    """Reads a JSON file, returning default if it is missing or unreadable."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logging.warning(f"[Cache] Ignoring unreadable state file {path}: {e}")
+        return default
+
+
+def write_json(path, data):
+    """Atomically writes data as JSON to path."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def index_lock(cache_dir):
+    """Holds an exclusive lock on the cache index for the with-block (a no-op without fcntl)."""
+    with open(os.path.join(cache_dir, INDEX_LOCK_FILENAME), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_run_state(cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the {dataset: sha256} mapping recorded by the last successful run."""
+    return read_json(os.path.join(cache_dir, RUN_STATE_FILENAME), {})
+
+
+def save_run_state(state, cache_dir=DEFAULT_CACHE_DIR):
+    """Records the {dataset: sha256} mapping of a successful run."""
+    os.makedirs(cache_dir, exist_ok=True)
+    write_json(os.path.join(cache_dir, RUN_STATE_FILENAME), state)
+
+
+def cached_sha256(url, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the sha256 of the copy of url currently in the cache, or None if there is none."""
+    entry = read_json(os.path.join(cache_dir, INDEX_FILENAME), {}).get(url)
+    return entry['sha256'] if entry else None
+
+
+# =============================================================================
+# Main Function: Fetch a URL Through the Cache
+# =============================================================================
+def fetch(url, cache_dir=DEFAULT_CACHE_DIR, log_prefix="[Cache]"):
+    """Returns (path, sha256, changed) for url, downloading only what is needed.
+
+    A cached copy is revalidated with If-None-Match/If-Modified-Since; a 304 reuses it without
+    transferring the body. An interrupted transfer left in partial/ is resumed with Range and
+    If-Range, so a changed upstream file restarts from scratch instead of being spliced.
+    changed is False when the returned content is identical to the previously cached copy.
+    """
+    objects_dir = os.path.join(cache_dir, 'objects')
+    partial_dir = os.path.join(cache_dir, 'partial')
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(partial_dir, exist_ok=True)
+
+    index_path = os.path.join(cache_dir, INDEX_FILENAME)
+    index = read_json(index_path, {})
+    entry = index.get(url)
+    cached_path = os.path.join(objects_dir, entry['filename']) if entry else None
+    if cached_path and not os.path.exists(cached_path):
+        logging.warning(f"{log_prefix} Cached object for {url} is missing; downloading again.")
+        entry, cached_path = None, None
+
+    url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    part_path = os.path.join(partial_dir, url_key + '.part')
+    part_meta_path = os.path.join(partial_dir, url_key + '.json')
+    part_meta = read_json(part_meta_path, {}) if os.path.exists(part_path) else {}
+    resume_from = os.path.getsize(part_path) if part_meta else 0
+    resume_validator = part_meta.get('etag') or part_meta.get('last_modified')
+
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    if resume_from and resume_validator:
+        headers['Range'] = f"bytes={resume_from}-"
+        headers['If-Range'] = resume_validator
+    else:
+        resume_from = 0
+
+    try:
+        with requests.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and entry:
+                logging.info(f"{log_prefix} Upstream unchanged (304); using cached copy {entry['sha256'][:12]}.")
+                return cached_path, entry['sha256'], False
+            if response.status_code == 416:
+                # Our partial no longer lines up with upstream; discard it and start over.
+                logging.info(f"{log_prefix} Stored partial download rejected (416); restarting.")
+                os.remove(part_path)
+                return fetch(url, cache_dir=cache_dir, log_prefix=log_prefix)
+            response.raise_for_status()
+
+            hasher = hashlib.sha256()
+            if response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f"bytes {resume_from}-"):
+                logging.info(f"{log_prefix} Resuming interrupted download at {resume_from / 1_048_576:.1f} MiB.")
+                with open(part_path, 'rb') as existing:
+                    for block in iter(lambda: existing.read(DOWNLOAD_BLOCK_SIZE), b''):
+                        hasher.update(block)
+                mode = 'ab'
+            else:
+                resume_from = 0
+                mode = 'wb'
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            write_json(part_meta_path, {'etag': etag, 'last_modified': last_modified})
+            with open(part_path, mode) as target:
+                write_response_to_file(response, target, log_prefix, hasher=hasher, bytes_already=resume_from)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"{log_prefix} Failed to download {url}: {e}")
+        raise
+
+    sha256 = hasher.hexdigest()
+    object_filename = sha256 + os.path.splitext(urlparse(url).path)[1]
+    object_path = os.path.join(objects_dir, object_filename)
+    previous_sha = entry['sha256'] if entry else None
+    with index_lock(cache_dir):
+        # Re-read the index: another process may have published a different URL meanwhile.
+        index = read_json(index_path, {})
+        os.replace(part_path, object_path)
+        os.remove(part_meta_path)
+        index[url] = {
+            'sha256': sha256,
+            'filename': object_filename,
+            'etag': etag,
+            'last_modified': last_modified,
+            'size': os.path.getsize(object_path),
+        }
+        write_json(index_path, index)
+
+        # Drop objects no URL refers to any more so the cache does not grow without bound.
+        referenced = {item['filename'] for item in index.values()}
+        for name in os.listdir(objects_dir):
+            if name not in referenced:
+                os.remove(os.path.join(objects_dir, name))
+
+    changed = sha256 != previous_sha
+    if not changed:
+        logging.info(f"{log_prefix} Downloaded content matches cached copy {sha256[:12]}.")
+    return object_path, sha256, changed
@@ -1,13 +1,24 @@
-import io
+import argparse
+import concurrent.futures
+import contextlib
 import logging
 import os
 import shutil
 import tempfile
+import time
 import zipfile
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import requests
+import shapely
+
+import crash_grids
+import download_cache
+import geo_files
+import run_metrics
+import vector_tiles
 
 # --- Shared Configuration ---
 CRS_GDA2020 = "EPSG:7844"
@@ -19,6 +30,13 @@ LOCALITIES_SHAPEFILE_INTERNAL_PATH = "QSC_Extracted_Data_20250420_220514325118-9
 LOCALITIES_OUTPUT_FILENAME = "qld_localities_cleaned.gpkg"
 # Define required columns AFTER cleaning but BEFORE final selection/lowercasing
 LOCALITIES_CLEANED_COLS = ['locality', 'geometry'] # Use 'geometry' here as it's the standard name before rename
+LOCALITIES_SIMPLIFIED_OUTPUT_FILENAME = "qld_localities_simplified.gpkg"
+# Levels of detail for map display: (detail name, simplification tolerance, coordinate grid size), in degrees
+LOCALITIES_SIMPLIFIED_LEVELS = [
+    ('low', 0.01, 0.001), # ~1 km; statewide views
+    ('medium', 0.001, 0.0001), # ~100 m; regional views
+    ('high', 0.0001, 0.00001), # ~10 m; suburb views
+]
 
 # --- Crashes Configuration ---
 CRASHES_CSV_URL = "https://www.data.qld.gov.au/dataset/f3e0ca94-2d7b-44ee-abef-d6b06e9b0729/resource/e88943c0-5968-4972-a15f-38e120d72ec0/download/_1_crash_locations.csv"
@@ -30,6 +48,64 @@ CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE = [ # Keep original case for initial selec
     'Crash_Atmospheric_Condition', 'Crash_Lighting_Condition'
 ]
 CRASHES_OUTPUT_FILENAME = "qld_crashes_processed.gpkg"
+CRASHES_CSV_CHUNK_SIZE = 200_000 # Rows per streamed CSV chunk (0 reads the whole file at once)
+# Compact dtypes for the kept columns; low-cardinality text becomes categorical
+CRASHES_CSV_DTYPES = {
+    'Crash_Ref_Number': 'Int64',
+    'Crash_Severity': 'category',
+    'Crash_Year': 'Int16',
+    'Crash_Month': 'category',
+    'Crash_Day_Of_Week': 'category',
+    'Crash_Hour': 'Int8',
+    'Crash_Nature': 'category',
+    'Crash_Type': 'category',
+    'Crash_Longitude': 'float64',
+    'Crash_Latitude': 'float64',
+    'Crash_Roadway_Feature': 'category',
+    'Crash_Traffic_Control': 'category',
+    'Crash_Speed_Limit': 'category',
+    'Crash_Road_Surface_Condition': 'category',
+    'Crash_Atmospheric_Condition': 'category',
+    'Crash_Lighting_Condition': 'category',
+}
+CRASHES_CUTOFF_DATE = '2011-01-01'
+
+# --- Incremental Crash Refresh Configuration (consumed by load_to_db.py --incremental) ---
+CRASHES_KEY_COLUMN = 'crash_ref_number'
+CRASHES_CHANGES_FILENAME = "qld_crashes_changes.gpkg" # Inserted and updated rows since the snapshot
+CRASHES_DELETED_FILENAME = "qld_crashes_deleted.csv" # Keys present in the snapshot but no longer upstream
+CRASHES_FINGERPRINTS_FILENAME = "qld_crashes_fingerprints.npz" # Fingerprints of the current processed file
+CRASHES_SNAPSHOT_FILENAME = "qld_crashes_snapshot.npz" # Fingerprints of what was last loaded (kept by load_to_db.py)
+
+# --- Geometry Validation & Quality Report Configuration ---
+QLD_EXTENT = (137.5, -29.5, 154.0, -9.0) # lon/lat box around Queensland incl. Torres Strait; crashes outside it follow CRASHES_OUT_OF_STATE_POLICY
+CRASHES_STATE_TOLERANCE = 0.001 # Degrees (~100 m); unmatched crashes this close to a locality are boundary cases, not out of state
+CRASHES_OUT_OF_STATE_POLICY = 'flag' # 'flag' keeps crashes outside every locality (locality NULL); 'drop' removes them
+LOCALITY_OVERLAP_MIN_AREA = 1e-10 # Square degrees (~1 m²); smaller overlaps between neighbours are floating-point slivers
+QUALITY_REPORT_FILENAME = "qld_quality_report.json"
+QUALITY_REPORT_SAMPLE_SIZE = 20 # Example identifiers listed per issue in the report
+
+# --- Heatmap Grid Configuration (loaded into the 'crash_heatmap' table by load_to_db.py) ---
+HEATMAP_OUTPUT_FILENAME = "qld_crash_heatmap.gpkg" # Crash counts per hexagon x month x severity
+# Hexagon circumradius per resolution, in Web Mercator metres; mirrors heatmapCellSizeForZoom in backend/src/QueryUtils.ts
+HEATMAP_CELL_SIZES = [16_000, 4_000, 1_000]
+HEATMAP_SEVERITY_SLOTS = 16 # Upper bound on distinct severity values; group code = month * slots + severity
+
+# --- Vector Tile Configuration ---
+TILES_OUTPUT_FILENAME = "qld_crash_tiles.mbtiles" # Static MBTiles with 'crash_clusters', 'crashes' and 'localities' layers
+TILES_MAX_ZOOM = 14
+TILES_CLUSTER_MAX_ZOOM = 10 # Crashes are grid-clustered up to this zoom and drawn individually above it
+TILES_CLUSTER_CELLS_PER_TILE = 32 # Cluster grid cells along each tile edge (8 px cells on a 256 px tile)
+TILES_POINT_COLUMNS = ['crash_ref_number', 'crash_severity', 'crash_year', 'crash_month']
+# Locality outlines are tiled as boundary lines (interior tiles stay empty) and stop at this zoom;
+# clients overzoom the finest level above it instead of fetching a tile per z13/z14 cell.
+TILES_LOCALITY_MAX_ZOOM = 12
+# Zoom range tiled from each simplified locality level (detailForZoom in backend/src/QueryUtils.ts
+# picks medium up to z12; here 'high' is used for the last tiled zoom, which clients overzoom)
+TILES_LOCALITY_ZOOMS = {'low': (0, 8), 'medium': (9, TILES_LOCALITY_MAX_ZOOM - 1), 'high': (TILES_LOCALITY_MAX_ZOOM, TILES_LOCALITY_MAX_ZOOM)}
+
+# --- Orchestration Configuration ---
+DEFAULT_JOBS = 2 # Worker processes for the locality and crash pipelines (also threads for geometry validation)
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -60,122 +136,198 @@ def lowercase_columns(gdf, geom_col_name):
 
 
 # =============================================================================
-# Helper Function for Localities Data: Download & Extract (Unchanged)
+# Helper Function: Data Quality Report
 # =============================================================================
-def download_and_extract_shapefile(zip_url, internal_shp_path, temp_dir):
-    """Downloads a zip file and extracts shapefile components to a temp directory."""
-    log_prefix = "[Localities]"
-    logging.info(f"{log_prefix} Downloading ZIP...")
+def update_quality_report(section, data):
+    """Replaces one section of QUALITY_REPORT_FILENAME (JSON), stamped with the time it was written.
+
+    Each section has a single writer, and the parallel pipelines write different sections at
+    different times (crashes during ingest, the rest in serial post-processing).
+    """
+    report = download_cache.read_json(QUALITY_REPORT_FILENAME, {})
+    report[section] = {'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), **data}
+    download_cache.write_json(QUALITY_REPORT_FILENAME, report)
+
+
+# =============================================================================
+# Helper Function: Stream a Download to Disk
+# =============================================================================
+def download_to_file(url, dest_path, log_prefix):
+    """Streams a URL to dest_path in fixed-size blocks, logging progress and throughput.
+
+    Returns the number of bytes written. Memory use is bounded by the block size.
+    """
     try:
-        response = requests.get(zip_url, stream=True)
-        response.raise_for_status()
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(dest_path, 'wb') as target:
+                return download_cache.write_response_to_file(response, target, log_prefix)
     except requests.exceptions.RequestException as e:
-        logging.error(f"{log_prefix} Failed to download ZIP file: {e}")
+        logging.error(f"{log_prefix} Failed to download {url}: {e}")
         raise
 
-    logging.info(f"{log_prefix} Extracting shapefile components...")
-    shapefile_basename = os.path.splitext(os.path.basename(internal_shp_path))[0]
-    zip_internal_dir = os.path.dirname(internal_shp_path)
-    extracted_shp_path = None
-    extracted_files_count = 0
 
+# =============================================================================
+# Helper Function for Localities Data: Download & Locate Shapefile in ZIP
+# =============================================================================
+def download_and_extract_shapefile(zip_url, internal_shp_path, temp_dir):
+    """Downloads a zip file to temp_dir and returns a GDAL /vsizip/ path to the shapefile inside it.
+
+    The shapefile is read in place from the on-disk archive, so nothing is extracted or held in memory.
+    """
+    log_prefix = "[Localities]"
+    logging.info(f"{log_prefix} Downloading ZIP...")
+    zip_path = os.path.join(temp_dir, os.path.basename(internal_shp_path) + ".zip")
+    download_to_file(zip_url, zip_path, log_prefix)
+    return locate_shapefile_in_zip(zip_path, internal_shp_path)
+
+
+def locate_shapefile_in_zip(zip_path, internal_shp_path):
+    """Checks a local zip file for the shapefile and its companions and returns its /vsizip/ path."""
+    log_prefix = "[Localities]"
+    logging.info(f"{log_prefix} Locating shapefile components in archive...")
+    shapefile_stem = os.path.splitext(internal_shp_path)[0]
     try:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_ref:
-            for member in zip_ref.namelist():
-                # Adjusted path joining for robustness
-                member_parts = member.split('/')
-                if len(member_parts) > 1 and member_parts[0] == os.path.basename(zip_internal_dir) and \
-                   os.path.splitext(os.path.basename(member))[0] == shapefile_basename:
-
-                    target_filename = os.path.basename(member)
-                    target_path = os.path.join(temp_dir, target_filename)
-
-                    # Ensure subdirectories are created if they exist in the zip path
-                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
-
-                    with zip_ref.open(member) as source, open(target_path, "wb") as target:
-                        shutil.copyfileobj(source, target)
-                    extracted_files_count += 1
-                    if member.lower().endswith(".shp"):
-                        extracted_shp_path = target_path
-            if not extracted_shp_path:
-                raise FileNotFoundError(f"'{shapefile_basename}.shp' not found within '{zip_internal_dir}' in the zip file.")
-
-            for ext in ['.dbf', '.shx', '.prj']:
-                companion_path = os.path.splitext(extracted_shp_path)[0] + ext
-                if not os.path.exists(companion_path):
-                    logging.warning(f"{log_prefix} Companion file {ext} not found for shapefile at {companion_path}")
-        return extracted_shp_path
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            members = set(zip_ref.namelist())
     except zipfile.BadZipFile:
         logging.error(f"{log_prefix} Downloaded file is not a valid ZIP archive.")
         raise
-    except Exception as e:
-        logging.error(f"{log_prefix} An error occurred during extraction: {e}")
-        raise
+
+    if internal_shp_path not in members:
+        raise FileNotFoundError(f"'{internal_shp_path}' not found in the zip file.")
+    for ext in ['.dbf', '.shx', '.prj']:
+        if shapefile_stem + ext not in members:
+            logging.warning(f"{log_prefix} Companion file {ext} not found for shapefile at {shapefile_stem + ext}")
+
+    return f"/vsizip/{os.path.abspath(zip_path)}/{internal_shp_path}"
 
 
 # =============================================================================
-# Helper Function for Localities Data: Clean Attributes (Unchanged)
+# Helper Functions for Localities Data: Clean Attributes
 # =============================================================================
+def map_distinct(values, transform):
+    """Applies a vectorised string transform once per distinct value of a Series.
+
+    Returns an object array aligned with values. Because the transform is elementwise, the
+    result is identical to transform(values), but it costs one evaluation per distinct value.
+    """
+    codes, uniques = pd.factorize(values)
+    return transform(pd.Series(uniques, dtype=values.dtype)).to_numpy(dtype=object)[codes]
+
+
 def clean_locality_attributes(gdf):
-    """Cleans the 'locality' column in the localities GeoDataFrame."""
+    """Cleans the 'locality' column in the localities GeoDataFrame.
+
+    Only the attribute columns are rewritten: the result is a new GeoDataFrame (columns
+    lowercased) that shares gdf's geometry instead of copying it. Duplicate names are found with
+    a single factorize pass, and the ' - <Admin Area>' suffix is built once per distinct admin
+    area rather than once per row.
+    """
     log_prefix = "[Localities]"
-    gdf_cleaned = gdf.copy()
-    gdf_cleaned.columns = gdf_cleaned.columns.str.lower()
+    columns = {col: col.lower() for col in gdf.columns}
 
     required_cols = ['locality', 'adminarean']
-    if not all(col in gdf_cleaned.columns for col in required_cols):
-        missing = [col for col in required_cols if col not in gdf_cleaned.columns]
+    if not all(col in columns.values() for col in required_cols):
+        missing = [col for col in required_cols if col not in columns.values()]
         logging.error(f"{log_prefix} GeoDataFrame missing required columns for cleaning: {missing}")
         raise ValueError(f"Missing required columns for cleaning: {missing}")
+    source_col = {lower: col for col, lower in columns.items()}
 
-    if 'locality' not in gdf_cleaned.columns:
-        raise ValueError("Required 'locality' column not found before cleaning.")
-    original_null_or_empty_mask = gdf_cleaned['locality'].isna() | \
-                                  (gdf_cleaned['locality'].astype(str).str.strip() == '')
+    locality_raw = gdf[source_col['locality']]
+    locality = locality_raw.fillna('').astype(str).str.strip()
+    adminarean = gdf[source_col['adminarean']].fillna('').astype(str).str.strip()
+    original_null_or_empty_mask = locality_raw.isna() | (locality == '')
     num_nulls_or_empty = original_null_or_empty_mask.sum()
     if num_nulls_or_empty > 0:
         logging.info(f"{log_prefix} Found {num_nulls_or_empty} rows with original null or empty locality values.")
 
-    gdf_cleaned['locality'] = gdf_cleaned['locality'].fillna('').astype(str).str.strip()
-    gdf_cleaned['adminarean'] = gdf_cleaned['adminarean'].fillna('').astype(str).str.strip()
-
-    locality_counts = gdf_cleaned.groupby('locality')['locality'].transform('size')
-    duplicate_mask = (locality_counts > 1) & (gdf_cleaned['locality'] != '')
-    duplicate_indices = gdf_cleaned.index[duplicate_mask]
-    num_duplicates = len(duplicate_indices)
+    codes, uniques = pd.factorize(locality)
+    duplicate_mask = (np.bincount(codes, minlength=len(uniques))[codes] > 1) & (locality != '').to_numpy()
+    duplicate_rows = np.flatnonzero(duplicate_mask)
+    num_duplicates = len(duplicate_rows)
+    cleaned_values = locality.to_numpy(dtype=object, copy=True)
 
     if num_duplicates > 0:
-        admin_part2 = gdf_cleaned.loc[duplicate_indices, 'adminarean'].str.split(',', n=1, expand=True)[1].fillna('').str.strip()
-        admin_part2_cleaned = admin_part2.str.replace(r'\s+\w+$', '', regex=True).str.strip()
-        admin_part2_title = admin_part2_cleaned.str.title()
-        locality_title = gdf_cleaned.loc[duplicate_indices, 'locality'].str.title()
-        new_locality_series = locality_title + ' - ' + admin_part2_title
-        new_locality_series[admin_part2_title == ''] = locality_title[admin_part2_title == '']
-        gdf_cleaned.loc[duplicate_indices, 'locality'] = new_locality_series
+        admin_part2_title = map_distinct(
+            adminarean.iloc[duplicate_rows],
+            lambda admin: admin.str.split(',', n=1).str[1].fillna('').str.strip()
+                               .str.replace(r'\s+\w+$', '', regex=True).str.strip().str.title(),
+        )
+        locality_title = map_distinct(locality.iloc[duplicate_rows], lambda names: names.str.title())
+        cleaned_values[duplicate_rows] = np.where(admin_part2_title == '', locality_title, locality_title + ' - ' + admin_part2_title)
         logging.info(f"{log_prefix} Updated {num_duplicates} duplicate locality names.")
 
     if num_nulls_or_empty > 0:
-        gdf_cleaned.loc[original_null_or_empty_mask, 'locality'] = 'Gulf of Carpentaria'
+        cleaned_values[original_null_or_empty_mask.to_numpy()] = 'Gulf of Carpentaria'
         logging.info(f"{log_prefix} Assigned 'Gulf of Carpentaria' to {num_nulls_or_empty} originally NULL/empty localities.")
 
-    return gdf_cleaned
+    data = {columns[col]: gdf[col] for col in gdf.columns}
+    data['locality'] = pd.Series(cleaned_values, index=locality.index, dtype=locality.dtype)
+    data['adminarean'] = adminarean
+    return gpd.GeoDataFrame(data, geometry=columns[gdf.geometry.name], crs=gdf.crs, copy=False)
+
+# =============================================================================
+# Helper Function for Localities Data: Multi-Resolution Simplified Geometries
+# =============================================================================
+def write_simplified_localities(gdf, output_format=geo_files.DEFAULT_FORMAT):
+    """Saves one simplified copy of every locality per LOCALITIES_SIMPLIFIED_LEVELS entry.
+
+    Simplification is done on the whole coverage at once (shapely.coverage_simplify), so an
+    edge shared by two suburbs is simplified identically on both sides and no gaps or overlaps
+    appear. Coordinates are then snapped to the level's grid to shrink the GeoJSON payload.
+    The output has one row per (locality, detail) in LOCALITIES_SIMPLIFIED_OUTPUT_FILENAME,
+    written in output_format.
+    """
+    log_prefix = "[Localities]"
+    geoms = gdf.geometry.values
+    levels = []
+    for detail, tolerance, grid_size in LOCALITIES_SIMPLIFIED_LEVELS:
+        simplified = shapely.set_precision(shapely.coverage_simplify(geoms, tolerance), grid_size)
+        collapsed = shapely.is_empty(simplified) & ~shapely.is_empty(geoms)
+        if collapsed.any():
+            # Localities smaller than the tolerance would vanish; keep them at full detail instead.
+            logging.info(f"{log_prefix} {int(collapsed.sum())} localities collapse at '{detail}' detail; keeping their full geometry.")
+            simplified[collapsed] = geoms[collapsed]
+        full_vertices = int(shapely.get_num_coordinates(geoms).sum())
+        kept_vertices = int(shapely.get_num_coordinates(simplified).sum())
+        logging.info(f"{log_prefix} Simplified '{detail}' level keeps {kept_vertices} of {full_vertices} vertices.")
+        levels.append(gpd.GeoDataFrame(
+            {'locality': gdf['locality'].to_numpy(), 'detail': detail},
+            geometry=simplified, crs=CRS_GDA2020,
+        ))
+    gdf_simplified = pd.concat(levels, ignore_index=True).rename_geometry(OUTPUT_GEOM_COLUMN_NAME)
+    output_file = geo_files.with_format(LOCALITIES_SIMPLIFIED_OUTPUT_FILENAME, output_format)
+    logging.info(f"{log_prefix} Saving {len(gdf_simplified)} simplified features to {output_file}...")
+    geo_files.write_frame(gdf_simplified, output_file)
+
 
 # =============================================================================
 # Main Processing Function for Localities Data
 # =============================================================================
-def process_locality_data():
-    """Downloads, extracts, cleans, selects columns, renames geometry, lowercases columns, and saves locality boundaries."""
+def process_locality_data(zip_path=None, output_format=geo_files.DEFAULT_FORMAT):
+    """Downloads, extracts, cleans, selects columns, renames geometry, lowercases columns, and saves locality boundaries.
+
+    If zip_path points at an already-downloaded boundary archive (e.g. from the download cache) it is read directly.
+    output_format selects GeoPackage or GeoParquet output (see geo_files.FORMAT_EXTENSIONS).
+    """
     log_prefix = "[Localities]"
     logging.info("--- Starting Locality Boundary Processing ---")
+    metrics = run_metrics.current()
     temp_dir = None
     success = False
     try:
-        temp_dir = tempfile.mkdtemp(prefix="locality_shp_")
-        extracted_shp_path = download_and_extract_shapefile(LOCALITIES_ZIP_URL, LOCALITIES_SHAPEFILE_INTERNAL_PATH, temp_dir)
+        if zip_path:
+            shapefile_path = locate_shapefile_in_zip(zip_path, LOCALITIES_SHAPEFILE_INTERNAL_PATH)
+        else:
+            temp_dir = tempfile.mkdtemp(prefix="locality_shp_")
+            with metrics.step('download'):
+                shapefile_path = download_and_extract_shapefile(LOCALITIES_ZIP_URL, LOCALITIES_SHAPEFILE_INTERNAL_PATH, temp_dir)
 
-        logging.info(f"{log_prefix} Reading shapefile: {os.path.basename(extracted_shp_path)}")
-        gdf_original = gpd.read_file(extracted_shp_path)
+        logging.info(f"{log_prefix} Reading shapefile: {os.path.basename(shapefile_path)}")
+        with metrics.step('read'):
+            gdf_original = gpd.read_file(shapefile_path)
+        metrics.count(rows_in=len(gdf_original))
         logging.info(f"{log_prefix} Loaded {len(gdf_original)} locality features.")
 
         if gdf_original.crs is None:
@@ -183,9 +335,11 @@ def process_locality_data():
             gdf_original.crs = CRS_GDA2020
         elif gdf_original.crs != CRS_GDA2020:
             logging.info(f"{log_prefix} Reprojecting localities from {gdf_original.crs} to {CRS_GDA2020}...")
-            gdf_original = gdf_original.to_crs(CRS_GDA2020)
+            with metrics.step('reproject'):
+                gdf_original = gdf_original.to_crs(CRS_GDA2020)
 
-        cleaned_gdf = clean_locality_attributes(gdf_original)
+        with metrics.step('clean'):
+            cleaned_gdf = clean_locality_attributes(gdf_original)
 
         # Select final columns (using the names after clean_locality_attributes lowercased them)
         required_final_lower = [col.lower() for col in LOCALITIES_CLEANED_COLS]
@@ -218,9 +372,12 @@ def process_locality_data():
         logging.debug(f"{log_prefix} Final columns before saving: {gdf_final.columns.tolist()}")
 
         # Save Output
-        logging.info(f"{log_prefix} Saving {len(gdf_final)} features to GeoPackage: {LOCALITIES_OUTPUT_FILENAME}...")
+        output_file = geo_files.with_format(LOCALITIES_OUTPUT_FILENAME, output_format)
+        logging.info(f"{log_prefix} Saving {len(gdf_final)} features to {output_file}...")
         if not gdf_final.empty:
-            gdf_final.to_file(LOCALITIES_OUTPUT_FILENAME, driver="GPKG")
+            with metrics.step('write'):
+                geo_files.write_frame(gdf_final, output_file)
+            metrics.count(rows_out=len(gdf_final))
             success = True
         else:
             logging.warning(f"{log_prefix} Final localities GeoDataFrame is empty. Skipping save.")
@@ -242,25 +399,68 @@ def process_locality_data():
 
 
 # =============================================================================
-# Main Processing Function for Crash Data
+# Helper Function for Crash Data: Open CSV Source
+# =============================================================================
+@contextlib.contextmanager
+def open_crash_csv(csv_source):
+    """Yields a binary stream for the crash CSV, streaming over HTTP for URLs."""
+    if not csv_source.startswith(('http://', 'https://')):
+        with open(csv_source, 'rb') as csv_file:
+            yield csv_file
+        return
+    with requests.get(csv_source, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True # Transparently handle gzip/deflate transfer encoding
+        yield response.raw
+
+
+# =============================================================================
+# Helper Function for Crash Data: Stream CSV in Chunks
 # =============================================================================
-def process_crash_data():
-    """Downloads, processes, renames geometry, lowercases columns, and saves crash location data."""
+def read_crash_csv_chunks(csv_source, chunk_size):
+    """Streams the crash CSV from a URL or local path, yielding DataFrames of at most chunk_size rows.
+
+    Only CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE are parsed, using CRASHES_CSV_DTYPES.
+    A chunk_size of 0 (or None) yields the whole file as a single DataFrame.
+    """
     log_prefix = "[Crashes]"
-    logging.info("--- Starting Crash Data Processing ---")
-    success = False
-    try:
-        logging.info(f"{log_prefix} Downloading CSV data...")
-        df = pd.read_csv(CRASHES_CSV_URL)
-        logging.info(f"{log_prefix} Downloaded {len(df)} rows.")
+    wanted_cols = set(CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE)
+    with open_crash_csv(csv_source) as csv_stream:
+        reader = pd.read_csv(
+            csv_stream,
+            usecols=lambda col: col in wanted_cols,
+            dtype=CRASHES_CSV_DTYPES,
+            chunksize=chunk_size or None,
+        )
+        if not chunk_size:
+            reader = [reader]
+        for chunk_number, chunk in enumerate(reader, start=1):
+            # Filter Columns using original case names
+            missing_cols = [col for col in CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE if col not in chunk.columns]
+            if missing_cols:
+                logging.error(f"{log_prefix} Source CSV missing required columns: {missing_cols}")
+                raise ValueError(f"Missing required columns: {missing_cols}")
+            logging.debug(f"{log_prefix} Read chunk {chunk_number} with {len(chunk)} rows.")
+            yield chunk.loc[:, CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE].copy()
 
-        # Filter Columns using original case names
-        missing_cols = [col for col in CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE if col not in df.columns]
-        if missing_cols:
-             logging.error(f"{log_prefix} Source CSV missing required columns: {missing_cols}")
-             raise ValueError(f"Missing required columns: {missing_cols}")
-        df_selected = df.loc[:, CRASHES_COLUMNS_TO_KEEP_ORIGINAL_CASE].copy()
 
+# =============================================================================
+# Helper Function for Crash Data: Filter & Build Geometry for One Chunk
+# =============================================================================
+def build_crash_geodataframe(df_selected):
+    """Adds Crash_Date, applies the date, null-coordinate and extent filters and builds point geometry.
+
+    Coordinates that are not valid degrees are always dropped. Crashes outside QLD_EXTENT are
+    dropped only under the 'drop' CRASHES_OUT_OF_STATE_POLICY; under 'flag' they are kept, and
+    assign_crash_localities later leaves their locality NULL and reports them as out of state.
+    Returns a GeoDataFrame with the geometry column named OUTPUT_GEOM_COLUMN_NAME and all
+    other columns lowercased, plus a dict of row counts dropped by each filter.
+    """
+    log_prefix = "[Crashes]"
+    metrics = run_metrics.current()
+    dropped = {'invalid_date': 0, 'before_cutoff': 0, 'null_coords': 0, 'invalid_coords': 0, 'out_of_extent': 0}
+
+    with metrics.step('filter'):
         # Create Date Column
         try:
             # Ensure year and month are strings for concatenation, handle potential non-string types
@@ -271,72 +471,100 @@ def process_crash_data():
         except Exception as date_err:
             logging.error(f"{log_prefix} Error converting Year/Month to Date: {date_err}")
             raise
-        nat_count = df_selected['Crash_Date'].isna().sum()
-        if nat_count > 0:
-             logging.warning(f"{log_prefix} {nat_count} rows had invalid date combinations (resulted in NaT).")
+        dropped['invalid_date'] = int(df_selected['Crash_Date'].isna().sum())
 
-        # Filter by Date (>= 2011)
-        cutoff_date = pd.to_datetime('2011-01-01')
-        df_filtered = df_selected[df_selected['Crash_Date'].notna() & (df_selected['Crash_Date'] >= cutoff_date)].copy()
+        # Filter by Date (>= cutoff)
+        cutoff_date = pd.to_datetime(CRASHES_CUTOFF_DATE)
+        date_mask = df_selected['Crash_Date'].notna() & (df_selected['Crash_Date'] >= cutoff_date)
+        dropped['before_cutoff'] = int(len(df_selected) - date_mask.sum() - dropped['invalid_date'])
+        df_filtered = df_selected[date_mask]
 
         # Handle Null Coordinates
-        initial_rows = len(df_filtered)
-        df_no_null_coords = df_filtered.dropna(subset=['Crash_Longitude', 'Crash_Latitude']).copy()
-        rows_dropped = initial_rows - len(df_no_null_coords)
-        if rows_dropped > 0:
-            logging.info(f"{log_prefix} Removed {rows_dropped} rows due to null coordinates.")
-
-        # Create Geometry
-        if df_no_null_coords.empty:
-            logging.warning(f"{log_prefix} DataFrame is empty after filtering. No geometry to create.")
-            # Create an empty GeoDataFrame with correct CRS and geometry name structure
-            gdf_with_geom = gpd.GeoDataFrame(geometry=[], crs=CRS_GDA2020)
-            # Manually add the target geometry column if empty
-            if OUTPUT_GEOM_COLUMN_NAME not in gdf_with_geom.columns:
-                gdf_with_geom[OUTPUT_GEOM_COLUMN_NAME] = None
-                gdf_with_geom = gdf_with_geom.set_geometry(OUTPUT_GEOM_COLUMN_NAME)
-        else:
-            geometry = gpd.points_from_xy(df_no_null_coords['Crash_Longitude'], df_no_null_coords['Crash_Latitude'])
-            # Create GeoDataFrame, default geometry name is 'geometry'
-            gdf_with_geom = gpd.GeoDataFrame(df_no_null_coords, geometry=geometry, crs=CRS_GDA2020)
+        df_no_null_coords = df_filtered.dropna(subset=['Crash_Longitude', 'Crash_Latitude'])
+        dropped['null_coords'] = len(df_filtered) - len(df_no_null_coords)
 
+        # Drop coordinates that cannot be a point on Earth (e.g. swapped lon/lat)
+        lon, lat = df_no_null_coords['Crash_Longitude'], df_no_null_coords['Crash_Latitude']
+        df_valid_coords = df_no_null_coords[lon.between(-180, 180) & lat.between(-90, 90)]
+        dropped['invalid_coords'] = len(df_no_null_coords) - len(df_valid_coords)
 
-        # Rename Geometry Column to the target name
-        current_geom_col = gdf_with_geom.geometry.name
-        if not gdf_with_geom.empty and current_geom_col != OUTPUT_GEOM_COLUMN_NAME:
-             logging.info(f"{log_prefix} Renaming geometry column from '{current_geom_col}' to '{OUTPUT_GEOM_COLUMN_NAME}'...")
-             gdf_with_geom = gdf_with_geom.rename_geometry(OUTPUT_GEOM_COLUMN_NAME)
-             if gdf_with_geom.geometry.name == OUTPUT_GEOM_COLUMN_NAME:
-                  logging.info(f"{log_prefix} Geometry column successfully renamed to '{gdf_with_geom.geometry.name}'.")
-             else:
-                  logging.error(f"{log_prefix} FAILED TO RENAME GEOMETRY COLUMN! Current name: '{gdf_with_geom.geometry.name}'")
-                  raise RuntimeError(f"Failed to rename geometry column to {OUTPUT_GEOM_COLUMN_NAME}")
-        elif gdf_with_geom.geometry.name == OUTPUT_GEOM_COLUMN_NAME:
-             logging.info(f"{log_prefix} Geometry column already named '{OUTPUT_GEOM_COLUMN_NAME}'.")
-        elif not gdf_with_geom.empty:
-             logging.warning(f"{log_prefix} Could not find geometry column '{current_geom_col}' to rename.")
+        # Crashes outside Queensland (zeroes, typos) are dropped here or flagged by assign_crash_localities
+        df_in_extent = df_valid_coords
+        if CRASHES_OUT_OF_STATE_POLICY == 'drop':
+            min_lon, min_lat, max_lon, max_lat = QLD_EXTENT
+            lon, lat = df_valid_coords['Crash_Longitude'], df_valid_coords['Crash_Latitude']
+            df_in_extent = df_valid_coords[lon.between(min_lon, max_lon) & lat.between(min_lat, max_lat)]
+            dropped['out_of_extent'] = len(df_valid_coords) - len(df_in_extent)
 
+    # Create Geometry and rename it to the target name
+    with metrics.step('geometry'):
+        geometry = gpd.points_from_xy(df_in_extent['Crash_Longitude'], df_in_extent['Crash_Latitude'])
+        gdf_with_geom = gpd.GeoDataFrame(df_in_extent, geometry=geometry, crs=CRS_GDA2020)
+    with metrics.step('rename'):
+        gdf_with_geom = gdf_with_geom.rename_geometry(OUTPUT_GEOM_COLUMN_NAME)
 
         # Lowercase all OTHER columns BEFORE saving
-        logging.info(f"{log_prefix} Ensuring all non-geometry column names are lowercase...")
         gdf_final = lowercase_columns(gdf_with_geom, OUTPUT_GEOM_COLUMN_NAME)
-        logging.debug(f"{log_prefix} Final columns before saving: {gdf_final.columns.tolist()}")
+    return gdf_final, dropped
 
 
-        # Save Output
-        logging.info(f"{log_prefix} Saving {len(gdf_final)} features to GeoPackage: {CRASHES_OUTPUT_FILENAME}...")
-        if not gdf_final.empty or (gdf_final.empty and len(gdf_final.columns)>0): # Save even if empty but has columns defined
-             # Ensure schema consistency even for empty frames if possible
-             gdf_final.to_file(CRASHES_OUTPUT_FILENAME, driver='GPKG')
-             success = True
+# =============================================================================
+# Main Processing Function for Crash Data
+# =============================================================================
+def process_crash_data(chunk_size=CRASHES_CSV_CHUNK_SIZE, csv_source=CRASHES_CSV_URL, output_format=geo_files.DEFAULT_FORMAT):
+    """Streams, processes, and saves crash location data chunk by chunk.
+
+    Each chunk is filtered, given point geometry and lowercased columns, then appended to the
+    output file, so peak memory is bounded by chunk_size rather than the full dataset.
+    csv_source may be the upstream URL or a local copy (e.g. from the download cache).
+    """
+    log_prefix = "[Crashes]"
+    logging.info("--- Starting Crash Data Processing ---")
+    metrics = run_metrics.current()
+    success = False
+    try:
+        if chunk_size:
+            logging.info(f"{log_prefix} Streaming CSV data in chunks of {chunk_size} rows...")
         else:
-             logging.warning(f"{log_prefix} Final crashes GeoDataFrame is completely empty (no rows, no columns). Skipping save.")
-             # If you want to save an empty file anyway, you might need more complex schema handling here.
-             success = True # Count as success if empty is expected
+            logging.info(f"{log_prefix} Downloading CSV data in a single read...")
+
+        output_file = geo_files.with_format(CRASHES_OUTPUT_FILENAME, output_format)
+        rows_read = 0
+        dropped_totals = {'invalid_date': 0, 'before_cutoff': 0, 'null_coords': 0, 'invalid_coords': 0, 'out_of_extent': 0}
+        with geo_files.GeoFrameWriter(output_file) as writer: # Chunks are appended to a fresh file
+            for chunk in metrics.timed(read_crash_csv_chunks(csv_source, chunk_size), 'parse'):
+                rows_read += len(chunk)
+                gdf_chunk, dropped = build_crash_geodataframe(chunk)
+                for key, count in dropped.items():
+                    dropped_totals[key] += count
+
+                if gdf_chunk.empty:
+                    continue
+                with metrics.step('write'):
+                    writer.write(gdf_chunk)
+                logging.debug(f"{log_prefix} Wrote {writer.rows_written} features so far.")
 
+            rows_written = writer.rows_written
+            if rows_written == 0:
+                logging.warning(f"{log_prefix} DataFrame is empty after filtering. Saving empty output file.")
+                writer.write(gpd.GeoDataFrame(geometry=[], crs=CRS_GDA2020).rename_geometry(OUTPUT_GEOM_COLUMN_NAME))
+
+        logging.info(f"{log_prefix} Downloaded {rows_read} rows.")
+        if dropped_totals['invalid_date'] > 0:
+            logging.warning(f"{log_prefix} {dropped_totals['invalid_date']} rows had invalid date combinations (resulted in NaT).")
+        if dropped_totals['null_coords'] > 0:
+            logging.info(f"{log_prefix} Removed {dropped_totals['null_coords']} rows due to null coordinates.")
+        if dropped_totals['invalid_coords'] > 0:
+            logging.warning(f"{log_prefix} Removed {dropped_totals['invalid_coords']} rows with coordinates outside -180..180 / -90..90.")
+        if dropped_totals['out_of_extent'] > 0:
+            logging.warning(f"{log_prefix} Removed {dropped_totals['out_of_extent']} rows with coordinates outside {QLD_EXTENT}.")
+        logging.info(f"{log_prefix} Saved {rows_written} features to {output_file}.")
+        metrics.count(rows_in=rows_read, rows_out=rows_written)
+        update_quality_report('crashes', {'rows_read': rows_read, 'rows_written': rows_written, 'dropped': dropped_totals})
+        success = True
 
     except pd.errors.EmptyDataError:
-        logging.error(f"{log_prefix} Downloaded file from {CRASHES_CSV_URL} is empty or invalid.")
+        logging.error(f"{log_prefix} Downloaded file from {csv_source} is empty or invalid.")
     except requests.exceptions.RequestException as req_err:
          logging.error(f"{log_prefix} Error during download: {req_err}")
     except ValueError as val_err:
@@ -348,14 +576,645 @@ def process_crash_data():
 
 
 # =============================================================================
-# Main Execution Orchestration (Unchanged)
+# Post-Processing: Validate and Repair Locality Geometry
+# =============================================================================
+def run_geometry_chunks(func, geoms, workers):
+    """Applies a vectorized shapely function to geoms in one chunk per worker thread.
+
+    Shapely releases the GIL inside GEOS, so the chunks run in parallel without the pickling
+    cost of worker processes.
+    """
+    if workers <= 1 or len(geoms) < 2 * workers:
+        return func(geoms)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(func, np.array_split(geoms, workers))))
+
+
+def validate_locality_geometries(output_format=geo_files.DEFAULT_FORMAT, workers=DEFAULT_JOBS):
+    """Repairs invalid locality polygons once at ingest and writes the simplified levels.
+
+    Invalid polygons (self-intersections, bad rings) are fixed with make_valid's 'structure'
+    method, dropping parts that collapse to lines or points so every locality stays polygonal;
+    localities left empty are removed. The repaired file replaces the localities output, so the
+    database never stores geometry that slows down or breaks ST_Within. The 'localities' section
+    of QUALITY_REPORT_FILENAME records the invalidity reasons, the repairs and an STRtree sanity
+    check: overlapping locality pairs and features outside QLD_EXTENT.
+    """
+    log_prefix = "[Geometry Validation]"
+    logging.info("--- Starting Locality Geometry Validation ---")
+    metrics = run_metrics.current()
+    success = False
+    try:
+        localities_file = geo_files.with_format(LOCALITIES_OUTPUT_FILENAME, output_format)
+        with metrics.step('read'):
+            gdf = geo_files.read_frame(localities_file)
+        geoms = np.asarray(gdf.geometry.array)
+        names = gdf['locality'].to_numpy(dtype=object)
+
+        with metrics.step('validate'):
+            valid = run_geometry_chunks(shapely.is_valid, geoms, workers)
+        invalid_rows = np.flatnonzero(~valid)
+        reasons = pd.Series(shapely.is_valid_reason(geoms[invalid_rows]), dtype=object).str.replace(r'\[.*$', '', regex=True)
+        if len(invalid_rows):
+            logging.warning(f"{log_prefix} {len(invalid_rows)} of {len(geoms)} locality polygons are invalid; repairing with make_valid.")
+            with metrics.step('repair'):
+                repaired = run_geometry_chunks(
+                    lambda chunk: shapely.make_valid(chunk, method='structure', keep_collapsed=False), geoms[invalid_rows], workers
+                )
+            geoms = geoms.copy()
+            geoms[invalid_rows] = repaired
+        empty = shapely.is_empty(geoms) | shapely.is_missing(geoms)
+        if empty.any():
+            logging.warning(f"{log_prefix} Dropping {int(empty.sum())} localities with no area left: {', '.join(map(str, names[empty][:QUALITY_REPORT_SAMPLE_SIZE]))}")
+
+        gdf_valid = gpd.GeoDataFrame(
+            {'locality': names[~empty]}, geometry=gpd.GeoSeries(geoms[~empty], crs=gdf.crs), crs=gdf.crs
+        ).rename_geometry(OUTPUT_GEOM_COLUMN_NAME)
+        if len(invalid_rows) or empty.any():
+            with metrics.step('write'):
+                geo_files.write_frame(gdf_valid, localities_file)
+            logging.info(f"{log_prefix} Rewrote {localities_file} with repaired geometry.")
+
+        # Sanity check through the same kind of index the crash join uses
+        valid_geoms = np.asarray(gdf_valid.geometry.array)
+        with metrics.step('overlap_check'):
+            tree = shapely.STRtree(valid_geoms)
+            left, right = tree.query(valid_geoms, predicate='overlaps')
+            left, right = left[left < right], right[left < right]
+            overlap_areas = shapely.area(shapely.intersection(valid_geoms[left], valid_geoms[right]))
+        overlap_pairs = overlap_areas >= LOCALITY_OVERLAP_MIN_AREA
+        valid_names = gdf_valid['locality'].to_numpy(dtype=object)
+        min_lon, min_lat, max_lon, max_lat = QLD_EXTENT
+        bounds = shapely.bounds(valid_geoms)
+        outside_extent = (bounds[:, 0] < min_lon) | (bounds[:, 1] < min_lat) | (bounds[:, 2] > max_lon) | (bounds[:, 3] > max_lat)
+        if overlap_pairs.any():
+            logging.warning(f"{log_prefix} {int(overlap_pairs.sum())} pairs of localities overlap.")
+
+        with metrics.step('simplify'):
+            write_simplified_localities(gdf_valid, output_format)
+        metrics.count(rows_in=len(geoms), rows_out=len(gdf_valid))
+        update_quality_report('localities', {
+            'features': int(len(geoms)),
+            'invalid': int(len(invalid_rows)),
+            'invalid_reasons': {k: int(v) for k, v in reasons.value_counts().items()},
+            'invalid_examples': names[invalid_rows][:QUALITY_REPORT_SAMPLE_SIZE].tolist(),
+            'repaired': int(len(invalid_rows) - empty[invalid_rows].sum()),
+            'dropped_empty': names[empty].tolist(),
+            'overlapping_pairs': int(overlap_pairs.sum()),
+            'sliver_overlap_pairs': int((~overlap_pairs).sum()),
+            'overlapping_examples': [
+                {'localities': [valid_names[a], valid_names[b]], 'area': float(area)}
+                for a, b, area in zip(left[overlap_pairs], right[overlap_pairs], overlap_areas[overlap_pairs])
+            ][:QUALITY_REPORT_SAMPLE_SIZE],
+            'outside_extent': valid_names[outside_extent][:QUALITY_REPORT_SAMPLE_SIZE].tolist(),
+            'total_bounds': [float(v) for v in gdf_valid.total_bounds],
+        })
+        logging.info(f"{log_prefix} Validated {len(geoms)} localities: {len(invalid_rows)} repaired or dropped, {int(overlap_pairs.sum())} overlapping pairs.")
+        success = True
+
+    except Exception as e:
+        logging.exception(f"{log_prefix} An unexpected error occurred: {e}")
+    finally:
+        return success
+
+
+# =============================================================================
+# Post-Processing: Assign Each Crash to a Locality
 # =============================================================================
-def main():
+def assign_crash_localities(batch_size=CRASHES_CSV_CHUNK_SIZE, output_format=geo_files.DEFAULT_FORMAT):
+    """Adds a 'locality' column to the crashes GeoPackage using one STRtree-indexed spatial join.
+
+    A crash gets the locality whose polygon covers it, boundary included. Where several polygons
+    cover a point (shared edges and vertices, overlaps) the alphabetically first locality wins, so
+    each crash maps to at most one locality. Crashes outside every polygon get NULL.
+    Unmatched crashes more than CRASHES_STATE_TOLERANCE from every locality are out of state:
+    they are kept or removed according to CRASHES_OUT_OF_STATE_POLICY and reported in the
+    'crash_locations' section of QUALITY_REPORT_FILENAME.
+    The crashes file is rewritten batch by batch, so memory stays bounded by batch_size.
+    """
+    log_prefix = "[Crash Localities]"
+    logging.info("--- Starting Crash Locality Assignment ---")
+    metrics = run_metrics.current()
+    success = False
+    crashes_file = geo_files.with_format(CRASHES_OUTPUT_FILENAME, output_format)
+    tmp_output = geo_files.with_format(crashes_file + ".tmp", output_format)
+    try:
+        localities_file = geo_files.with_format(LOCALITIES_OUTPUT_FILENAME, output_format)
+        localities = geo_files.read_frame(localities_file).sort_values('locality', kind='stable')
+        if localities.crs != CRS_GDA2020:
+            localities = localities.to_crs(CRS_GDA2020)
+        locality_names = np.append(localities['locality'].to_numpy(dtype=object), None) # Last slot = no match
+        no_match = len(localities)
+        tree = shapely.STRtree(localities.geometry.values)
+        logging.info(f"{log_prefix} Built STRtree over {len(localities)} locality polygons.")
+
+        total_features = geo_files.read_info(crashes_file)['features']
+        matched = 0
+        near_boundary = 0
+        out_of_state_refs = []
+        with geo_files.GeoFrameWriter(tmp_output, layer=geo_files.layer_name(crashes_file)) as writer:
+            for crashes in metrics.timed(geo_files.iter_frames(crashes_file, batch_size), 'read'):
+                with metrics.step('join'):
+                    points = crashes.geometry.values
+                    point_idx, polygon_idx = tree.query(points, predicate='intersects')
+                    # Polygons are sorted by name, so the smallest matching index is the alphabetical winner.
+                    best = np.full(len(crashes), no_match)
+                    np.minimum.at(best, point_idx, polygon_idx)
+                    crashes['locality'] = locality_names[best]
+                    matched += int((best != no_match).sum())
+
+                    unmatched = np.flatnonzero(best == no_match)
+                    near_idx, _ = tree.query(points[unmatched], predicate='dwithin', distance=CRASHES_STATE_TOLERANCE)
+                    out_of_state = np.setdiff1d(unmatched, unmatched[near_idx])
+                near_boundary += len(unmatched) - len(out_of_state)
+                out_of_state_refs.extend(crashes[CRASHES_KEY_COLUMN].iloc[out_of_state].tolist())
+                if CRASHES_OUT_OF_STATE_POLICY == 'drop':
+                    crashes = crashes.drop(index=crashes.index[out_of_state])
+                with metrics.step('write'):
+                    writer.write(crashes.rename_geometry(OUTPUT_GEOM_COLUMN_NAME))
+            metrics.count(rows_in=total_features, rows_out=writer.rows_written)
+
+        if total_features == 0:
+            logging.warning(f"{log_prefix} Crashes file is empty. Nothing to assign.")
+        else:
+            os.replace(tmp_output, crashes_file)
+            logging.info(f"{log_prefix} Assigned {matched} of {total_features} crashes to a locality ({total_features - matched} outside every locality).")
+        if out_of_state_refs:
+            action = 'Dropped' if CRASHES_OUT_OF_STATE_POLICY == 'drop' else 'Flagged'
+            logging.warning(f"{log_prefix} {action} {len(out_of_state_refs)} crashes more than {CRASHES_STATE_TOLERANCE} degrees from every locality.")
+        update_quality_report('crash_locations', {
+            'crashes': int(total_features),
+            'assigned': matched,
+            'near_boundary_unassigned': near_boundary,
+            'out_of_state': len(out_of_state_refs),
+            'out_of_state_policy': CRASHES_OUT_OF_STATE_POLICY,
+            'out_of_state_examples': [int(ref) for ref in out_of_state_refs[:QUALITY_REPORT_SAMPLE_SIZE]],
+        })
+        success = True
+
+    except Exception as e:
+        logging.exception(f"{log_prefix} An unexpected error occurred: {e}")
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        return success
+
+
+# =============================================================================
+# Post-Processing: Diff Crashes Against the Last Loaded Snapshot
+# =============================================================================
+def fingerprint_crash_rows(gdf):
+    """Returns a uint64 fingerprint per row over every attribute column.
+
+    Geometry is left out because it is derived from crash_longitude/crash_latitude. Columns are
+    normalised first because the dtype OGR returns can depend on the batch (e.g. an all-NULL
+    text column comes back as float), and the hash must only depend on the values.
+    """
+    attributes = gdf.drop(columns=gdf.geometry.name)
+    normalized = {}
+    for col in attributes.columns:
+        values = attributes[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            normalized[col] = values.astype('datetime64[ms]')
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            normalized[col] = values.astype('float64')
+        else:
+            normalized[col] = values.astype(object).where(values.notna(), None)
+    return pd.util.hash_pandas_object(pd.DataFrame(normalized), index=False).to_numpy()
+
+
+def collapse_fingerprints(keys, fingerprints):
+    """Sorts by key and XOR-combines the fingerprints of rows sharing a key, so keys are unique."""
+    order = np.argsort(keys, kind='stable')
+    keys, fingerprints = keys[order], fingerprints[order]
+    if len(keys) == 0:
+        return keys, fingerprints
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.bitwise_xor.reduceat(fingerprints, starts)
+
+
+def diff_crash_snapshot(batch_size=CRASHES_CSV_CHUNK_SIZE, output_format=geo_files.DEFAULT_FORMAT):
+    """Writes the crash changeset relative to the snapshot last loaded into the database.
+
+    Every row of the processed crashes file is fingerprinted and keyed on CRASHES_KEY_COLUMN.
+    Keys new since the snapshot or whose fingerprint changed are copied to
+    CRASHES_CHANGES_FILENAME; keys that disappeared are listed in CRASHES_DELETED_FILENAME.
+    Without a snapshot every row counts as inserted. The snapshot itself is only advanced by
+    load_to_db.py once the data is in the database.
+    """
+    log_prefix = "[Crash Changes]"
+    logging.info("--- Starting Crash Change Detection ---")
+    metrics = run_metrics.current()
+    success = False
+    try:
+        crashes_file = geo_files.with_format(CRASHES_OUTPUT_FILENAME, output_format)
+        changes_file = geo_files.with_format(CRASHES_CHANGES_FILENAME, output_format)
+        total_features = geo_files.read_info(crashes_file)['features']
+
+        # Pass 1: fingerprint every row
+        key_parts, fingerprint_parts = [], []
+        for batch in metrics.timed(geo_files.iter_frames(crashes_file, batch_size), 'read'):
+            with metrics.step('fingerprint'):
+                key_parts.append(batch[CRASHES_KEY_COLUMN].to_numpy(dtype='int64'))
+                fingerprint_parts.append(fingerprint_crash_rows(batch))
+        keys, fingerprints = collapse_fingerprints(
+            np.concatenate(key_parts) if key_parts else np.array([], dtype='int64'),
+            np.concatenate(fingerprint_parts) if fingerprint_parts else np.array([], dtype='uint64'),
+        )
+        if len(keys) < total_features:
+            logging.warning(f"{log_prefix} {total_features - len(keys)} rows share a {CRASHES_KEY_COLUMN} with another row; they are diffed as one unit.")
+        np.savez(CRASHES_FINGERPRINTS_FILENAME, keys=keys, fingerprints=fingerprints)
+
+        # Diff against the snapshot
+        if os.path.exists(CRASHES_SNAPSHOT_FILENAME):
+            with np.load(CRASHES_SNAPSHOT_FILENAME) as snapshot:
+                old_keys, old_fingerprints = snapshot['keys'], snapshot['fingerprints']
+        else:
+            logging.info(f"{log_prefix} No snapshot found ({CRASHES_SNAPSHOT_FILENAME}); treating every crash as inserted.")
+            old_keys, old_fingerprints = np.array([], dtype='int64'), np.array([], dtype='uint64')
+        inserted = np.setdiff1d(keys, old_keys, assume_unique=True)
+        deleted = np.setdiff1d(old_keys, keys, assume_unique=True)
+        _, new_idx, old_idx = np.intersect1d(keys, old_keys, assume_unique=True, return_indices=True)
+        updated = keys[new_idx[fingerprints[new_idx] != old_fingerprints[old_idx]]]
+        changed_keys = np.union1d(inserted, updated)
+
+        # Pass 2: copy the inserted/updated rows out
+        with geo_files.GeoFrameWriter(changes_file) as writer:
+            for batch in metrics.timed(geo_files.iter_frames(crashes_file, batch_size), 'read'):
+                changed = batch[np.isin(batch[CRASHES_KEY_COLUMN].to_numpy(dtype='int64'), changed_keys)]
+                if changed.empty and writer.rows_written:
+                    continue
+                with metrics.step('write'):
+                    writer.write(changed.rename_geometry(OUTPUT_GEOM_COLUMN_NAME)) # First batch always written, so the file has a schema
+            rows_written = writer.rows_written
+        metrics.count(rows_in=total_features, rows_out=rows_written)
+        pd.DataFrame({CRASHES_KEY_COLUMN: deleted}).to_csv(CRASHES_DELETED_FILENAME, index=False)
+
+        logging.info(
+            f"{log_prefix} {len(inserted)} inserted, {len(updated)} updated, {len(deleted)} deleted, "
+            f"{len(keys) - len(inserted) - len(updated)} unchanged; wrote {rows_written} changed rows to {changes_file}."
+        )
+        success = True
+
+    except Exception as e:
+        logging.exception(f"{log_prefix} An unexpected error occurred: {e}")
+    finally:
+        return success
+
+
+# =============================================================================
+# Post-Processing: Hexagon Heatmap Grids
+# =============================================================================
+def build_crash_heatmaps(batch_size=CRASHES_CSV_CHUNK_SIZE, output_format=geo_files.DEFAULT_FORMAT):
+    """Counts crashes per hexagon, month and severity at every HEATMAP_CELL_SIZES resolution.
+
+    The crashes file is read batch by batch (only crash_date and crash_severity besides the
+    point) and each batch is binned with crash_grids.hexbin_counts, so memory is bounded by
+    batch_size plus the number of non-empty cells. HEATMAP_OUTPUT_FILENAME gets one row per
+    non-empty (cell_size, cell_q, cell_r, crash_date, crash_severity) with its crash_count and
+    the hexagon centre as geometry, so density queries and heatmaps never scan raw crashes.
+    """
+    log_prefix = "[Heatmaps]"
+    logging.info("--- Starting Crash Heatmap Grid Build ---")
+    metrics = run_metrics.current()
+    success = False
+    try:
+        crashes_file = geo_files.with_format(CRASHES_OUTPUT_FILENAME, output_format)
+        heatmap_file = geo_files.with_format(HEATMAP_OUTPUT_FILENAME, output_format)
+        severity_codes = {} # severity label -> code, stable across batches
+        empty = (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        totals = {size: empty for size in HEATMAP_CELL_SIZES} # size -> (packed keys, counts)
+        rows_read = 0
+
+        for crashes in metrics.timed(geo_files.iter_frames(crashes_file, batch_size, columns=['crash_date', 'crash_severity']), 'read'):
+            with metrics.step('bin'):
+                crashes = crashes[crashes['crash_date'].notna() & crashes.geometry.notna() & ~crashes.geometry.is_empty]
+                rows_read += len(crashes)
+                months = crashes['crash_date'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+                codes, labels = pd.factorize(crashes['crash_severity'].astype(object), use_na_sentinel=False)
+                label_codes = np.array([severity_codes.setdefault(label, len(severity_codes)) for label in labels], dtype=np.int64)
+                if len(severity_codes) > HEATMAP_SEVERITY_SLOTS:
+                    raise ValueError(f"More than {HEATMAP_SEVERITY_SLOTS} distinct crash_severity values.")
+                group = months * HEATMAP_SEVERITY_SLOTS + label_codes[codes]
+                lon, lat = crashes.geometry.x.to_numpy(), crashes.geometry.y.to_numpy()
+                for size in HEATMAP_CELL_SIZES:
+                    # Merge into the running totals per batch, so they never hold more than the distinct cells
+                    keys, counts = crash_grids.hexbin_counts(lon, lat, group, size)
+                    totals[size] = crash_grids.merge_counts(np.concatenate([totals[size][0], keys]), np.concatenate([totals[size][1], counts]))
+
+        with metrics.step('write'):
+            severity_labels = np.array(list(severity_codes), dtype=object)
+            frames = []
+            for size in HEATMAP_CELL_SIZES:
+                keys, counts = totals[size]
+                q, r, group = crash_grids.unpack_keys(keys)
+                lon, lat = crash_grids.inverse_web_mercator(*crash_grids.hex_centres(q, r, size))
+                frames.append(pd.DataFrame({
+                    'cell_size': np.full(len(keys), size, dtype=np.int32),
+                    'cell_q': q.astype(np.int32),
+                    'cell_r': r.astype(np.int32),
+                    'crash_date': (group // HEATMAP_SEVERITY_SLOTS).astype('datetime64[M]').astype('datetime64[ms]'),
+                    'crash_severity': severity_labels[group % HEATMAP_SEVERITY_SLOTS] if len(severity_labels) else np.array([], dtype=object),
+                    'crash_count': counts.astype(np.int32),
+                    'longitude': lon,
+                    'latitude': lat,
+                }))
+                logging.info(f"{log_prefix} {size} m hexagons: {len(np.unique(keys >> crash_grids.KEY_GROUP_BITS))} cells, {len(keys)} cell x month x severity counts.")
+            cells = pd.concat(frames, ignore_index=True)
+            gdf_cells = gpd.GeoDataFrame(
+                cells.drop(columns=['longitude', 'latitude']),
+                geometry=gpd.points_from_xy(cells['longitude'], cells['latitude']), crs=CRS_GDA2020,
+            ).rename_geometry(OUTPUT_GEOM_COLUMN_NAME)
+            geo_files.write_frame(gdf_cells, heatmap_file)
+
+        metrics.count(rows_in=rows_read, rows_out=len(gdf_cells))
+        logging.info(f"{log_prefix} Wrote {len(gdf_cells)} heatmap rows for {rows_read} crashes to {heatmap_file}.")
+        success = True
+
+    except Exception as e:
+        logging.exception(f"{log_prefix} An unexpected error occurred: {e}")
+    finally:
+        return success
+
+
+# =============================================================================
+# Post-Processing: Pre-Rendered Vector Tiles
+# =============================================================================
+def build_vector_tiles(batch_size=CRASHES_CSV_CHUNK_SIZE, output_format=geo_files.DEFAULT_FORMAT):
+    """Pre-renders crashes and locality boundaries into TILES_OUTPUT_FILENAME.
+
+    Up to TILES_CLUSTER_MAX_ZOOM crashes are aggregated per zoom level into grid cells
+    ('crash_clusters' layer, with a total and a per-severity count); above it every crash is a
+    point in the 'crashes' layer. The crashes file is streamed in batches of batch_size into the
+    points layer, keeping only coordinates and severity codes for clustering. Locality outlines
+    are boundary lines from the simplified levels, one level per zoom range up to
+    TILES_LOCALITY_MAX_ZOOM. The MBTiles file can be served statically (or converted to PMTiles),
+    so a statewide map view costs a few small tile fetches instead of the full crash result set.
+    """
+    log_prefix = "[Tiles]"
+    logging.info("--- Starting Vector Tile Build ---")
+    metrics = run_metrics.current()
+    temp_dir = None
+    success = False
+    try:
+        temp_dir = tempfile.mkdtemp(prefix="crash_tiles_")
+        layer_files = []
+
+        crashes_file = geo_files.with_format(CRASHES_OUTPUT_FILENAME, output_format)
+        crs = geo_files.read_info(crashes_file)['crs']
+        lon_parts, lat_parts, severity_parts = [], [], []
+        severity_labels = [] # Severity code -> label, in order of first appearance
+
+        def crash_points():
+            """Yields the crash point batches, keeping their coordinates and severity codes."""
+            for crashes in geo_files.iter_frames(crashes_file, batch_size, columns=TILES_POINT_COLUMNS):
+                crashes = crashes[~crashes.geometry.is_empty & crashes.geometry.notna()]
+                severity = crashes['crash_severity'].astype(object)
+                severity_labels.extend(label for label in pd.unique(severity.dropna()) if label not in severity_labels)
+                lon_parts.append(crashes.geometry.x.to_numpy())
+                lat_parts.append(crashes.geometry.y.to_numpy())
+                severity_parts.append(pd.Index(severity_labels).get_indexer(severity)) # -1 for missing
+                yield crashes
+
+        path = os.path.join(temp_dir, "crashes.mbtiles")
+        with metrics.step('points'):
+            point_count = vector_tiles.write_tile_layer_frames(crash_points(), path, 'crashes', TILES_CLUSTER_MAX_ZOOM + 1, TILES_MAX_ZOOM, geometry_type='Point')
+        if point_count:
+            layer_files.append(path)
+        lon = np.concatenate(lon_parts) if lon_parts else np.empty(0)
+        lat = np.concatenate(lat_parts) if lat_parts else np.empty(0)
+        severity_codes = np.concatenate(severity_parts) if severity_parts else np.empty(0, dtype=np.int64)
+        severity_names = {f'count_{code}': f'count_{vector_tiles.slugify(name)}' for code, name in enumerate(severity_labels)}
+        logging.info(f"{log_prefix} Wrote {point_count} crash points.")
+
+        for zoom in range(TILES_CLUSTER_MAX_ZOOM + 1):
+            with metrics.step('cluster'):
+                clusters = vector_tiles.cluster_points(lon, lat, zoom, TILES_CLUSTER_CELLS_PER_TILE, categories=severity_codes)
+                gdf_clusters = vector_tiles.points_frame(clusters, crs).rename(columns=severity_names)
+            path = os.path.join(temp_dir, f"crash_clusters_z{zoom}.mbtiles")
+            with metrics.step('encode'):
+                vector_tiles.write_tile_layer(gdf_clusters, path, 'crash_clusters', zoom, zoom)
+            layer_files.append(path)
+            logging.info(f"{log_prefix} Zoom {zoom}: {len(lon)} crashes in {len(gdf_clusters)} clusters.")
+
+        simplified = geo_files.read_frame(geo_files.with_format(LOCALITIES_SIMPLIFIED_OUTPUT_FILENAME, output_format))
+        for detail, (min_zoom, max_zoom) in TILES_LOCALITY_ZOOMS.items():
+            path = os.path.join(temp_dir, f"localities_{detail}.mbtiles")
+            level = simplified.loc[simplified['detail'] == detail, ['locality', simplified.geometry.name]]
+            level = level.set_geometry(level.geometry.boundary) # Outlines only, so tiles inside a locality stay empty
+            with metrics.step('encode'):
+                vector_tiles.write_tile_layer(level, path, 'localities', min_zoom, max_zoom)
+            layer_files.append(path)
+
+        with metrics.step('merge'):
+            tile_count = vector_tiles.merge_mbtiles(layer_files, TILES_OUTPUT_FILENAME, 'Queensland crashes', log_prefix=log_prefix)
+        metrics.count(rows_in=len(lon), rows_out=tile_count)
+        success = True
+
+    except Exception as e:
+        logging.exception(f"{log_prefix} An unexpected error occurred: {e}")
+    finally:
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return success
+
+
+# =============================================================================
+# Main Execution Orchestration
+# =============================================================================
+def parse_args(argv=None):
+    """Parses command-line options for the processing pipeline."""
+    parser = argparse.ArgumentParser(description="Download and prepare Queensland crash and locality data.")
+    parser.add_argument(
+        '--chunk-size', type=int, default=CRASHES_CSV_CHUNK_SIZE,
+        help=f"Rows per streamed crash CSV chunk; 0 reads the whole file at once (default: {CRASHES_CSV_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=DEFAULT_JOBS,
+        help=f"Worker processes for the locality and crash pipelines, and threads for geometry validation; 1 runs them serially (default: {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help="Download inputs directly instead of through the local download cache",
+    )
+    parser.add_argument(
+        '--cache-dir', default=download_cache.DEFAULT_CACHE_DIR,
+        help=f"Directory for cached downloads and run state (default: {download_cache.DEFAULT_CACHE_DIR})",
+    )
+    parser.add_argument(
+        '--format', choices=sorted(geo_files.FORMAT_EXTENSIONS), default=geo_files.DEFAULT_FORMAT,
+        help=f"Format of the processed output files read by load_to_db.py (default: {geo_files.DEFAULT_FORMAT})",
+    )
+    parser.add_argument(
+        '--skip-tiles', action='store_true',
+        help=f"Do not rebuild the vector tiles in {TILES_OUTPUT_FILENAME}",
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help="Reprocess even if both inputs match the last successful run",
+    )
+    parser.add_argument(
+        '--metrics-file', default=run_metrics.DEFAULT_METRICS_FILE,
+        help=f"JSON-lines file each stage's metrics are appended to; empty disables it (default: {run_metrics.DEFAULT_METRICS_FILE})",
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help="Also write the run's stage metrics to this Prometheus textfile (e.g. for node_exporter's textfile collector)",
+    )
+    parser.add_argument(
+        '--profile', choices=run_metrics.PROFILE_MODES,
+        help="Profile every stage with cProfile (.prof files in --profile-dir) or tracemalloc (top allocations in the metrics)",
+    )
+    parser.add_argument(
+        '--profile-dir', default=run_metrics.DEFAULT_PROFILE_DIR,
+        help=f"Directory for cProfile output (default: {run_metrics.DEFAULT_PROFILE_DIR})",
+    )
+    return parser.parse_args(argv)
+
+
+def cached_source(dataset):
+    """Returns (url, log prefix, pipeline function, keyword taking the local file) for a cached input."""
+    return {
+        'localities': (LOCALITIES_ZIP_URL, "[Localities]", process_locality_data, 'zip_path'),
+        'crashes': (CRASHES_CSV_URL, "[Crashes]", process_crash_data, 'csv_source'),
+    }[dataset]
+
+
+def fetch_and_process(dataset, cache_dir, reuse_sha256=None, **kwargs):
+    """Fetches one input through the download cache, then runs its pipeline on the cached file.
+
+    Runs inside a worker task, so one dataset's download overlaps the other's download and
+    processing. If the fetched content's SHA-256 equals reuse_sha256 the existing output is kept
+    and the pipeline is not run. Returns the pipeline's success (False if the fetch failed).
+    """
+    url, log_prefix, pipeline, source_keyword = cached_source(dataset)
+    try:
+        with run_metrics.stage(f"download_{dataset}"):
+            path, sha256, _ = download_cache.fetch(url, cache_dir=cache_dir, log_prefix=log_prefix)
+    except Exception as e:
+        logging.error(f"{log_prefix} Could not fetch input through cache: {e}")
+        return False
+    if reuse_sha256 and sha256 == reuse_sha256:
+        logging.info(f"{log_prefix} Input matches the last successful run; keeping the existing output.")
+        return True
+    return pipeline(**kwargs, **{source_keyword: path})
+
+
+def run_timed_task(name, func, kwargs):
+    """Runs one pipeline function as a run_metrics stage and returns (name, success, elapsed seconds).
+
+    Defined at module level so it can be pickled into a worker process.
+    """
+    start_time = time.perf_counter()
+    with run_metrics.stage(name) as metrics:
+        success = func(**kwargs)
+        metrics.success = success
+    return name, success, time.perf_counter() - start_time
+
+
+def run_tasks(tasks, jobs):
+    """Runs {name: (func, kwargs)} pipelines, in a process pool when jobs > 1.
+
+    Returns {name: success}. Each task's wall time is logged as it finishes; a worker that
+    dies without returning counts as a failure for its task.
+    """
+    results = {}
+    start_time = time.perf_counter()
+    if jobs <= 1 or len(tasks) <= 1:
+        for name, (func, kwargs) in tasks.items():
+            name, success, elapsed = run_timed_task(name, func, kwargs)
+            logging.info(f"Stage '{name}' finished in {elapsed:.1f}s ({'ok' if success else 'failed'}).")
+            results[name] = success
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(tasks)), initializer=run_metrics.init_worker, initargs=(run_metrics.load_settings(),),
+        ) as executor:
+            futures = {
+                executor.submit(run_timed_task, name, func, kwargs): name
+                for name, (func, kwargs) in tasks.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    name, success, elapsed = future.result()
+                    logging.info(f"Stage '{name}' finished in {elapsed:.1f}s ({'ok' if success else 'failed'}).")
+                except Exception as e:
+                    logging.error(f"Stage '{name}' worker failed: {e}")
+                    success = False
+                results[name] = success
+    logging.info(f"All stages finished in {time.perf_counter() - start_time:.1f}s wall time (jobs={jobs}).")
+    return results
+
+
+def run_post_processing(results, args):
+    """Runs the stages that need both processed outputs, in order; returns {stage: success}."""
+    if not (results.get('localities') and results.get('crashes')):
+        logging.warning("Skipping post-processing stages because a pipeline failed.")
+        return {}
+    stages = {
+        'geometry_validation': (validate_locality_geometries, {'output_format': args.format, 'workers': args.jobs}),
+        'crash_localities': (assign_crash_localities, {'batch_size': args.chunk_size, 'output_format': args.format}),
+        'crash_changes': (diff_crash_snapshot, {'batch_size': args.chunk_size, 'output_format': args.format}),
+        'crash_heatmaps': (build_crash_heatmaps, {'batch_size': args.chunk_size, 'output_format': args.format}),
+    }
+    if not args.skip_tiles:
+        stages['vector_tiles'] = (build_vector_tiles, {'batch_size': args.chunk_size, 'output_format': args.format})
+    post_results = {}
+    for name, (func, kwargs) in stages.items():
+        name, success, elapsed = run_timed_task(name, func, kwargs)
+        logging.info(f"Stage '{name}' finished in {elapsed:.1f}s ({'ok' if success else 'failed'}).")
+        post_results[name] = success
+        if not success:
+            break
+    return post_results
+
+
+def main(argv=None):
     """Runs the processing for both localities and crash datasets."""
+    args = parse_args(argv)
+    run_metrics.start_run('download_data', args.metrics_file, args.metrics_textfile, args.profile, args.profile_dir)
     logging.info("===== Starting All Data Processing Pipeline =====")
     results = {}
-    results['localities'] = process_locality_data()
-    results['crashes'] = process_crash_data()
+    tasks = {}
+    if args.no_cache:
+        tasks['localities'] = (process_locality_data, {'output_format': args.format})
+        tasks['crashes'] = (process_crash_data, {'chunk_size': args.chunk_size, 'output_format': args.format})
+        results.update(run_tasks(tasks, args.jobs))
+        results.update(run_post_processing(results, args))
+    else:
+        run_state = download_cache.load_run_state(args.cache_dir)
+        outputs = {'localities': LOCALITIES_OUTPUT_FILENAME, 'crashes': CRASHES_OUTPUT_FILENAME}
+        pipeline_kwargs = {
+            'localities': {'output_format': args.format},
+            'crashes': {'chunk_size': args.chunk_size, 'output_format': args.format},
+        }
+        # A dataset whose fetched input matches the last successful run keeps its output from that
+        # run; post-processing rewrites both outputs idempotently, so it can run on a mix of
+        # reused and freshly processed outputs.
+        reuse = {
+            dataset: None if args.force or not os.path.exists(geo_files.with_format(filename, args.format)) else run_state.get(dataset)
+            for dataset, filename in outputs.items()
+        }
+        for dataset in outputs:
+            tasks[dataset] = (fetch_and_process, {'dataset': dataset, 'cache_dir': args.cache_dir, 'reuse_sha256': reuse[dataset], **pipeline_kwargs[dataset]})
+        results.update(run_tasks(tasks, args.jobs))
+        input_sha256 = {dataset: download_cache.cached_sha256(cached_source(dataset)[0], args.cache_dir) for dataset in outputs}
+        reused = [dataset for dataset in outputs if results[dataset] and reuse[dataset] and input_sha256[dataset] == reuse[dataset]]
+        if len(reused) == len(outputs):
+            logging.info("Both inputs match the last successful run. Skipping processing (use --force to override).")
+            run_metrics.finish_run(success=True)
+            return
+        if reused:
+            logging.info(f"Reusing the previous output of unchanged {', '.join(reused)}; post-processing both.")
+        post_results = run_post_processing(results, args)
+        results.update(post_results)
+        for dataset in outputs:
+            # Post-processing rewrites the outputs, so a failure there means neither is up to date.
+            if results[dataset] and post_results and all(post_results.values()):
+                run_state[dataset] = input_sha256[dataset]
+            else:
+                run_state.pop(dataset, None)
+        download_cache.save_run_state(run_state, args.cache_dir)
     logging.info("===== Data Processing Pipeline Finished =====")
     successful_tasks = [k for k, v in results.items() if v]
     failed_tasks = [k for k, v in results.items() if not v]
@@ -363,6 +1222,7 @@ def main():
          logging.info(f"Successfully processed: {', '.join(successful_tasks)}")
     if failed_tasks:
          logging.error(f"Failed to process: {', '.join(failed_tasks)}")
+    run_metrics.finish_run(success=not failed_tasks)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,352 @@
+import datetime
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyogrio
+import pyogrio.raw
+import shapely
+from pyproj import CRS
+
+# =============================================================================
+# Intermediate files exchanged between download_data.py and load_to_db.py.
+#
+# Both scripts can use either format, chosen with --format:
+#   gpkg     GeoPackage via OGR (row-oriented SQLite; opens in QGIS and ogr2ogr)
+#   parquet  GeoParquet 1.0 via Arrow (columnar, zstd-compressed, keeps categorical and
+#            nullable integer dtypes, supports column projection and row-group filters)
+# File names are configured with a .gpkg extension; with_format() swaps it for the chosen one.
+# =============================================================================
+
+# --- Configuration ---
+FORMAT_EXTENSIONS = {'gpkg': '.gpkg', 'parquet': '.parquet'}
+DEFAULT_FORMAT = 'gpkg'
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_ROW_GROUP_SIZE = 100_000 # Rows per row group; each group carries min/max statistics for filters
+GEOPARQUET_VERSION = '1.0.0'
+
+# numpy dtype names reported for Arrow types, matching what pyogrio reports for GeoPackages
+NUMPY_DTYPES_BY_ARROW_TYPE = {
+    pa.bool_(): 'bool',
+    pa.int8(): 'int16', # OGR has no 8-bit integer; widen like a GeoPackage round trip would
+    pa.int16(): 'int16',
+    pa.int32(): 'int32',
+    pa.int64(): 'int64',
+    pa.float32(): 'float32',
+    pa.float64(): 'float64',
+    pa.date32(): 'datetime64[D]',
+}
+
+
+# =============================================================================
+# Helper Functions: Paths and Formats
+# =============================================================================
+def with_format(path, file_format):
+    """Returns path with its extension replaced by the one for file_format."""
+    return os.path.splitext(path)[0] + FORMAT_EXTENSIONS[file_format]
+
+
+def format_of(path):
+    """Returns the file format implied by path's extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for file_format, format_extension in FORMAT_EXTENSIONS.items():
+        if extension == format_extension:
+            return file_format
+    raise ValueError(f"Unsupported intermediate file type: {path}")
+
+
+def layer_name(path):
+    """Returns the GeoPackage layer name used for path (its base name without extension)."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# =============================================================================
+# Helper Functions: GeoParquet Metadata
+# =============================================================================
+def geometry_types(geoms):
+    """Returns the sorted GeoParquet geometry type names (e.g. 'Point', 'Polygon Z') present in geoms."""
+    present = ~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)
+    names = shapely.get_type_id(geoms[present])
+    type_names = np.array(['Point', 'LineString', 'LinearRing', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon', 'GeometryCollection'])
+    suffix = np.where(shapely.has_z(geoms[present]), ' Z', '')
+    return sorted(set(np.char.add(type_names[names].astype(str), suffix).tolist()))
+
+
+def geo_metadata(geometry_name, crs, types, bounds):
+    """Builds the GeoParquet 'geo' file metadata for a single WKB geometry column."""
+    column = {'encoding': 'WKB', 'geometry_types': types}
+    if crs is not None:
+        column['crs'] = CRS.from_user_input(crs).to_json_dict()
+    if bounds is not None and np.all(np.isfinite(bounds)):
+        column['bbox'] = [float(v) for v in bounds]
+    return {'version': GEOPARQUET_VERSION, 'primary_column': geometry_name, 'columns': {geometry_name: column}}
+
+
+def read_geo_metadata(parquet_file):
+    """Returns (geometry column name, CRS or None, column metadata) from a GeoParquet file."""
+    # Read from the file footer: the 'geo' key is added at close, after the Arrow schema was stored
+    metadata = json.loads(parquet_file.metadata.metadata[b'geo'])
+    geometry_name = metadata['primary_column']
+    column = metadata['columns'][geometry_name]
+    crs = CRS.from_json_dict(column['crs']) if column.get('crs') else None
+    return geometry_name, crs, column
+
+
+def normalized_schema(table):
+    """Widens a chunk's schema so later chunks of the same frame can be cast to it.
+
+    Categorical columns become dictionaries with int32 indices (a later chunk may have more
+    categories than the first), and all-NULL columns, plain or categorical, become strings:
+    pandas gives an all-NULL categorical float64 or null categories, whatever its later values.
+    """
+    fields = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_dictionary(field.type):
+            all_null = pa.types.is_null(field.type.value_type) or column.null_count == len(column)
+            value_type = pa.string() if all_null else field.type.value_type
+            field = field.with_type(pa.dictionary(pa.int32(), value_type))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def frame_to_table(gdf, schema=None):
+    """Converts a GeoDataFrame to an Arrow table with the geometry as WKB, cast to schema if given."""
+    geometry_name = gdf.geometry.name
+    df = pd.DataFrame(gdf.drop(columns=geometry_name))
+    df[geometry_name] = shapely.to_wkb(gdf.geometry.values)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Typed explicitly: an empty chunk's WKB would otherwise be inferred as null and widened to string
+    wkb = pa.array(df[geometry_name].to_numpy(), type=pa.binary())
+    table = table.set_column(table.schema.get_field_index(geometry_name), geometry_name, wkb)
+    return table.cast(schema) if schema is not None else table
+
+
+def table_to_frame(table, geometry_name, crs):
+    """Converts an Arrow table with a WKB geometry column back into a GeoDataFrame."""
+    df = table.to_pandas()
+    geometry = gpd.GeoSeries.from_wkb(df.pop(geometry_name).to_numpy(), crs=crs, index=df.index)
+    return gpd.GeoDataFrame(df, geometry=geometry.rename(geometry_name), crs=crs)
+
+
+# =============================================================================
+# Writer: Append GeoDataFrame Chunks to One File
+# =============================================================================
+class GeoFrameWriter:
+    """Writes GeoDataFrame chunks to a single GeoPackage layer or GeoParquet file.
+
+    Used as a context manager; the file is complete once the block exits. GeoParquet chunks are
+    split into PARQUET_ROW_GROUP_SIZE row groups, and the 'geo' metadata (geometry types, bbox)
+    covers every chunk written. layer names the GeoPackage layer (default: from path).
+    """
+
+    def __init__(self, path, layer=None):
+        self.path = path
+        self.file_format = format_of(path)
+        self.layer = layer or layer_name(path)
+        self.rows_written = 0
+        self._writer = None
+        self._schema = None
+        self._geometry_name = None
+        self._crs = None
+        self._types = set()
+        self._bounds = None
+
+    def __enter__(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return self
+
+    def write(self, gdf):
+        """Appends one chunk. Every chunk must have the same columns."""
+        if self.file_format == 'gpkg':
+            gdf.to_file(self.path, driver='GPKG', layer=self.layer, mode='a' if os.path.exists(self.path) else 'w')
+        else:
+            if self._writer is None:
+                table = frame_to_table(gdf)
+                self._schema = normalized_schema(table)
+                table = table.cast(self._schema)
+                self._geometry_name, self._crs = gdf.geometry.name, gdf.crs
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression=PARQUET_COMPRESSION)
+            else:
+                table = frame_to_table(gdf, self._schema)
+            self._writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+            self._types.update(geometry_types(gdf.geometry.values))
+            if len(gdf):
+                bounds = gdf.geometry.total_bounds
+                self._bounds = bounds if self._bounds is None else np.r_[np.minimum(self._bounds[:2], bounds[:2]), np.maximum(self._bounds[2:], bounds[2:])]
+        self.rows_written += len(gdf)
+
+    def close(self):
+        """Finishes the file, writing the GeoParquet footer metadata."""
+        if self._writer is not None:
+            metadata = geo_metadata(self._geometry_name, self._crs, sorted(self._types), self._bounds)
+            self._writer.add_key_value_metadata({'geo': json.dumps(metadata)})
+            self._writer.close()
+            self._writer = None
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if exc_type is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        return False
+
+
+def write_frame(gdf, path):
+    """Writes a whole GeoDataFrame to path in the format implied by its extension."""
+    with GeoFrameWriter(path) as writer:
+        writer.write(gdf)
+
+
+# =============================================================================
+# Readers
+# =============================================================================
+def read_info(path):
+    """Returns pyogrio-style layer info: fields, dtypes, features, geometry_type, geometry_name, crs."""
+    if format_of(path) == 'gpkg':
+        return pyogrio.read_info(path)
+    parquet_file = pq.ParquetFile(path)
+    geometry_name, crs, column = read_geo_metadata(parquet_file)
+    fields = [field for field in parquet_file.schema_arrow if field.name != geometry_name]
+    types = column.get('geometry_types') or []
+    return {
+        'fields': np.array([field.name for field in fields], dtype=object),
+        'dtypes': np.array([arrow_numpy_dtype(field.type) for field in fields], dtype=object),
+        'features': parquet_file.metadata.num_rows,
+        'geometry_type': types[0] if len(types) == 1 else 'Unknown',
+        'geometry_name': geometry_name,
+        'crs': crs.to_string() if crs is not None else None,
+    }
+
+
+def arrow_numpy_dtype(arrow_type):
+    """Returns the numpy dtype name for an Arrow type, as pyogrio would report it."""
+    if arrow_type in NUMPY_DTYPES_BY_ARROW_TYPE:
+        return NUMPY_DTYPES_BY_ARROW_TYPE[arrow_type]
+    if pa.types.is_timestamp(arrow_type):
+        return f'datetime64[{arrow_type.unit}]'
+    return 'object'
+
+
+def sql_where(filters):
+    """Turns pyarrow-style [(column, op, value), ...] filters into an OGR SQL WHERE clause.
+
+    Dates are compared as ISO strings, which is how GeoPackage stores them. The extra op
+    'is null' (value ignored) selects missing values.
+    """
+    def literal(value):
+        return repr(value.isoformat() if isinstance(value, datetime.date) else value)
+
+    clauses = []
+    for column, op, value in filters:
+        if op == 'is null':
+            clauses.append(f'"{column}" IS NULL')
+        elif op in ('in', 'not in'):
+            values = ', '.join(literal(v) for v in value)
+            clauses.append(f'"{column}" {op.upper()} ({values})')
+        else:
+            clauses.append(f'"{column}" {"=" if op == "==" else op} {literal(value)}')
+    return ' AND '.join(clauses)
+
+
+def arrow_filter(filters):
+    """Turns the same filters into a pyarrow.dataset expression (with 'is null' support)."""
+    expressions = [
+        ds.field(column).is_null() if op == 'is null' else pq.filters_to_expression([(column, op, value)])
+        for column, op, value in filters
+    ]
+    expression = expressions[0]
+    for other in expressions[1:]:
+        expression = expression & other
+    return expression
+
+
+def read_frame(path, columns=None, filters=None):
+    """Reads path into a GeoDataFrame, optionally projecting columns and filtering rows.
+
+    filters uses the pyarrow form [(column, op, value), ...] (ANDed). For GeoParquet they are
+    pushed down to row-group statistics, so groups that cannot match are never decoded.
+    """
+    if format_of(path) == 'gpkg':
+        return pyogrio.read_dataframe(path, columns=columns, where=sql_where(filters) if filters else None)
+    return gpd.read_parquet(path, columns=None if columns is None else columns + [read_info(path)['geometry_name']], filters=filters)
+
+
+def iter_frames(path, batch_size, columns=None):
+    """Yields path as GeoDataFrames of at most batch_size rows (all rows at once if batch_size is 0)."""
+    if format_of(path) == 'gpkg':
+        total_features = pyogrio.read_info(path)['features']
+        step = batch_size or total_features or 1
+        for offset in range(0, total_features, step):
+            yield pyogrio.read_dataframe(path, columns=columns, skip_features=offset, max_features=step)
+        return
+    parquet_file = pq.ParquetFile(path)
+    geometry_name, crs, _ = read_geo_metadata(parquet_file)
+    read_columns = None if columns is None else columns + [geometry_name]
+    step = batch_size or parquet_file.metadata.num_rows or 1
+    for batch in parquet_file.iter_batches(batch_size=step, columns=read_columns):
+        yield table_to_frame(pa.Table.from_batches([batch]), geometry_name, crs)
+
+
+def arrow_column_values(column):
+    """Converts an Arrow column to the numpy array pyogrio.raw would return for it.
+
+    Nullable integer and boolean columns that contain NULLs come back as object arrays holding
+    None, so they are never silently turned into floats.
+    """
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    if (pa.types.is_integer(column.type) or pa.types.is_boolean(column.type)) and column.null_count:
+        return np.array(column.to_pylist(), dtype=object)
+    if pa.types.is_date32(column.type):
+        return column.to_numpy(zero_copy_only=False).astype('datetime64[D]')
+    values = column.to_numpy(zero_copy_only=False)
+    return values.astype(object) if values.dtype.kind in 'OUS' else values
+
+
+def read_column(path, column):
+    """Reads one attribute column as the numpy array pyogrio.raw would return, skipping geometry."""
+    if format_of(path) == 'gpkg':
+        _, _, _, field_data = pyogrio.raw.read(path, columns=[column], read_geometry=False)
+        return field_data[0]
+    return arrow_column_values(pq.read_table(path, columns=[column]).column(column).combine_chunks())
+
+
+def iter_raw_batches(path, batch_size, filters=None):
+    """Yields (field_data, geometry_wkb) batches without building DataFrames.
+
+    field_data is a list of numpy arrays in read_info(path)['fields'] order and geometry_wkb an
+    object array of WKB bytes (None for missing geometry). filters takes the read_frame form and
+    restricts the rows yielded (an OGR WHERE clause, or an Arrow dataset scan filter).
+    """
+    if format_of(path) == 'gpkg':
+        where = sql_where(filters) if filters else None
+        offset = 0
+        while True:
+            _, _, geometry, field_data = pyogrio.raw.read(
+                path, skip_features=offset, max_features=batch_size, where=where, return_fids=False
+            )
+            if len(geometry) == 0:
+                break
+            yield field_data, geometry
+            offset += len(geometry)
+            if len(geometry) < batch_size:
+                break
+        return
+    parquet_file = pq.ParquetFile(path)
+    geometry_name, _, _ = read_geo_metadata(parquet_file)
+    if filters:
+        batches = ds.dataset(path, format='parquet').to_batches(batch_size=batch_size, filter=arrow_filter(filters))
+    else:
+        batches = parquet_file.iter_batches(batch_size=batch_size)
+    for batch in batches:
+        if filters and batch.num_rows == 0:
+            continue
+        field_data = [arrow_column_values(batch.column(name)) for name in batch.schema.names if name != geometry_name]
+        yield field_data, batch.column(geometry_name).to_numpy(zero_copy_only=False)
@@ -1,11 +1,21 @@
+import argparse
+import concurrent.futures
+import datetime
+import io
 import logging
 import os
+import shutil
 import sys
+import time
 
-import geopandas as gpd
+import numpy as np
+import shapely
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError, ProgrammingError
 
+import geo_files
+import run_metrics
+
 # --- Basic Logging Configuration ---
 log_format = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=log_format)
@@ -17,110 +27,816 @@ DB_PASSWORD = 'password'
 DB_HOST = 'localhost'
 DB_PORT = '5432'
 DB_NAME = 'qld_crashes'
+DB_POOL_SIZE = 5 # Pooled connections kept open; raised to --workers for partitioned loads
 
 # --- File and Table Mapping ---
 FILES_TO_LOAD = [
     ('qld_crashes_processed.gpkg', 'crashes'),
     ('qld_localities_cleaned.gpkg', 'localities'),
+    ('qld_localities_simplified.gpkg', 'localities_simplified'),
+    ('qld_crash_heatmap.gpkg', 'crash_heatmap'),
 ]
 
 # --- Target Geometry Column Name ---
 TARGET_GEOMETRY_COLUMN_NAME = 'geom'
+TARGET_SRID = 7844 # GDA2020, matches CRS_GDA2020 in download_data.py
 
 # --- Load Behavior ---
 IF_EXISTS_MODE = 'replace' # 'replace', 'append', 'fail'
+LOAD_METHOD = 'copy' # 'copy' (bulk COPY FROM STDIN) or 'to_postgis' (GeoPandas/SQLAlchemy inserts)
+COPY_BATCH_SIZE = 50_000 # Features read from the GeoPackage and sent per COPY batch
+
+# --- Staging & Swap Behavior (IF_EXISTS_MODE = 'replace') ---
+# Each table is loaded into '<table>__staging', indexed and analyzed there, then renamed over the
+# live table in one transaction so readers never see a missing, partial or unindexed table.
+STAGING_TABLE_SUFFIX = '__staging'
+SWAP_LOCK_TIMEOUT = '5s' # Give up on the swap rather than queueing readers behind it indefinitely
+SWAP_ATTEMPTS = 3
+SWAP_RETRY_DELAY_SECONDS = 5
+
+# --- Partitioned Crash Load (--partitioned) ---
+# crashes is created range-partitioned by crash_date, one partition per calendar year in the file
+# plus a DEFAULT partition that takes NULL dates (and incremental rows from years added since the
+# last full load). Partitions are COPYed and indexed in parallel, each on a pooled connection, and
+# a failed partition is retried on its own. Date-bounded queries then only scan their years.
+PARTITIONED_TABLE = 'crashes'
+PARTITION_KEY_COLUMN = 'crash_date'
+DEFAULT_PARTITION_LABEL = 'default'
+PARTITION_LOAD_WORKERS = os.cpu_count() or 1
+PARTITION_LOAD_ATTEMPTS = 3
+PARTITION_RETRY_DELAY_SECONDS = 5
+
+# --- Indexes Built Before a Table Goes Live: (name suffix, method, indexed expression) ---
+DEFAULT_TABLE_INDEXES = [
+    ('geom', 'gist', TARGET_GEOMETRY_COLUMN_NAME),
+]
+TABLE_INDEXES = {
+    'crashes': DEFAULT_TABLE_INDEXES + [
+        ('crash_year', 'btree', 'crash_year'),
+        ('crash_month', 'btree', 'crash_month'),
+        ('crash_severity', 'btree', 'crash_severity'),
+        ('crash_date', 'btree', 'crash_date'), # Serves the backend's date-window filter
+        ('crash_ref_number', 'btree', 'crash_ref_number'), # Serves incremental deletes/upserts
+        ('locality_lower', 'btree', 'LOWER(locality)'), # Assigned at ingest by download_data.py
+    ],
+    'localities': DEFAULT_TABLE_INDEXES + [
+        ('locality', 'btree', 'locality'),
+        ('locality_lower', 'btree', 'LOWER(locality)'), # Backend filters on LOWER(L.locality)
+    ],
+    'localities_simplified': [
+        ('locality_detail', 'btree', 'locality, detail'), # Backend fetches one shape per zoom level
+    ],
+    'crash_heatmap': DEFAULT_TABLE_INDEXES + [
+        ('cell_size_date', 'btree', 'cell_size, crash_date'), # Backend sums one resolution over a date window
+    ],
+    'crash_rollup': [
+        ('crash_date', 'btree', 'crash_date'),
+        ('locality_lower_date', 'btree', 'LOWER(locality), crash_date'),
+    ],
+}
+
+# --- Incremental Crash Refresh (files written by download_data.py) ---
+INCREMENTAL_TABLE = 'crashes'
+CRASHES_KEY_COLUMN = 'crash_ref_number'
+CRASHES_CHANGES_FILENAME = "qld_crashes_changes.gpkg" # Inserted and updated rows
+CRASHES_DELETED_FILENAME = "qld_crashes_deleted.csv" # crash_ref_number of deleted rows
+CRASHES_FINGERPRINTS_FILENAME = "qld_crashes_fingerprints.npz" # Fingerprints of the processed file
+CRASHES_SNAPSHOT_FILENAME = "qld_crashes_snapshot.npz" # Fingerprints of what is in the database
+
+# --- Rollup Cube (crash counts per cell, rebuilt or patched after every crashes load) ---
+ROLLUP_TABLE = 'crash_rollup'
+ROLLUP_DIMENSIONS = ['locality', 'crash_date', 'crash_severity', 'crash_hour', 'crash_day_of_week']
+
+# --- Column Type Mapping for COPY Loads (numpy dtype reported by pyogrio -> PostgreSQL) ---
+PG_TYPES_BY_DTYPE = {
+    'bool': 'boolean',
+    'int16': 'smallint',
+    'int32': 'integer',
+    'int64': 'bigint',
+    'float32': 'real',
+    'float64': 'double precision',
+    'object': 'text',
+    'datetime64[D]': 'date',
+}
+# PostgreSQL types written as whole numbers; OGR returns such columns as float64 when they hold NULLs
+INTEGER_PG_TYPES = {'smallint', 'integer', 'bigint', 'boolean'}
+# Columns whose PostgreSQL type is fixed regardless of how the GeoPackage stores them
+COLUMN_TYPE_OVERRIDES = {
+    'crash_date': 'date', # Month-precision crash date; GPKG stores it as a midnight DateTime
+}
 
 # --- Construct Database URL ---
 db_url = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 # db_url = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}" # for psycopg driver
 
-logging.info(f"Attempting to connect to database: {DB_NAME} on {DB_HOST}:{DB_PORT}")
 
-# --- Create SQLAlchemy Engine ---
-engine = None
-try:
-    engine = create_engine(db_url)
-    with engine.connect() as connection:
-        logging.info("Database connection successful.")
-        try:
-            result = connection.execute(text("SELECT PostGIS_Version()"))
-            pg_version = result.scalar()
-            logging.info(f"PostGIS extension found: {pg_version}")
-        except (OperationalError, ProgrammingError) as postgis_err:
-            logging.error("Could not detect PostGIS extension.", exc_info=False)
-            logging.error("Please ensure PostGIS is installed and enabled in your database:")
-            logging.error(f"  psql -d {DB_NAME} -c 'CREATE EXTENSION IF NOT EXISTS postgis;'")
-            logging.error(f"Original error: {postgis_err}")
-            sys.exit(1)
-
-except OperationalError as e:
-    logging.error("Database connection failed.", exc_info=True)
-    logging.error("Please check your database connection details (host, port, user, password, dbname) and ensure the server is running.")
-    sys.exit(1)
-except ImportError as e:
-    if 'psycopg' in str(e).lower():
-         logging.error("Missing PostgreSQL database driver.", exc_info=False)
-         logging.error(f"Error detail: {e}")
-         logging.error("Please install the required driver:")
-         logging.error("  pip install psycopg2-binary")
-         logging.error("  OR (for newer SQLAlchemy/psycopg3)")
-         logging.error("  pip install psycopg")
-    else:
-        logging.error("An import error occurred.", exc_info=True)
-        logging.error("Please ensure all required libraries (geopandas, sqlalchemy, geoalchemy2) are installed.")
-    sys.exit(1)
-except Exception as e:
-    logging.critical(f"An unexpected error occurred during database engine creation.", exc_info=True)
-    sys.exit(1)
+# =============================================================================
+# Create SQLAlchemy Engine
+# =============================================================================
+def create_db_engine(pool_size=DB_POOL_SIZE):
+    """Creates the engine and checks the connection and PostGIS; exits the script on failure.
+
+    The engine pools up to pool_size connections, checked for liveness before each use.
+    """
+    logging.info(f"Attempting to connect to database: {DB_NAME} on {DB_HOST}:{DB_PORT}")
+    engine = None
+    try:
+        engine = create_engine(db_url, pool_size=pool_size, pool_pre_ping=True)
+        with engine.connect() as connection:
+            logging.info("Database connection successful.")
+            try:
+                result = connection.execute(text("SELECT PostGIS_Version()"))
+                pg_version = result.scalar()
+                logging.info(f"PostGIS extension found: {pg_version}")
+            except (OperationalError, ProgrammingError) as postgis_err:
+                logging.error("Could not detect PostGIS extension.", exc_info=False)
+                logging.error("Please ensure PostGIS is installed and enabled in your database:")
+                logging.error(f"  psql -d {DB_NAME} -c 'CREATE EXTENSION IF NOT EXISTS postgis;'")
+                logging.error(f"Original error: {postgis_err}")
+                sys.exit(1)
+
+    except OperationalError as e:
+        logging.error("Database connection failed.", exc_info=True)
+        logging.error("Please check your database connection details (host, port, user, password, dbname) and ensure the server is running.")
+        sys.exit(1)
+    except ImportError as e:
+        if 'psycopg' in str(e).lower():
+             logging.error("Missing PostgreSQL database driver.", exc_info=False)
+             logging.error(f"Error detail: {e}")
+             logging.error("Please install the required driver:")
+             logging.error("  pip install psycopg2-binary")
+             logging.error("  OR (for newer SQLAlchemy/psycopg3)")
+             logging.error("  pip install psycopg")
+        else:
+            logging.error("An import error occurred.", exc_info=True)
+            logging.error("Please ensure all required libraries (geopandas, sqlalchemy, geoalchemy2) are installed.")
+        sys.exit(1)
+    except Exception as e:
+        logging.critical(f"An unexpected error occurred during database engine creation.", exc_info=True)
+        sys.exit(1)
+    return engine
 
 
-# --- Load Data ---
-logging.info(f"Starting data loading process (if_exists='{IF_EXISTS_MODE}')...")
+# =============================================================================
+# Loader: GeoPandas to_postgis (SQLAlchemy row inserts)
+# =============================================================================
+def load_with_to_postgis(engine, gpkg_file, table_name, target_table):
+    """Reads the whole file into a GeoDataFrame and writes it to target_table with to_postgis."""
+    # 1. Read the GeoPackage/GeoParquet file into a GeoDataFrame
+    metrics = run_metrics.current()
+    logging.info(f"Reading {gpkg_file}...")
+    with metrics.step('read'):
+        gdf = geo_files.read_frame(gpkg_file)
+    logging.info(f"Read {len(gdf)} features from {gpkg_file}.")
+    logging.debug(f"Original columns: {gdf.columns.tolist()}")
 
-for gpkg_file, table_name in FILES_TO_LOAD:
-    logging.info(f"Processing file: {gpkg_file} -> Table: {table_name}")
+    source_geom_col = gdf.geometry.name
+    logging.info(f"Detected geometry column in source file: '{source_geom_col}'")
 
-    if not os.path.exists(gpkg_file):
-        logging.warning(f"File not found: {gpkg_file}. Skipping.")
-        continue
+    # 2. RENAME Geometry Column in GeoDataFrame if necessary
+    if source_geom_col != TARGET_GEOMETRY_COLUMN_NAME:
+        logging.info(f"Renaming GeoDataFrame geometry column from '{source_geom_col}' to '{TARGET_GEOMETRY_COLUMN_NAME}' before writing to DB.")
+        gdf = gdf.rename_geometry(TARGET_GEOMETRY_COLUMN_NAME)
+        # Verify rename (optional debug)
+        logging.debug(f"GeoDataFrame geometry column is now: '{gdf.geometry.name}'")
+    else:
+         logging.info(f"GeoDataFrame geometry column is already named '{TARGET_GEOMETRY_COLUMN_NAME}'. No rename needed.")
 
-    try:
-        # 1. Read GeoPackage file using GeoPandas
-        logging.info(f"Reading {gpkg_file}...")
-        gdf = gpd.read_file(gpkg_file)
-        logging.info(f"Read {len(gdf)} features from {gpkg_file}.")
-        logging.debug(f"Original columns: {gdf.columns.tolist()}")
-
-        source_geom_col = gdf.geometry.name
-        logging.info(f"Detected geometry column in source file: '{source_geom_col}'")
-
-        # 2. RENAME Geometry Column in GeoDataFrame if necessary
-        if source_geom_col != TARGET_GEOMETRY_COLUMN_NAME:
-            logging.info(f"Renaming GeoDataFrame geometry column from '{source_geom_col}' to '{TARGET_GEOMETRY_COLUMN_NAME}' before writing to DB.")
-            gdf = gdf.rename_geometry(TARGET_GEOMETRY_COLUMN_NAME)
-            # Verify rename (optional debug)
-            logging.debug(f"GeoDataFrame geometry column is now: '{gdf.geometry.name}'")
-        else:
-             logging.info(f"GeoDataFrame geometry column is already named '{TARGET_GEOMETRY_COLUMN_NAME}'. No rename needed.")
+    # Date-typed columns are passed as datetime.date objects so to_postgis creates them as DATE
+    for col, pg_type in COLUMN_TYPE_OVERRIDES.items():
+        if pg_type == 'date' and col in gdf.columns:
+            gdf[col] = gdf[col].dt.date
 
-        # 3. Write to PostGIS using GeoPandas' to_postgis
-        logging.info(f"Writing {len(gdf)} features to table '{table_name}'...")
+    # 3. Write to PostGIS using GeoPandas' to_postgis
+    logging.info(f"Writing {len(gdf)} features to table '{target_table}'...")
+    start_time = time.perf_counter()
+    with metrics.step('insert'):
         gdf.to_postgis(
-            name=table_name,
+            name=target_table,
             con=engine,
-            if_exists=IF_EXISTS_MODE,
+            if_exists='replace' if target_table != table_name else IF_EXISTS_MODE,
             index=False  # Don't write the GeoDataFrame index as a column
             # REMOVED the unsupported 'geometry=' keyword argument
         )
-        # The geometry column name used will be gdf.geometry.name, which we ensured is TARGET_GEOMETRY_COLUMN_NAME
-        logging.info(f"Successfully loaded data into table '{table_name}' with geometry column '{gdf.geometry.name}'.") # Use gdf.geometry.name here
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    metrics.count(rows_in=len(gdf), rows_out=len(gdf))
+    # The geometry column name used will be gdf.geometry.name, which we ensured is TARGET_GEOMETRY_COLUMN_NAME
+    logging.info(f"Successfully loaded data into table '{target_table}' with geometry column '{gdf.geometry.name}'.") # Use gdf.geometry.name here
+    logging.info(f"Loaded {len(gdf)} rows in {elapsed:.1f}s ({len(gdf) / elapsed:,.0f} rows/s).")
+
+
+# =============================================================================
+# Helper Functions for COPY Loads
+# =============================================================================
+def quote_ident(name):
+    """Double-quotes a PostgreSQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def pg_type_for_column(name, dtype):
+    """Maps a column name and the numpy dtype name reported by pyogrio to a PostgreSQL column type."""
+    if name in COLUMN_TYPE_OVERRIDES:
+        return COLUMN_TYPE_OVERRIDES[name]
+    if dtype in PG_TYPES_BY_DTYPE:
+        return PG_TYPES_BY_DTYPE[dtype]
+    if dtype.startswith('datetime64'):
+        return 'timestamp'
+    return 'text'
+
+
+def postgis_geometry_type(ogr_geometry_type):
+    """Maps an OGR geometry type name (e.g. 'Point', 'MultiPolygon Z') to a PostGIS typmod."""
+    if not ogr_geometry_type or 'Unknown' in ogr_geometry_type:
+        return 'Geometry'
+    return ogr_geometry_type.replace(' ', '')
+
+
+def format_copy_column(values, pg_type):
+    """Formats one numpy column as a list of COPY text-format values, using \\N for NULL.
+
+    pyogrio.raw returns nullable integer and boolean GeoPackage fields as float64 when they
+    contain NULLs; for integer pg_types those are written as whole numbers ('1', not '1.0').
+    """
+    if values.dtype.kind == 'M':
+        formatted = np.datetime_as_string(values, unit='D' if pg_type == 'date' else 'auto').astype(object)
+        formatted[np.isnat(values)] = r'\N'
+        return formatted.tolist()
+    if values.dtype.kind == 'f' and pg_type in INTEGER_PG_TYPES:
+        missing = np.isnan(values)
+        formatted = np.where(missing, 0, values).astype(np.int64).astype(str).astype(object)
+        formatted[missing] = r'\N'
+        return formatted.tolist()
+    if values.dtype.kind == 'f':
+        formatted = values.astype(str).astype(object)
+        formatted[np.isnan(values)] = r'\N'
+        return formatted.tolist()
+    if values.dtype.kind in 'iub':
+        return values.astype(str).tolist()
+    return [
+        r'\N' if value is None else
+        str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+        for value in values
+    ]
+
+
+def create_table_sql(table_name, fields, dtypes, geometry_type):
+    """Builds the CREATE TABLE statement for a GeoPackage layer with an SRID-typed geometry column."""
+    column_defs = [f"{quote_ident(name)} {pg_type_for_column(name, dtype)}" for name, dtype in zip(fields, dtypes)]
+    column_defs.append(
+        f"{quote_ident(TARGET_GEOMETRY_COLUMN_NAME)} geometry({postgis_geometry_type(geometry_type)}, {TARGET_SRID})"
+    )
+    return f"CREATE TABLE {quote_ident(table_name)} ({', '.join(column_defs)})"
+
+
+def copy_gpkg_rows(cursor, gpkg_file, target_table, fields, pg_types, filters=None):
+    """COPYs every feature of gpkg_file into an existing target_table in COPY_BATCH_SIZE batches.
+
+    filters (geo_files.read_frame form) restricts the features copied. Returns the number of rows
+    copied. The caller owns the transaction. Reading, encoding and sending are timed as separate
+    run_metrics steps of the current stage.
+    """
+    metrics = run_metrics.current()
+    columns_sql = ', '.join(quote_ident(name) for name in list(fields) + [TARGET_GEOMETRY_COLUMN_NAME])
+    copy_sql = f"COPY {quote_ident(target_table)} ({columns_sql}) FROM STDIN"
+    start_time = time.perf_counter()
+    rows_loaded = 0
+    for field_data, geometry in metrics.timed(geo_files.iter_raw_batches(gpkg_file, COPY_BATCH_SIZE, filters), 'read'):
+        with metrics.step('encode'):
+            geoms = shapely.set_srid(shapely.from_wkb(geometry), TARGET_SRID)
+            ewkb = shapely.to_wkb(geoms, hex=True, include_srid=True).astype(object)
+            ewkb[shapely.is_missing(geoms)] = r'\N'
+            columns = [format_copy_column(values, pg_type) for values, pg_type in zip(field_data, pg_types)] + [ewkb.tolist()]
+
+            buffer = io.StringIO()
+            buffer.writelines('\t'.join(row) + '\n' for row in zip(*columns))
+            buffer.seek(0)
+        with metrics.step('copy'):
+            cursor.copy_expert(copy_sql, buffer)
+
+        rows_loaded += len(geometry)
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        logging.debug(f"COPY progress for '{target_table}': {rows_loaded} rows ({rows_loaded / elapsed:,.0f} rows/s).")
+    return rows_loaded
+
+
+# =============================================================================
+# Loader: Bulk COPY FROM STDIN with EWKB Geometry
+# =============================================================================
+def load_with_copy(engine, gpkg_file, table_name, target_table):
+    """Streams a GeoPackage or GeoParquet file into target_table with COPY FROM STDIN in COPY_BATCH_SIZE batches.
+
+    Features are read in batches directly from OGR or Arrow and geometry is sent as hex EWKB tagged with
+    TARGET_SRID, so the file is never materialised as a GeoDataFrame. The table is created and
+    filled in a single transaction. A staging target_table is always recreated from scratch.
+    """
+    info = geo_files.read_info(gpkg_file)
+    fields = list(info['fields'])
+    dtypes = list(info['dtypes'])
+    pg_types = [pg_type_for_column(name, dtype) for name, dtype in zip(fields, dtypes)]
+    total_features = info['features']
+    logging.info(f"Detected geometry column in source file: '{info.get('geometry_name')}' ({info['geometry_type']}), {total_features} features.")
+
+    if_exists = 'replace' if target_table != table_name else IF_EXISTS_MODE
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (quote_ident(target_table),))
+            table_exists = cursor.fetchone()[0] is not None
+            if table_exists and if_exists == 'fail':
+                raise ValueError(f"Table '{target_table}' already exists (if_exists='fail').")
+            if table_exists and if_exists == 'replace':
+                cursor.execute(f"DROP TABLE {quote_ident(target_table)}")
+            if not table_exists or if_exists == 'replace':
+                cursor.execute(create_table_sql(target_table, fields, dtypes, info['geometry_type']))
+
+            logging.info(f"Writing {total_features} features to table '{target_table}' via COPY...")
+            start_time = time.perf_counter()
+            rows_loaded = copy_gpkg_rows(cursor, gpkg_file, target_table, fields, pg_types)
+            copy_elapsed = max(time.perf_counter() - start_time, 1e-9)
+        with run_metrics.current().step('commit'):
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    logging.info(f"Successfully loaded data into table '{target_table}' with geometry column '{TARGET_GEOMETRY_COLUMN_NAME}'.")
+    logging.info(f"Loaded {rows_loaded} rows in {copy_elapsed:.1f}s ({rows_loaded / copy_elapsed:,.0f} rows/s).")
+    run_metrics.current().count(rows_in=total_features, rows_out=rows_loaded)
+
+
+# =============================================================================
+# Indexing, ANALYZE and Atomic Swap
+# =============================================================================
+def index_name(table_name, suffix):
+    """Returns the name used for a table's index with the given suffix."""
+    return f"idx_{table_name}_{suffix}"
+
+
+def build_indexes_and_analyze(engine, target_table, table_name, analyze=True):
+    """Creates the TABLE_INDEXES for table_name on target_table, then runs ANALYZE on it unless analyze is False."""
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for suffix, method, expression in TABLE_INDEXES.get(table_name, DEFAULT_TABLE_INDEXES):
+                start_time = time.perf_counter()
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {quote_ident(index_name(target_table, suffix))} "
+                    f"ON {quote_ident(target_table)} USING {method} ({expression})"
+                )
+                logging.info(f"Built {method} index on {target_table}({expression}) in {time.perf_counter() - start_time:.1f}s.")
+            if analyze:
+                cursor.execute(f"ANALYZE {quote_ident(target_table)}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def swap_in_staging_table(engine, table_name):
+    """Atomically replaces table_name with its staging table, renaming indexes to match.
+
+    Partitions of a partitioned staging table ('<staging>_<label>') and their indexes are renamed
+    to '<table>_<label>' as well. The drop and renames run in one transaction with a lock
+    timeout; if readers hold the live table for longer than SWAP_LOCK_TIMEOUT the swap is rolled
+    back and retried.
+    """
+    staging_table = table_name + STAGING_TABLE_SUFFIX
+    index_suffixes = [suffix for suffix, _, _ in TABLE_INDEXES.get(table_name, DEFAULT_TABLE_INDEXES)]
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                cursor.execute(
+                    "SELECT C.relname FROM pg_inherits I JOIN pg_class C ON C.oid = I.inhrelid "
+                    "WHERE I.inhparent = to_regclass(%s)",
+                    (quote_ident(staging_table),)
+                )
+                renames = [(staging_table, table_name)] + [
+                    (partition, table_name + partition[len(staging_table):]) for partition, in cursor.fetchall()
+                ]
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+                for old_name, new_name in renames:
+                    cursor.execute(f"ALTER TABLE {quote_ident(old_name)} RENAME TO {quote_ident(new_name)}")
+                    for suffix in index_suffixes:
+                        cursor.execute(
+                            f"ALTER INDEX IF EXISTS {quote_ident(index_name(old_name, suffix))} "
+                            f"RENAME TO {quote_ident(index_name(new_name, suffix))}"
+                        )
+            connection.commit()
+            logging.info(f"Swapped '{staging_table}' in as '{table_name}'.")
+            return
+        except Exception as e:
+            connection.rollback()
+            if getattr(e, 'pgcode', None) != '55P03' or attempt == SWAP_ATTEMPTS: # 55P03 = lock_not_available
+                raise
+            logging.warning(f"Swap of '{table_name}' timed out waiting for readers (attempt {attempt}/{SWAP_ATTEMPTS}); retrying...")
+            time.sleep(SWAP_RETRY_DELAY_SECONDS)
+        finally:
+            connection.close()
+
+
+def load_file_into_table(engine, loader, gpkg_file, table_name):
+    """Loads one GeoPackage with loader, builds indexes and ANALYZEs before the table goes live.
+
+    In 'replace' mode the data goes into a staging table that is swapped in atomically; other
+    modes write to table_name directly.
+    """
+    metrics = run_metrics.current()
+    use_staging = IF_EXISTS_MODE == 'replace'
+    target_table = table_name + STAGING_TABLE_SUFFIX if use_staging else table_name
+    loader(engine, gpkg_file, table_name, target_table)
+    with metrics.step('index'):
+        build_indexes_and_analyze(engine, target_table, table_name)
+    if use_staging:
+        with metrics.step('swap'):
+            swap_in_staging_table(engine, table_name)
+
+
+# =============================================================================
+# Partitioned Crash Load: One Partition per Year, Loaded in Parallel
+# =============================================================================
+def partition_table_name(table_name, label):
+    """Returns the name of table_name's partition with the given label (e.g. 'y2019', 'default')."""
+    return f"{table_name}_{label}"
+
+
+def crash_partitions(gpkg_file):
+    """Plans the partitions for the crashes in gpkg_file from its PARTITION_KEY_COLUMN alone.
+
+    Returns (label, bounds clause, read filters, row count) per partition, largest first so the
+    longest loads start first: one per calendar year from the first to the last year present
+    (years without crashes get an empty partition, so the ranges are contiguous), plus the
+    DEFAULT partition for NULL dates (always created, possibly empty).
+    """
+    dates = geo_files.read_column(gpkg_file, PARTITION_KEY_COLUMN)
+    missing = np.isnat(dates)
+    present, present_counts = np.unique(dates[~missing].astype('datetime64[Y]').astype(np.int64) + 1970, return_counts=True)
+    years = np.arange(present[0], present[-1] + 1) if len(present) else present
+    counts = np.zeros(len(years), dtype=np.int64)
+    counts[np.searchsorted(years, present)] = present_counts
+    partitions = []
+    for year, rows in zip(years.tolist(), counts.tolist()):
+        start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        partitions.append((
+            f"y{year}", f"FOR VALUES FROM ('{start}') TO ('{end}')",
+            [(PARTITION_KEY_COLUMN, '>=', start), (PARTITION_KEY_COLUMN, '<', end)], rows,
+        ))
+    partitions.append((DEFAULT_PARTITION_LABEL, 'DEFAULT', [(PARTITION_KEY_COLUMN, 'is null', None)], int(missing.sum())))
+    return sorted(partitions, key=lambda partition: partition[3], reverse=True)
+
+
+def load_crash_partition(engine, gpkg_file, partition_table, filters, rows, fields, pg_types):
+    """COPYs one partition's rows and builds its indexes, retrying just this partition on failure.
+
+    The COPY is committed before the index build and every attempt starts by truncating the
+    partition, so a retry never duplicates rows. Returns the number of rows copied.
+    """
+    for attempt in range(1, PARTITION_LOAD_ATTEMPTS + 1):
+        start_time = time.perf_counter()
+        try:
+            connection = engine.raw_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"TRUNCATE {quote_ident(partition_table)}")
+                    rows_loaded = copy_gpkg_rows(cursor, gpkg_file, partition_table, fields, pg_types, filters) if rows else 0
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.close()
+            # The parent's ANALYZE afterwards samples every partition, so partitions skip their own
+            build_indexes_and_analyze(engine, partition_table, PARTITIONED_TABLE, analyze=False)
+            logging.info(f"Loaded and indexed partition '{partition_table}' ({rows_loaded} rows) in {time.perf_counter() - start_time:.1f}s.")
+            return rows_loaded
+        except Exception as e:
+            if attempt == PARTITION_LOAD_ATTEMPTS:
+                raise
+            logging.warning(f"Loading partition '{partition_table}' failed (attempt {attempt}/{PARTITION_LOAD_ATTEMPTS}): {e}; retrying...")
+            time.sleep(PARTITION_RETRY_DELAY_SECONDS)
+
+
+def load_partitioned_crashes(engine, gpkg_file, workers=PARTITION_LOAD_WORKERS):
+    """Loads gpkg_file as PARTITIONED_TABLE range-partitioned by year, partitions in parallel.
+
+    The staging parent and its partitions are created up front. A thread pool of workers then
+    COPYs each partition straight from its own filtered read of the file and indexes it, each on
+    a pooled connection. Threads are enough because COPY parsing, index builds and ANALYZE run
+    in server backends, and GDAL/Arrow reads and shapely's WKB conversion release the GIL. The
+    parent's indexes are created last (attaching the partition indexes rather than rebuilding
+    them), then the table is analyzed and swapped in like any other staging table. If any
+    partition still fails after PARTITION_LOAD_ATTEMPTS, the live table is left untouched.
+    """
+    metrics = run_metrics.current()
+    staging_table = PARTITIONED_TABLE + STAGING_TABLE_SUFFIX
+    info = geo_files.read_info(gpkg_file)
+    fields = list(info['fields'])
+    dtypes = list(info['dtypes'])
+    pg_types = [pg_type_for_column(name, dtype) for name, dtype in zip(fields, dtypes)]
+    with metrics.step('plan'):
+        partitions = crash_partitions(gpkg_file)
+    logging.info(f"Loading {info['features']} features into {len(partitions)} partitions of '{staging_table}' with {workers} workers...")
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(staging_table)}")
+            cursor.execute(
+                create_table_sql(staging_table, fields, dtypes, info['geometry_type'])
+                + f" PARTITION BY RANGE ({quote_ident(PARTITION_KEY_COLUMN)})"
+            )
+            for label, bounds, _, _ in partitions:
+                cursor.execute(
+                    f"CREATE TABLE {quote_ident(partition_table_name(staging_table, label))} "
+                    f"PARTITION OF {quote_ident(staging_table)} {bounds}"
+                )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    start_time = time.perf_counter()
+    rows_loaded = 0
+    failed_partitions = []
+    with metrics.step('partitions'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    load_crash_partition, engine, gpkg_file, partition_table_name(staging_table, label),
+                    filters, rows, fields, pg_types,
+                ): label
+                for label, _, filters, rows in partitions
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    rows_loaded += future.result()
+                except Exception:
+                    failed_partitions.append(futures[future])
+                    logging.error(f"Partition '{futures[future]}' of '{staging_table}' failed after {PARTITION_LOAD_ATTEMPTS} attempts.", exc_info=True)
+    if failed_partitions:
+        raise RuntimeError(f"{len(failed_partitions)} partitions of '{staging_table}' failed ({', '.join(sorted(failed_partitions))}); '{PARTITIONED_TABLE}' was not replaced.")
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    logging.info(f"Loaded {rows_loaded} rows into {len(partitions)} partitions in {elapsed:.1f}s ({rows_loaded / elapsed:,.0f} rows/s).")
+    metrics.count(rows_in=info['features'], rows_out=rows_loaded)
+
+    with metrics.step('index'):
+        build_indexes_and_analyze(engine, staging_table, PARTITIONED_TABLE)
+    with metrics.step('swap'):
+        swap_in_staging_table(engine, PARTITIONED_TABLE)
+
+
+# =============================================================================
+# Incremental Crash Refresh
+# =============================================================================
+def promote_crash_fingerprints():
+    """Marks the processed crash fingerprints as the snapshot of what is now in the database."""
+    if os.path.exists(CRASHES_FINGERPRINTS_FILENAME):
+        shutil.copyfile(CRASHES_FINGERPRINTS_FILENAME, CRASHES_SNAPSHOT_FILENAME)
+        logging.info(f"Recorded {CRASHES_FINGERPRINTS_FILENAME} as the loaded crash snapshot.")
+
+
+def apply_crash_changes(engine, input_format=geo_files.DEFAULT_FORMAT):
+    """Applies the changeset written by download_data.py to the live crashes table.
+
+    Rows whose key was updated or deleted are removed and the inserted/updated rows are COPYed
+    back in, all in one transaction, so readers see either the old or the new state. Returns
+    False without touching the database if an incremental apply is not possible (no table, no
+    snapshot the changeset was diffed against, or no changeset), so the caller can fall back to
+    a full load.
+    """
+    changes_file = geo_files.with_format(CRASHES_CHANGES_FILENAME, input_format)
+    for required in (CRASHES_SNAPSHOT_FILENAME, changes_file, CRASHES_DELETED_FILENAME):
+        if not os.path.exists(required):
+            logging.info(f"Incremental refresh unavailable ({required} not found); doing a full load.")
+            return False
+
+    info = geo_files.read_info(changes_file)
+    fields = list(info['fields'])
+    pg_types = [pg_type_for_column(name, dtype) for name, dtype in zip(fields, info['dtypes'])]
+    key_sql = quote_ident(CRASHES_KEY_COLUMN)
+    table_sql = quote_ident(INCREMENTAL_TABLE)
+    columns_sql = ', '.join(quote_ident(name) for name in fields + [TARGET_GEOMETRY_COLUMN_NAME])
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (table_sql,))
+            if cursor.fetchone()[0] is None:
+                logging.info(f"Table '{INCREMENTAL_TABLE}' does not exist yet; doing a full load.")
+                return False
+
+            start_time = time.perf_counter()
+            cursor.execute(f"CREATE TEMP TABLE crash_upserts (LIKE {table_sql}) ON COMMIT DROP")
+            upserted = copy_gpkg_rows(cursor, changes_file, 'crash_upserts', fields, pg_types)
+            cursor.execute(f"CREATE TEMP TABLE crash_deletes ({key_sql} bigint) ON COMMIT DROP")
+            with open(CRASHES_DELETED_FILENAME, 'r', encoding='utf-8') as deleted_file:
+                cursor.copy_expert(f"COPY crash_deletes ({key_sql}) FROM STDIN WITH (FORMAT csv, HEADER)", deleted_file)
+            cursor.execute("SELECT COUNT(*) FROM crash_deletes")
+            deleted = cursor.fetchone()[0]
+
+            cursor.execute(
+                f"CREATE TEMP TABLE crash_changed_keys ON COMMIT DROP AS "
+                f"SELECT {key_sql} FROM crash_upserts UNION SELECT {key_sql} FROM crash_deletes"
+            )
+            cursor.execute("SELECT to_regclass(%s)", (quote_ident(ROLLUP_TABLE),))
+            has_rollup = cursor.fetchone()[0] is not None
+            if has_rollup:
+                # Cells touched by the old or the new version of any changed row
+                cursor.execute(
+                    f"CREATE TEMP TABLE crash_rollup_cells ON COMMIT DROP AS "
+                    f"SELECT DISTINCT C.locality, C.crash_date FROM {table_sql} C JOIN crash_changed_keys K USING ({key_sql}) "
+                    f"UNION SELECT DISTINCT locality, crash_date FROM crash_upserts"
+                )
+
+            cursor.execute(f"DELETE FROM {table_sql} C USING crash_changed_keys K WHERE C.{key_sql} = K.{key_sql}")
+            removed = cursor.rowcount
+            cursor.execute(f"INSERT INTO {table_sql} ({columns_sql}) SELECT {columns_sql} FROM crash_upserts")
+            cursor.execute(f"ANALYZE {table_sql}")
+            if has_rollup:
+                with run_metrics.current().step('rollup'):
+                    refresh_rollup_cells(cursor)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    logging.info(
+        f"Applied incremental crash refresh in {elapsed:.1f}s: {upserted} rows inserted/updated, "
+        f"{deleted} keys deleted ({removed} existing rows replaced or removed)."
+    )
+    run_metrics.current().count(rows_in=info['features'], rows_out=upserted)
+    promote_crash_fingerprints()
+    if not has_rollup:
+        with run_metrics.current().step('rollup'):
+            build_crash_rollup(engine)
+    return True
+
+
+# =============================================================================
+# Rollup Cube: Crash Counts by Locality x Month x Severity x Hour x Day of Week
+# =============================================================================
+def rollup_select_sql(cells_join=''):
+    """Returns the aggregation that produces rollup rows from crashes, optionally restricted by a join."""
+    dims_sql = ', '.join(f"C.{quote_ident(dim)}" for dim in ROLLUP_DIMENSIONS)
+    return (
+        f"SELECT {dims_sql}, COUNT(*)::integer AS crash_count "
+        f"FROM {quote_ident(INCREMENTAL_TABLE)} C {cells_join} GROUP BY {dims_sql}"
+    )
+
+
+def build_crash_rollup(engine):
+    """Rebuilds ROLLUP_TABLE from crashes in a staging table, indexes it and swaps it in."""
+    staging_table = ROLLUP_TABLE + STAGING_TABLE_SUFFIX
+    start_time = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(staging_table)}")
+            cursor.execute(f"CREATE TABLE {quote_ident(staging_table)} AS {rollup_select_sql()}")
+            cells = cursor.rowcount
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    build_indexes_and_analyze(engine, staging_table, ROLLUP_TABLE)
+    swap_in_staging_table(engine, ROLLUP_TABLE)
+    logging.info(f"Built '{ROLLUP_TABLE}' with {cells} cells in {time.perf_counter() - start_time:.1f}s.")
+
+
+def refresh_rollup_cells(cursor):
+    """Recomputes the rollup rows for the (locality, crash_date) cells in temp table crash_rollup_cells.
+
+    Runs inside the caller's transaction, after the crash changes have been applied.
+    """
+    cursor.execute(
+        f"DELETE FROM {quote_ident(ROLLUP_TABLE)} R USING crash_rollup_cells A "
+        f"WHERE R.locality IS NOT DISTINCT FROM A.locality AND R.crash_date IS NOT DISTINCT FROM A.crash_date"
+    )
+    removed = cursor.rowcount
+    dims_sql = ', '.join(quote_ident(dim) for dim in ROLLUP_DIMENSIONS)
+    cursor.execute(
+        f"INSERT INTO {quote_ident(ROLLUP_TABLE)} ({dims_sql}, crash_count) " + rollup_select_sql(
+            "JOIN crash_rollup_cells A ON C.locality IS NOT DISTINCT FROM A.locality "
+            "AND C.crash_date IS NOT DISTINCT FROM A.crash_date"
+        )
+    )
+    logging.info(f"Refreshed '{ROLLUP_TABLE}': replaced {removed} cells with {cursor.rowcount}.")
+    cursor.execute(f"ANALYZE {quote_ident(ROLLUP_TABLE)}")
+
+
+LOADERS = {
+    'copy': load_with_copy,
+    'to_postgis': load_with_to_postgis,
+}
+
+
+# =============================================================================
+# Main Execution
+# =============================================================================
+def parse_args(argv=None):
+    """Parses command-line options for the database load."""
+    parser = argparse.ArgumentParser(description="Load processed GeoPackage/GeoParquet files into PostGIS.")
+    parser.add_argument(
+        '--method', choices=sorted(LOADERS), default=LOAD_METHOD,
+        help=f"Loader to use (default: {LOAD_METHOD})",
+    )
+    parser.add_argument(
+        '--format', choices=sorted(geo_files.FORMAT_EXTENSIONS), default=geo_files.DEFAULT_FORMAT,
+        help=f"Format of the files written by download_data.py (default: {geo_files.DEFAULT_FORMAT})",
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help=f"Apply only the changed '{INCREMENTAL_TABLE}' rows computed by download_data.py instead of a full rebuild",
+    )
+    parser.add_argument(
+        '--partitioned', action='store_true',
+        help=f"Create '{PARTITIONED_TABLE}' range-partitioned by year and load its partitions in parallel (copy method only)",
+    )
+    parser.add_argument(
+        '--workers', type=int, default=PARTITION_LOAD_WORKERS,
+        help=f"Partitions loaded at once, each on its own pooled connection, with --partitioned (default: {PARTITION_LOAD_WORKERS})",
+    )
+    parser.add_argument(
+        '--metrics-file', default=run_metrics.DEFAULT_METRICS_FILE,
+        help=f"JSON-lines file each table load's metrics are appended to; empty disables it (default: {run_metrics.DEFAULT_METRICS_FILE})",
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help="Also write the run's metrics to this Prometheus textfile (e.g. for node_exporter's textfile collector)",
+    )
+    parser.add_argument(
+        '--profile', choices=run_metrics.PROFILE_MODES,
+        help="Profile every table load with cProfile (.prof files in --profile-dir) or tracemalloc (top allocations in the metrics)",
+    )
+    parser.add_argument(
+        '--profile-dir', default=run_metrics.DEFAULT_PROFILE_DIR,
+        help=f"Directory for cProfile output (default: {run_metrics.DEFAULT_PROFILE_DIR})",
+    )
+    args = parser.parse_args(argv)
+    if args.partitioned and (args.method != 'copy' or IF_EXISTS_MODE != 'replace'):
+        parser.error("--partitioned needs --method copy and IF_EXISTS_MODE = 'replace'")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def main(argv=None):
+    """Loads every file in FILES_TO_LOAD into its PostGIS table."""
+    args = parse_args(argv)
+    run_metrics.start_run('load_to_db', args.metrics_file, args.metrics_textfile, args.profile, args.profile_dir)
+    engine = create_db_engine(max(DB_POOL_SIZE, args.workers) if args.partitioned else DB_POOL_SIZE)
+    loader = LOADERS[args.method]
+    failed_tables = []
+
+    # --- Load Data ---
+    logging.info(f"Starting data loading process (if_exists='{IF_EXISTS_MODE}', method='{args.method}', partitioned={args.partitioned})...")
+
+    for gpkg_file, table_name in FILES_TO_LOAD:
+        gpkg_file = geo_files.with_format(gpkg_file, args.format)
+        logging.info(f"Processing file: {gpkg_file} -> Table: {table_name}")
+
+        if not os.path.exists(gpkg_file):
+            logging.warning(f"File not found: {gpkg_file}. Skipping.")
+            continue
+
+        try:
+            with run_metrics.stage(f"load_{table_name}") as metrics:
+                if table_name == INCREMENTAL_TABLE and args.incremental and apply_crash_changes(engine, args.format):
+                    continue
+                if table_name == PARTITIONED_TABLE and args.partitioned:
+                    load_partitioned_crashes(engine, gpkg_file, args.workers)
+                else:
+                    load_file_into_table(engine, loader, gpkg_file, table_name)
+                if table_name == INCREMENTAL_TABLE:
+                    promote_crash_fingerprints()
+                    with metrics.step('rollup'):
+                        build_crash_rollup(engine)
+        except FileNotFoundError:
+            failed_tables.append(table_name)
+            logging.error(f"File not found error during processing: {gpkg_file}. Make sure it's accessible.")
+        except Exception as e:
+            failed_tables.append(table_name)
+            logging.error(f"Failed to load {gpkg_file} into table {table_name}.", exc_info=True)
+            # Optionally: stop script on first error
+            # logging.critical("Stopping script due to error.")
+            # sys.exit(1)
+
+    run_metrics.finish_run(success=not failed_tables)
+    logging.info("Script finished.")
 
-    except FileNotFoundError:
-        logging.error(f"File not found error during processing: {gpkg_file}. Make sure it's accessible.")
-    except Exception as e:
-        logging.error(f"Failed to load {gpkg_file} into table {table_name}.", exc_info=True)
-        # Optionally: stop script on first error
-        # logging.critical("Stopping script due to error.")
-        # sys.exit(1)
 
-logging.info("Script finished.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+# =============================================================================
+# Structured per-stage run metrics for download_data.py and load_to_db.py.
+#
+# A stage (one pipeline function, one table load) runs inside stage(name). Code in the stage
+# reaches its StageMetrics through current() to count rows and time named steps (parse, filter,
+# write, COPY, ...). When the stage ends, one JSON line is appended to the metrics file with:
+#   duration_seconds, cpu_seconds      wall and CPU time of the stage
+#   rows_in, rows_out                  set by the stage (null if it does not count rows)
+#   read_bytes, written_bytes          bytes through read/write syscalls (/proc/self/io rchar/wchar),
+#                                      so downloads, file I/O and database traffic all count
+#   peak_rss_bytes                     peak resident memory during the stage (VmHWM, reset when the
+#                                      stage starts); peak_rss_scope is 'process' where it cannot be reset
+#   steps                              seconds spent in each named step
+# finish_run() renders the run's records as a Prometheus textfile for node_exporter's textfile
+# collector. Process pools hand the run's settings to their workers with init_worker(), so stages
+# run in worker processes report to the same run. Outside start_run()/finish_run() stages are
+# measured and logged but not written anywhere.
+# =============================================================================
+
+# --- Configuration ---
+DEFAULT_METRICS_FILE = "qld_run_metrics.jsonl"
+DEFAULT_PROFILE_DIR = "profiles"
+PROFILE_MODES = ['cprofile', 'tracemalloc']
+TRACEMALLOC_TOP_ALLOCATIONS = 10 # Largest allocation sites still held when a stage ends (tracemalloc profiling)
+PROMETHEUS_PREFIX = "qld_pipeline"
+# Record fields exported as Prometheus gauges: (field, metric name suffix, help text)
+PROMETHEUS_STAGE_GAUGES = [
+    ('duration_seconds', 'stage_duration_seconds', "Wall time of the stage."),
+    ('cpu_seconds', 'stage_cpu_seconds', "CPU time of the stage."),
+    ('rows_in', 'stage_rows_in', "Rows the stage read."),
+    ('rows_out', 'stage_rows_out', "Rows the stage wrote."),
+    ('read_bytes', 'stage_read_bytes', "Bytes read through read syscalls during the stage."),
+    ('written_bytes', 'stage_written_bytes', "Bytes written through write syscalls during the stage."),
+    ('peak_rss_bytes', 'stage_peak_rss_bytes', "Peak resident set size during the stage."),
+    ('success', 'stage_success', "1 if the stage succeeded, 0 if it failed."),
+]
+
+_active_stages = [] # Stages currently running in this process, innermost last
+_run_settings = {} # Settings of the run started in (or handed to) this process
+
+
+# =============================================================================
+# Helper Functions: Process Counters
+# =============================================================================
+def read_io_counters():
+    """Returns (rchar, wchar) for this process from /proc/self/io, or (None, None) where unavailable."""
+    try:
+        with open('/proc/self/io', 'r', encoding='ascii') as f:
+            counters = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def read_peak_rss():
+    """Returns this process's peak resident set size in bytes (VmHWM, else ru_maxrss)."""
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            match = re.search(r'^VmHWM:\s+(\d+) kB', f.read(), re.MULTILINE)
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # ru_maxrss is KiB on Linux, bytes on macOS
+
+
+def reset_peak_rss():
+    """Resets VmHWM to the current RSS (Linux 4.0+); returns False if the peak cannot be reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# =============================================================================
+# Helper Functions: Run Settings
+# =============================================================================
+def start_run(script, metrics_file=DEFAULT_METRICS_FILE, textfile=None, profile=None, profile_dir=DEFAULT_PROFILE_DIR):
+    """Starts a run whose stages report to metrics_file (JSON lines; empty or None disables it).
+
+    textfile is the Prometheus textfile written by finish_run(). profile ('cprofile' or
+    'tracemalloc') profiles every top-level stage; cProfile output goes to profile_dir.
+    Returns the settings; pass them to worker processes through init_worker().
+    """
+    settings = {
+        'run_id': f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}",
+        'script': script,
+        'metrics_file': os.path.abspath(metrics_file) if metrics_file else None,
+        'textfile': os.path.abspath(textfile) if textfile else None,
+        'profile': profile,
+        'profile_dir': os.path.abspath(profile_dir),
+    }
+    init_worker(settings)
+    return settings
+
+
+def init_worker(settings):
+    """Makes this process report to the run with settings; use as a process pool's initializer."""
+    _run_settings.clear()
+    _run_settings.update(settings)
+
+
+def load_settings():
+    """Returns the settings of the current run, or {} outside start_run()."""
+    return dict(_run_settings)
+
+
+# =============================================================================
+# Stage Measurements
+# =============================================================================
+class StageMetrics:
+    """Counters of one running stage; rows_in/rows_out are filled in by the stage itself."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.success = None
+        self.steps = {}
+        self.child_peak_rss = 0 # Peak of nested stages, which reset VmHWM while they ran
+        self._lock = threading.Lock() # Worker threads of a stage may count and time steps concurrently
+
+    def count(self, rows_in=0, rows_out=0):
+        """Adds to the stage's row counters."""
+        with self._lock:
+            self.rows_in = (self.rows_in or 0) + rows_in
+            self.rows_out = (self.rows_out or 0) + rows_out
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """Adds the time spent in the with-block to step name (steps may repeat, e.g. per chunk).
+
+        Steps timed from several threads at once add up, so they can exceed the stage's wall time.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._lock:
+                self.steps[name] = self.steps.get(name, 0.0) + elapsed
+
+    def timed(self, iterable, step_name):
+        """Yields from iterable, timing each fetch as step_name (e.g. reading a chunked file)."""
+        iterator = iter(iterable)
+        while True:
+            with self.step(step_name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+
+def current():
+    """Returns the innermost running stage, or a detached StageMetrics that is never reported."""
+    return _active_stages[-1] if _active_stages else StageMetrics(None)
+
+
+def start_profile(mode):
+    """Starts the per-stage profiler for mode; returns a handle for stop_profile."""
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if mode == 'tracemalloc':
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return started
+    return None
+
+
+def stop_profile(mode, handle, settings, stage_name):
+    """Stops the per-stage profiler and returns the fields it adds to the stage record."""
+    if mode == 'cprofile':
+        handle.disable()
+        os.makedirs(settings['profile_dir'], exist_ok=True)
+        path = os.path.join(settings['profile_dir'], f"{settings['run_id']}_{settings['script']}_{stage_name}.prof")
+        handle.dump_stats(path)
+        return {'profile_path': path}
+    if mode == 'tracemalloc':
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP_ALLOCATIONS]
+        if handle:
+            tracemalloc.stop()
+        return {
+            'tracemalloc_peak_bytes': peak,
+            'tracemalloc_top': [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size} B in {stat.count} blocks" for stat in top],
+        }
+    return {}
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Measures the with-block as stage name and reports it when the block ends.
+
+    Set metrics.success from the stage's return value; an exception escaping the block marks the
+    stage failed and is re-raised. Only top-level stages are profiled, because cProfile and
+    tracemalloc's peak cannot nest.
+    """
+    settings = load_settings()
+    metrics = StageMetrics(name)
+    for parent in _active_stages:
+        parent.child_peak_rss = max(parent.child_peak_rss, read_peak_rss())
+    peak_is_per_stage = reset_peak_rss()
+    profile_mode = settings.get('profile') if not _active_stages else None
+    read_start, written_start = read_io_counters()
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    profile_handle = start_profile(profile_mode)
+    _active_stages.append(metrics)
+    try:
+        yield metrics
+    except BaseException:
+        metrics.success = False
+        raise
+    finally:
+        _active_stages.pop()
+        profile_fields = stop_profile(profile_mode, profile_handle, settings, name)
+        duration = time.perf_counter() - start_time
+        read_end, written_end = read_io_counters()
+        peak_rss = max(read_peak_rss(), metrics.child_peak_rss)
+        if _active_stages:
+            _active_stages[-1].child_peak_rss = max(_active_stages[-1].child_peak_rss, peak_rss)
+        record = {
+            'run_id': settings.get('run_id'),
+            'script': settings.get('script'),
+            'stage': name,
+            'pid': os.getpid(),
+            'started_at': started_at,
+            'success': metrics.success is not False,
+            'duration_seconds': round(duration, 3),
+            'cpu_seconds': round(time.process_time() - cpu_start, 3),
+            'rows_in': metrics.rows_in,
+            'rows_out': metrics.rows_out,
+            'read_bytes': read_end - read_start if read_start is not None else None,
+            'written_bytes': written_end - written_start if written_start is not None else None,
+            'peak_rss_bytes': peak_rss,
+            'peak_rss_scope': 'stage' if peak_is_per_stage else 'process',
+            'steps': {step: round(seconds, 3) for step, seconds in metrics.steps.items()},
+            **profile_fields,
+        }
+        report_stage(record, settings)
+
+
+def format_bytes(value):
+    """Formats a byte count in MiB for log messages."""
+    return 'n/a' if value is None else f"{value / 1_048_576:.1f} MiB"
+
+
+def report_stage(record, settings):
+    """Logs a one-line summary of a stage record and appends it to the run's metrics file."""
+    steps = ', '.join(f"{step} {seconds:.1f}s" for step, seconds in sorted(record['steps'].items(), key=lambda item: -item[1]))
+    logging.info(
+        f"[Metrics] Stage '{record['stage']}' {'ok' if record['success'] else 'FAILED'} in {record['duration_seconds']:.1f}s: "
+        f"rows {record['rows_in']} -> {record['rows_out']}, read {format_bytes(record['read_bytes'])}, "
+        f"written {format_bytes(record['written_bytes'])}, peak RSS {format_bytes(record['peak_rss_bytes'])}"
+        + (f" ({steps})" if steps else "")
+    )
+    if settings.get('metrics_file'):
+        # One short write per line on an O_APPEND file, so worker processes do not interleave
+        with open(settings['metrics_file'], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+# =============================================================================
+# Main Function: Prometheus Textfile for the Finished Run
+# =============================================================================
+def read_run_records(settings):
+    """Returns the records of the current run from its metrics file, latest per stage."""
+    records = {}
+    if not settings.get('metrics_file') or not os.path.exists(settings['metrics_file']):
+        return records
+    with open(settings['metrics_file'], 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('run_id') == settings['run_id']:
+                records[record['stage']] = record
+    return records
+
+
+def prometheus_labels(**labels):
+    """Formats Prometheus labels, escaping backslashes, quotes and newlines."""
+    escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped.items()) + '}'
+
+
+def finish_run(success):
+    """Writes the current run's stage records, plus the run outcome, to the Prometheus textfile.
+
+    Does nothing unless start_run() was given a textfile. The file is replaced atomically so the
+    textfile collector never reads a partial file. Stages after finish_run() are no longer reported.
+    """
+    settings = load_settings()
+    _run_settings.clear()
+    if not settings.get('textfile'):
+        return
+    if not settings.get('metrics_file'):
+        logging.warning("[Metrics] The Prometheus textfile is built from the metrics file, which is disabled; skipping it.")
+        return
+    records = read_run_records(settings)
+    script = settings['script']
+    lines = []
+    for field, suffix, help_text in PROMETHEUS_STAGE_GAUGES:
+        samples = [(stage_name, record[field]) for stage_name, record in records.items() if record.get(field) is not None]
+        if not samples:
+            continue
+        lines += [f"# HELP {PROMETHEUS_PREFIX}_{suffix} {help_text}", f"# TYPE {PROMETHEUS_PREFIX}_{suffix} gauge"]
+        lines += [f"{PROMETHEUS_PREFIX}_{suffix}{prometheus_labels(script=script, stage=stage_name)} {float(value)}" for stage_name, value in samples]
+    step_samples = [(stage_name, step, seconds) for stage_name, record in records.items() for step, seconds in record.get('steps', {}).items()]
+    if step_samples:
+        lines += [f"# HELP {PROMETHEUS_PREFIX}_step_duration_seconds Wall time spent in one step of a stage.", f"# TYPE {PROMETHEUS_PREFIX}_step_duration_seconds gauge"]
+        lines += [f"{PROMETHEUS_PREFIX}_step_duration_seconds{prometheus_labels(script=script, stage=stage_name, step=step)} {float(seconds)}" for stage_name, step, seconds in step_samples]
+    lines += [
+        f"# HELP {PROMETHEUS_PREFIX}_run_success 1 if every stage of the last run succeeded.",
+        f"# TYPE {PROMETHEUS_PREFIX}_run_success gauge",
+        f"{PROMETHEUS_PREFIX}_run_success{prometheus_labels(script=script)} {1 if success else 0}",
+        f"# HELP {PROMETHEUS_PREFIX}_run_finished_timestamp_seconds Unix time the last run finished.",
+        f"# TYPE {PROMETHEUS_PREFIX}_run_finished_timestamp_seconds gauge",
+        f"{PROMETHEUS_PREFIX}_run_finished_timestamp_seconds{prometheus_labels(script=script)} {time.time():.0f}",
+    ]
+    tmp_path = settings['textfile'] + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, settings['textfile'])
+    logging.info(f"[Metrics] Wrote {len(records)} stage records to {settings['textfile']}.")
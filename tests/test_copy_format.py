@@ -0,0 +1,84 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import geo_files
+import load_to_db
+
+# =============================================================================
+# format_copy_column: the exact COPY text-format values written for each column type
+# =============================================================================
+
+
+def test_float_with_nan_is_null():
+    values = pd.Series([1.5, np.nan, -2.0, 1e20]).to_numpy()
+    assert load_to_db.format_copy_column(values, 'double precision') == ['1.5', r'\N', '-2.0', '1e+20']
+
+
+def test_float_backed_integer_is_written_as_whole_number():
+    # pyogrio.raw returns a nullable GeoPackage integer as float64 once it holds a NULL.
+    values = pd.Series([1, None, -3], dtype='Int8').to_numpy(dtype='float64', na_value=np.nan)
+    assert load_to_db.format_copy_column(values, 'smallint') == ['1', r'\N', '-3']
+
+
+def test_float_backed_boolean_is_written_as_whole_number():
+    values = pd.Series([True, None, False], dtype='boolean').to_numpy(dtype='float64', na_value=np.nan)
+    assert load_to_db.format_copy_column(values, 'boolean') == ['1', r'\N', '0']
+
+
+def test_object_backed_nullable_integer_and_boolean():
+    # GeoParquet nullable integer and boolean columns are read as object arrays holding None.
+    ints = pd.Series([1, None, -3], dtype='Int8').to_numpy(dtype=object, na_value=None)
+    bools = pd.Series([True, None, False], dtype='boolean').to_numpy(dtype=object, na_value=None)
+    assert load_to_db.format_copy_column(ints, 'smallint') == ['1', r'\N', '-3']
+    assert load_to_db.format_copy_column(bools, 'boolean') == ['True', r'\N', 'False']
+
+
+def test_non_null_integer_and_boolean():
+    assert load_to_db.format_copy_column(pd.Series([7, -1], dtype='int16').to_numpy(), 'smallint') == ['7', '-1']
+    assert load_to_db.format_copy_column(pd.Series([True, False]).to_numpy(), 'boolean') == ['True', 'False']
+
+
+def test_date_and_timestamp():
+    values = pd.Series(pd.to_datetime(['2020-01-02 08:30:00', None, '2021-12-31 23:59:59'])).to_numpy()
+    assert load_to_db.format_copy_column(values.astype('datetime64[D]'), 'date') == ['2020-01-02', r'\N', '2021-12-31']
+    assert load_to_db.format_copy_column(values.astype('datetime64[s]'), 'timestamp') == [
+        '2020-01-02T08:30', r'\N', '2021-12-31T23:59:59',
+    ]
+
+
+def test_text_escapes_tab_newline_and_backslash():
+    # Text columns are read as object arrays holding None for NULL.
+    values = pd.Series(['a\tb', 'c\nd', 'e\\f', 'g\rh', None, r'\N'], dtype=object).to_numpy()
+    assert load_to_db.format_copy_column(values, 'text') == [
+        'a\\tb', 'c\\nd', 'e\\\\f', 'g\\rh', r'\N', '\\\\N',
+    ]
+
+
+@pytest.mark.parametrize('output_format, boolean_text', [('gpkg', ['1', r'\N', '0']), ('parquet', ['True', r'\N', 'False'])])
+def test_columns_read_back_from_file(tmp_path, output_format, boolean_text):
+    gdf = gpd.GeoDataFrame(
+        {
+            'n': pd.Series([1, None, -3], dtype='Int8'),
+            'b': pd.Series([True, None, False], dtype='boolean'),
+            'f': [1.5, np.nan, 2.0],
+            'd': pd.to_datetime(['2020-01-02', None, '2021-12-31']),
+            't': ['a\tb', 'c\nd\\e', None],
+        },
+        geometry=shapely.points([0, 1, 2], [0, 1, 2]),
+        crs='EPSG:4326',
+    )
+    path = str(tmp_path / f'rows.{output_format}')
+    with geo_files.GeoFrameWriter(path) as writer:
+        writer.write(gdf)
+    (field_data, _), = geo_files.iter_raw_batches(path, 10)
+    pg_types = ['smallint', 'boolean', 'double precision', 'date', 'text']
+    assert [load_to_db.format_copy_column(values, pg_type) for values, pg_type in zip(field_data, pg_types)] == [
+        ['1', r'\N', '-3'],
+        boolean_text,
+        ['1.5', r'\N', '2.0'],
+        ['2020-01-02', r'\N', '2021-12-31'],
+        ['a\\tb', 'c\\nd\\\\e', r'\N'],
+    ]
@@ -0,0 +1,125 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import download_data
+import geo_files
+
+# =============================================================================
+# Incremental refresh: fingerprint_crash_rows, collapse_fingerprints, diff_crash_snapshot
+# =============================================================================
+
+
+def crashes_frame(rows):
+    """Builds a processed-crashes frame from (crash_ref_number, crash_severity, crash_date, locality) rows."""
+    keys, severities, dates, localities = zip(*rows)
+    return gpd.GeoDataFrame(
+        {
+            'crash_ref_number': np.array(keys, dtype='int64'),
+            'crash_severity': list(severities),
+            'crash_date': pd.to_datetime(list(dates)),
+            'locality': list(localities),
+        },
+        geometry=shapely.points(np.arange(len(rows), dtype=float) + 150, np.full(len(rows), -27.0)),
+        crs='EPSG:4326',
+    ).rename_geometry(download_data.OUTPUT_GEOM_COLUMN_NAME)
+
+
+OLD_ROWS = [
+    (1, 'Minor injury', '2020-01-01', 'Brisbane'),
+    (2, 'Fatal', '2020-02-01', 'Cairns'),
+    (3, 'Property damage only', '2020-03-01', None), # Deleted upstream
+    (4, 'Minor injury', '2020-04-01', 'Mackay'), # Duplicate key, unchanged
+    (4, 'Hospitalisation', '2020-04-01', 'Mackay'),
+    (5, 'Minor injury', '2020-05-01', 'Ipswich'), # Duplicate key, one of its rows updated
+    (5, 'Minor injury', '2020-05-02', 'Ipswich'),
+]
+NEW_ROWS = [
+    (4, 'Hospitalisation', '2020-04-01', 'Mackay'), # Same rows in another order
+    (4, 'Minor injury', '2020-04-01', 'Mackay'),
+    (1, 'Minor injury', '2020-01-01', 'Brisbane'),
+    (2, 'Fatal', '2020-02-01', 'Townsville'), # Updated
+    (5, 'Minor injury', '2020-05-01', 'Ipswich'),
+    (5, 'Medical treatment', '2020-05-02', 'Ipswich'),
+    (6, 'Minor injury', '2020-06-01', None), # Inserted
+]
+
+
+def test_fingerprint_ignores_dtype_and_geometry():
+    gdf = crashes_frame(OLD_ROWS[:3])
+    variant = gdf.copy()
+    variant['crash_ref_number'] = variant['crash_ref_number'].astype('float64')
+    variant['crash_date'] = variant['crash_date'].astype('datetime64[s]')
+    variant['locality'] = variant['locality'].astype('category')
+    variant.geometry = shapely.points(np.zeros(3), np.zeros(3))
+    assert (download_data.fingerprint_crash_rows(gdf) == download_data.fingerprint_crash_rows(variant)).all()
+    changed = gdf.copy()
+    changed.loc[1, 'locality'] = 'Townsville'
+    assert (download_data.fingerprint_crash_rows(gdf) != download_data.fingerprint_crash_rows(changed)).tolist() == [False, True, False]
+
+
+def test_collapse_fingerprints_combines_duplicate_keys():
+    keys = np.array([7, 3, 7, 5, 3], dtype='int64')
+    fingerprints = np.array([0b0001, 0b0010, 0b0100, 0b1000, 0b1010], dtype='uint64')
+    collapsed_keys, collapsed = download_data.collapse_fingerprints(keys, fingerprints)
+    assert collapsed_keys.tolist() == [3, 5, 7]
+    assert collapsed.tolist() == [0b0010 ^ 0b1010, 0b1000, 0b0001 ^ 0b0100]
+    empty_keys, empty = download_data.collapse_fingerprints(np.array([], dtype='int64'), np.array([], dtype='uint64'))
+    assert len(empty_keys) == len(empty) == 0
+
+
+def write_crashes(rows, output_format):
+    with geo_files.GeoFrameWriter(geo_files.with_format(download_data.CRASHES_OUTPUT_FILENAME, output_format)) as writer:
+        writer.write(crashes_frame(rows))
+
+
+def read_changes(output_format):
+    changes = geo_files.read_frame(geo_files.with_format(download_data.CRASHES_CHANGES_FILENAME, output_format))
+    localities = changes['locality'].astype(object).where(changes['locality'].notna(), None)
+    return sorted(zip(changes['crash_ref_number'].astype(int), changes['crash_severity'], localities), key=str)
+
+
+def read_deleted():
+    return pd.read_csv(download_data.CRASHES_DELETED_FILENAME)['crash_ref_number'].tolist()
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_diff_crash_snapshot(tmp_path, monkeypatch, output_format):
+    monkeypatch.chdir(tmp_path)
+
+    # First run: no snapshot, so every row is inserted and nothing is deleted
+    write_crashes(OLD_ROWS, output_format)
+    assert download_data.diff_crash_snapshot(batch_size=3, output_format=output_format)
+    assert [key for key, _, _ in read_changes(output_format)] == [1, 2, 3, 4, 4, 5, 5]
+    assert read_deleted() == []
+    with np.load(download_data.CRASHES_FINGERPRINTS_FILENAME) as fingerprints:
+        assert fingerprints['keys'].tolist() == [1, 2, 3, 4, 5] # Duplicate keys collapsed
+
+    # load_to_db.py advances the snapshot once the rows are loaded
+    os.replace(download_data.CRASHES_FINGERPRINTS_FILENAME, download_data.CRASHES_SNAPSHOT_FILENAME)
+
+    write_crashes(NEW_ROWS, output_format)
+    assert download_data.diff_crash_snapshot(batch_size=3, output_format=output_format)
+    assert read_changes(output_format) == [
+        (2, 'Fatal', 'Townsville'),
+        (5, 'Medical treatment', 'Ipswich'), # Every row of an updated key is rewritten
+        (5, 'Minor injury', 'Ipswich'),
+        (6, 'Minor injury', None),
+    ]
+    assert read_deleted() == [3]
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_diff_crash_snapshot_without_changes_writes_empty_changeset(tmp_path, monkeypatch, output_format):
+    monkeypatch.chdir(tmp_path)
+    write_crashes(OLD_ROWS, output_format)
+    assert download_data.diff_crash_snapshot(batch_size=3, output_format=output_format)
+    os.replace(download_data.CRASHES_FINGERPRINTS_FILENAME, download_data.CRASHES_SNAPSHOT_FILENAME)
+
+    assert download_data.diff_crash_snapshot(batch_size=3, output_format=output_format)
+    assert read_changes(output_format) == []
+    assert read_deleted() == []
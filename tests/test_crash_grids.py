@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import crash_grids
+
+# =============================================================================
+# Hexagon addressing, packed keys and count merging
+# =============================================================================
+
+SQRT3 = np.sqrt(3.0)
+NEIGHBOURS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]
+
+
+@pytest.mark.parametrize('size', [1.0, 250.0])
+def test_known_points_map_to_expected_cells(size):
+    points = np.array([
+        (0.0, 0.0), # Centre of the origin cell
+        (SQRT3, 0.0), # Centre of (1, 0)
+        (SQRT3 / 2, 1.5), # Centre of (0, 1)
+        (-SQRT3 / 2, 1.5), # Centre of (-1, 1)
+        (-SQRT3, -3.0), # Centre of (0, -2)
+        (0.0, 0.95), # Just below the origin cell's top corner
+        (0.1, 1.05), # Just past it, into (0, 1)
+        (0.8, 0.4), # Inside the origin cell, near its right edge
+        (0.9, 0.0), # Just past that edge, into (1, 0)
+    ]) * size
+    q, r = crash_grids.hex_cells(points[:, 0], points[:, 1], size)
+    assert list(zip(q.tolist(), r.tolist())) == [(0, 0), (1, 0), (0, 1), (-1, 1), (0, -2), (0, 0), (0, 1), (0, 0), (1, 0)]
+
+
+def test_cells_are_the_nearest_hexagon_centre():
+    rng = np.random.default_rng(0)
+    size = 3.5
+    x, y = rng.uniform(-1000, 1000, 10_000), rng.uniform(-1000, 1000, 10_000)
+    q, r = crash_grids.hex_cells(x, y, size)
+    cx, cy = crash_grids.hex_centres(q, r, size)
+    distance = np.hypot(x - cx, y - cy)
+    assert (distance <= size + 1e-9).all()
+    for dq, dr in NEIGHBOURS:
+        nx, ny = crash_grids.hex_centres(q + dq, r + dr, size)
+        assert (distance <= np.hypot(x - nx, y - ny) + 1e-9).all()
+
+
+@pytest.mark.parametrize('size', [0.5, 1.0, 1000.0])
+def test_centres_round_trip(size):
+    q, r = np.meshgrid(np.arange(-50, 51), np.arange(-50, 51))
+    q, r = q.ravel(), r.ravel()
+    x, y = crash_grids.hex_centres(q, r, size)
+    cell_q, cell_r = crash_grids.hex_cells(x, y, size)
+    assert (cell_q == q).all() and (cell_r == r).all()
+
+
+def test_pack_unpack_is_identity():
+    rng = np.random.default_rng(1)
+    limit = crash_grids.KEY_COORDINATE_OFFSET
+    q = np.r_[rng.integers(-limit, limit, 1000), -limit, limit - 1, 0, -1]
+    r = np.r_[rng.integers(-limit, limit, 1000), limit - 1, -limit, -1, 0]
+    group = np.r_[rng.integers(0, 1 << crash_grids.KEY_GROUP_BITS, 1000), 0, (1 << crash_grids.KEY_GROUP_BITS) - 1, 7, 0]
+    keys = crash_grids.pack_keys(q, r, group)
+    assert keys.dtype == np.int64
+    assert len(np.unique(keys)) == len(np.unique(np.c_[q, r, group], axis=0))
+    unpacked_q, unpacked_r, unpacked_group = crash_grids.unpack_keys(keys)
+    assert (unpacked_q == q).all() and (unpacked_r == r).all() and (unpacked_group == group).all()
+
+
+def test_pack_keys_rejects_out_of_range_groups():
+    zeros = np.zeros(1, dtype=np.int64)
+    with pytest.raises(ValueError):
+        crash_grids.pack_keys(zeros, zeros, np.array([-1]))
+    with pytest.raises(ValueError):
+        crash_grids.pack_keys(zeros, zeros, np.array([1 << crash_grids.KEY_GROUP_BITS]))
+
+
+def test_merge_counts_sums_duplicate_keys():
+    keys, counts = crash_grids.merge_counts(np.array([30, 10, 30, 20, 10, 30]), np.array([1, 2, 3, 4, 5, 6]))
+    assert keys.tolist() == [10, 20, 30]
+    assert counts.tolist() == [7, 4, 10]
+    assert counts.dtype == np.int64
+
+
+def test_hexbin_counts_merge_across_batches():
+    rng = np.random.default_rng(2)
+    lon, lat = rng.uniform(152.9, 153.1, 5000), rng.uniform(-27.6, -27.4, 5000)
+    group = rng.integers(0, 4, 5000)
+    size = 500.0
+    whole_keys, whole_counts = crash_grids.hexbin_counts(lon, lat, group, size)
+    batches = [crash_grids.hexbin_counts(lon[i:i + 1200], lat[i:i + 1200], group[i:i + 1200], size) for i in range(0, 5000, 1200)]
+    keys, counts = crash_grids.merge_counts(np.concatenate([k for k, _ in batches]), np.concatenate([c for _, c in batches]))
+    assert (keys == whole_keys).all() and (counts == whole_counts).all()
+    assert counts.sum() == 5000
+
+    # Every point lies within one circumradius of its cell's centre
+    x, y = crash_grids.web_mercator(lon, lat)
+    q, r = crash_grids.hex_cells(x, y, size)
+    cx, cy = crash_grids.hex_centres(q, r, size)
+    assert (np.hypot(x - cx, y - cy) <= size + 1e-6).all()
@@ -0,0 +1,63 @@
+import json
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+
+import download_data
+import geo_files
+
+# =============================================================================
+# CRASHES_OUT_OF_STATE_POLICY: the QLD_EXTENT filter and locality assignment
+# =============================================================================
+
+CRASHES = pd.DataFrame({
+    'Crash_Ref_Number': [1, 2, 3, 4, 5],
+    'Crash_Year': [2020] * 5,
+    'Crash_Month': ['January'] * 5,
+    'Crash_Longitude': [153.02, 0.0, 151.2, -27.4, None], # Brisbane, zeroes, Sydney, swapped, missing
+    'Crash_Latitude': [-27.47, 0.0, -33.87, 153.0, -27.0],
+})
+
+
+def write_localities(output_format):
+    localities = gpd.GeoDataFrame(
+        {'locality': ['Brisbane City']}, geometry=[shapely.box(152.9, -27.6, 153.1, -27.4)], crs=download_data.CRS_GDA2020,
+    ).rename_geometry(download_data.OUTPUT_GEOM_COLUMN_NAME)
+    geo_files.write_frame(localities, geo_files.with_format(download_data.LOCALITIES_OUTPUT_FILENAME, output_format))
+
+
+def build_and_assign(output_format):
+    gdf, dropped = download_data.build_crash_geodataframe(CRASHES.copy())
+    with geo_files.GeoFrameWriter(geo_files.with_format(download_data.CRASHES_OUTPUT_FILENAME, output_format)) as writer:
+        writer.write(gdf)
+    write_localities(output_format)
+    assert download_data.assign_crash_localities(batch_size=2, output_format=output_format)
+    crashes = geo_files.read_frame(geo_files.with_format(download_data.CRASHES_OUTPUT_FILENAME, output_format))
+    localities = crashes['locality'].astype(object).where(crashes['locality'].notna(), None)
+    with open(download_data.QUALITY_REPORT_FILENAME) as f:
+        report = json.load(f)['crash_locations']
+    return dropped, dict(zip(crashes['crash_ref_number'].astype(int), localities)), report
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_flag_policy_keeps_crashes_outside_extent(tmp_path, monkeypatch, output_format):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_data, 'CRASHES_OUT_OF_STATE_POLICY', 'flag')
+    dropped, localities, report = build_and_assign(output_format)
+    assert dropped == {'invalid_date': 0, 'before_cutoff': 0, 'null_coords': 1, 'invalid_coords': 1, 'out_of_extent': 0}
+    assert localities == {1: 'Brisbane City', 2: None, 3: None}
+    assert report['out_of_state'] == 2
+    assert report['out_of_state_policy'] == 'flag'
+    assert sorted(report['out_of_state_examples']) == [2, 3]
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_drop_policy_drops_crashes_outside_extent(tmp_path, monkeypatch, output_format):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_data, 'CRASHES_OUT_OF_STATE_POLICY', 'drop')
+    dropped, localities, report = build_and_assign(output_format)
+    assert dropped == {'invalid_date': 0, 'before_cutoff': 0, 'null_coords': 1, 'invalid_coords': 1, 'out_of_extent': 2}
+    assert localities == {1: 'Brisbane City'}
+    assert report['out_of_state'] == 0
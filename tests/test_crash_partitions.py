@@ -0,0 +1,80 @@
+import datetime
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import geo_files
+import load_to_db
+
+# =============================================================================
+# crash_partitions: year ranges that cover every crash exactly once
+# =============================================================================
+
+CRASH_DATES = [
+    '2011-01-01', '2011-12-31 23:59:59', '2012-01-01', '2012-06-01', '2012-12-01',
+    None, '2014-01-01', '2014-12-31', None, '2016-07-15', '2011-05-01',
+] # No crashes in 2013 or 2015
+
+
+def write_crashes(path, dates):
+    gdf = gpd.GeoDataFrame(
+        {
+            'crash_ref_number': np.arange(len(dates), dtype='int64'),
+            load_to_db.PARTITION_KEY_COLUMN: pd.to_datetime(pd.Series(dates, dtype=object), format='ISO8601'),
+        },
+        geometry=shapely.points(np.full(len(dates), 153.0), np.full(len(dates), -27.5)),
+        crs='EPSG:7844',
+    )
+    with geo_files.GeoFrameWriter(path) as writer:
+        writer.write(gdf)
+
+
+def read_partition_refs(path, filters):
+    fields = list(geo_files.read_info(path)['fields'])
+    refs = [batch[fields.index('crash_ref_number')] for batch, _ in geo_files.iter_raw_batches(path, 4, filters)]
+    return np.concatenate(refs).astype(np.int64).tolist() if refs else []
+
+
+def year_range(bounds):
+    start, end = re.fullmatch(r"FOR VALUES FROM \('(\d{4}-\d{2}-\d{2})'\) TO \('(\d{4}-\d{2}-\d{2})'\)", bounds).groups()
+    return datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_partitions_cover_every_row_once(tmp_path, output_format):
+    path = str(tmp_path / f'crashes.{output_format}')
+    write_crashes(path, CRASH_DATES)
+    partitions = load_to_db.crash_partitions(path)
+
+    assert [rows for _, _, _, rows in partitions] == sorted((rows for _, _, _, rows in partitions), reverse=True)
+    by_label = {label: (bounds, filters, rows) for label, bounds, filters, rows in partitions}
+    assert sorted(by_label) == ['default', 'y2011', 'y2012', 'y2013', 'y2014', 'y2015', 'y2016']
+    assert by_label['default'][0] == 'DEFAULT'
+
+    seen = []
+    for label, (bounds, filters, rows) in by_label.items():
+        refs = read_partition_refs(path, filters)
+        assert len(refs) == rows, label
+        seen += refs
+    assert sorted(seen) == list(range(len(CRASH_DATES)))
+    assert sorted(read_partition_refs(path, by_label['default'][1])) == [5, 8]
+    assert sorted(read_partition_refs(path, by_label['y2011'][1])) == [0, 1, 10]
+    assert by_label['y2013'][2] == by_label['y2015'][2] == 0
+
+    ranges = sorted(year_range(bounds) for bounds, _, _ in by_label.values() if bounds != 'DEFAULT')
+    assert ranges[0][0] == datetime.date(2011, 1, 1) and ranges[-1][1] == datetime.date(2017, 1, 1)
+    for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start
+
+
+@pytest.mark.parametrize('output_format', ['gpkg', 'parquet'])
+def test_only_null_dates_get_only_the_default_partition(tmp_path, output_format):
+    path = str(tmp_path / f'crashes.{output_format}')
+    write_crashes(path, [None, None])
+    partitions = load_to_db.crash_partitions(path)
+    assert [(label, bounds, rows) for label, bounds, _, rows in partitions] == [('default', 'DEFAULT', 2)]
+    assert sorted(read_partition_refs(path, partitions[0][2])) == [0, 1]
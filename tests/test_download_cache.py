@@ -0,0 +1,247 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+import requests
+
+import download_cache
+import download_data
+
+# =============================================================================
+# Local HTTP stand-in for the upstream servers: serves in-memory files with ETag and
+# Last-Modified validators, honours If-None-Match, Range and If-Range, and can drop the
+# connection part-way through one response.
+# =============================================================================
+
+
+class Upstream:
+    """One served file; replace() changes its content and validators like a new upstream release."""
+
+    def __init__(self, content, version=1):
+        self.drop_after = None # Close the connection after this many body bytes (once)
+        self.replace(content, version)
+
+    def replace(self, content, version):
+        self.content = content
+        self.etag = f'"v{version}"'
+        self.last_modified = f"Mon, 0{version} Jan 2024 00:00:00 GMT"
+
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        upstream = self.server.files[self.path]
+        headers = dict(self.headers.items())
+        content = upstream.content
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if self.headers.get('If-None-Match') == upstream.etag:
+            status, body, extra = 304, b'', {}
+        elif range_header and if_range in (None, upstream.etag, upstream.last_modified):
+            start = int(range_header.removeprefix('bytes=').split('-')[0])
+            if start >= len(content):
+                status, body, extra = 416, b'', {'Content-Range': f"bytes */{len(content)}"}
+            else:
+                status, body = 206, content[start:]
+                extra = {'Content-Range': f"bytes {start}-{len(content) - 1}/{len(content)}"}
+        else:
+            status, body, extra = 200, content, {}
+        self.server.requests_log.append((self.path, headers, status))
+
+        self.send_response(status)
+        self.send_header('ETag', upstream.etag)
+        self.send_header('Last-Modified', upstream.last_modified)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in extra.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if upstream.drop_after is not None and status in (200, 206):
+            self.wfile.write(body[:upstream.drop_after])
+            self.wfile.flush()
+            upstream.drop_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def upstream_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    server.files = {}
+    server.requests_log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # Small blocks so a dropped connection leaves a partial file behind
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_BLOCK_SIZE', 4096)
+
+
+def serve(server, path, content, version=1):
+    server.files[path] = Upstream(content, version)
+    return f"http://127.0.0.1:{server.server_port}{path}", server.files[path]
+
+
+def sha256_of(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def statuses(server):
+    return [status for _, _, status in server.requests_log]
+
+
+# =============================================================================
+# fetch(): Revalidation, Resume, Restart and Recovery
+# =============================================================================
+def test_unchanged_upstream_is_revalidated_with_304(upstream_server, tmp_path):
+    content = os.urandom(50_000)
+    url, upstream = serve(upstream_server, '/data.csv', content)
+    cache_dir = str(tmp_path / 'cache')
+
+    path, sha256, changed = download_cache.fetch(url, cache_dir=cache_dir)
+    assert changed and sha256 == sha256_of(content) and read_bytes(path) == content
+    assert path.endswith('.csv')
+
+    path_again, sha256_again, changed_again = download_cache.fetch(url, cache_dir=cache_dir)
+    assert (path_again, sha256_again, changed_again) == (path, sha256, False)
+    assert statuses(upstream_server) == [200, 304]
+    _, headers, _ = upstream_server.requests_log[-1]
+    assert headers['If-None-Match'] == upstream.etag
+    assert headers['If-Modified-Since'] == upstream.last_modified
+    assert download_cache.cached_sha256(url, cache_dir) == sha256
+
+
+def test_dropped_connection_resumes_with_range_and_if_range(upstream_server, tmp_path):
+    content = os.urandom(200_000)
+    url, upstream = serve(upstream_server, '/data.zip', content)
+    cache_dir = str(tmp_path / 'cache')
+
+    upstream.drop_after = 50_000
+    with pytest.raises(requests.exceptions.RequestException):
+        download_cache.fetch(url, cache_dir=cache_dir)
+    part_files = [name for name in os.listdir(tmp_path / 'cache' / 'partial') if name.endswith('.part')]
+    resume_from = os.path.getsize(tmp_path / 'cache' / 'partial' / part_files[0])
+    assert 0 < resume_from <= 50_000
+
+    path, sha256, changed = download_cache.fetch(url, cache_dir=cache_dir)
+    assert changed and sha256 == sha256_of(content) and read_bytes(path) == content
+    assert statuses(upstream_server) == [200, 206]
+    _, headers, _ = upstream_server.requests_log[-1]
+    assert headers['Range'] == f"bytes={resume_from}-"
+    assert headers['If-Range'] == upstream.etag
+    assert os.listdir(tmp_path / 'cache' / 'partial') == []
+
+
+def test_changed_upstream_restarts_instead_of_splicing(upstream_server, tmp_path):
+    old_content, new_content = os.urandom(200_000), os.urandom(150_000)
+    url, upstream = serve(upstream_server, '/data.csv', old_content)
+    cache_dir = str(tmp_path / 'cache')
+
+    upstream.drop_after = 50_000
+    with pytest.raises(requests.exceptions.RequestException):
+        download_cache.fetch(url, cache_dir=cache_dir)
+    upstream.replace(new_content, version=2)
+
+    path, sha256, changed = download_cache.fetch(url, cache_dir=cache_dir)
+    assert changed and sha256 == sha256_of(new_content) and read_bytes(path) == new_content
+    assert statuses(upstream_server) == [200, 200]
+    _, headers, _ = upstream_server.requests_log[-1]
+    assert headers['If-Range'] == '"v1"' # The stale validator was offered and rejected
+
+
+def test_unsatisfiable_range_discards_partial_and_restarts(upstream_server, tmp_path):
+    content = os.urandom(20_000)
+    url, upstream = serve(upstream_server, '/data.csv', content)
+    cache_dir = str(tmp_path / 'cache')
+
+    # A partial longer than the file, fetched under the current validators
+    partial_dir = tmp_path / 'cache' / 'partial'
+    partial_dir.mkdir(parents=True)
+    url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    (partial_dir / (url_key + '.part')).write_bytes(os.urandom(30_000))
+    download_cache.write_json(str(partial_dir / (url_key + '.json')), {'etag': upstream.etag, 'last_modified': upstream.last_modified})
+
+    path, sha256, changed = download_cache.fetch(url, cache_dir=cache_dir)
+    assert changed and sha256 == sha256_of(content) and read_bytes(path) == content
+    assert statuses(upstream_server) == [416, 200]
+    assert os.listdir(partial_dir) == []
+
+
+# =============================================================================
+# download_data.main(): Skip Unchanged Inputs
+# =============================================================================
+@pytest.fixture
+def cached_pipeline(upstream_server, tmp_path, monkeypatch):
+    """Points download_data at the stand-in server with stub pipelines; returns the call log."""
+    monkeypatch.chdir(tmp_path)
+    localities_url, _ = serve(upstream_server, '/localities.zip', os.urandom(40_000))
+    crashes_url, _ = serve(upstream_server, '/crashes.csv', os.urandom(60_000))
+    monkeypatch.setattr(download_data, 'LOCALITIES_ZIP_URL', localities_url)
+    monkeypatch.setattr(download_data, 'CRASHES_CSV_URL', crashes_url)
+
+    calls = []
+    monkeypatch.setattr(download_data, 'process_locality_data', lambda **kwargs: calls.append(('localities', kwargs)) or True)
+    monkeypatch.setattr(download_data, 'process_crash_data', lambda **kwargs: calls.append(('crashes', kwargs)) or True)
+    monkeypatch.setattr(download_data, 'run_post_processing', lambda results, args: calls.append(('post', None)) or {'crash_changes': True})
+    for filename in (download_data.LOCALITIES_OUTPUT_FILENAME, download_data.CRASHES_OUTPUT_FILENAME):
+        (tmp_path / filename).write_bytes(b'')
+    return calls
+
+
+def run_main(tmp_path):
+    download_data.main(['--jobs', '1', '--cache-dir', str(tmp_path / 'cache'), '--metrics-file', ''])
+
+
+def test_main_processes_then_skips_unchanged_inputs(upstream_server, tmp_path, cached_pipeline):
+    run_main(tmp_path)
+    assert [name for name, _ in cached_pipeline] == ['localities', 'crashes', 'post']
+    localities_kwargs, crashes_kwargs = cached_pipeline[0][1], cached_pipeline[1][1]
+    assert read_bytes(localities_kwargs['zip_path']) == upstream_server.files['/localities.zip'].content
+    assert read_bytes(crashes_kwargs['csv_source']) == upstream_server.files['/crashes.csv'].content
+    run_state = download_cache.load_run_state(str(tmp_path / 'cache'))
+    assert run_state == {
+        'localities': sha256_of(upstream_server.files['/localities.zip'].content),
+        'crashes': sha256_of(upstream_server.files['/crashes.csv'].content),
+    }
+
+    cached_pipeline.clear()
+    run_main(tmp_path)
+    assert cached_pipeline == []
+    assert statuses(upstream_server)[-2:] == [304, 304]
+    assert download_cache.load_run_state(str(tmp_path / 'cache')) == run_state
+
+
+def test_main_reuses_unchanged_output_when_other_input_changed(upstream_server, tmp_path, cached_pipeline):
+    run_main(tmp_path)
+    new_crashes = os.urandom(70_000)
+    upstream_server.files['/crashes.csv'].replace(new_crashes, version=2)
+
+    cached_pipeline.clear()
+    run_main(tmp_path)
+    assert [name for name, _ in cached_pipeline] == ['crashes', 'post'] # Localities output reused, not reprocessed
+    run_state = download_cache.load_run_state(str(tmp_path / 'cache'))
+    assert run_state['crashes'] == sha256_of(new_crashes)
+    assert run_state['localities'] == sha256_of(upstream_server.files['/localities.zip'].content)
+
+
+def test_main_force_reprocesses_unchanged_inputs(upstream_server, tmp_path, cached_pipeline):
+    run_main(tmp_path)
+    cached_pipeline.clear()
+    download_data.main(['--jobs', '1', '--cache-dir', str(tmp_path / 'cache'), '--metrics-file', '', '--force'])
+    assert [name for name, _ in cached_pipeline] == ['localities', 'crashes', 'post']
@@ -0,0 +1,60 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import geo_files
+
+# =============================================================================
+# GeoFrameWriter: GeoParquet chunks whose first chunk has an all-NULL categorical
+# =============================================================================
+
+
+def chunk(roads, severities, start):
+    return gpd.GeoDataFrame(
+        {
+            'crash_road': pd.Categorical(roads),
+            'crash_severity': pd.Categorical(severities),
+            'crash_year': np.arange(start, start + len(roads), dtype='int64'),
+        },
+        geometry=shapely.points(np.arange(start, start + len(roads), dtype=float), np.zeros(len(roads))),
+        crs='EPSG:4326',
+    )
+
+
+@pytest.mark.parametrize('null_categorical', [
+    pd.Categorical([None, None]), # float64 categories
+    pd.Series([None, None], dtype=object).astype('category'), # object categories, as read_csv gives them
+])
+def test_parquet_widens_all_null_categorical_in_first_chunk(tmp_path, null_categorical):
+    path = str(tmp_path / 'crashes.parquet')
+    first = chunk([None, None], ['Fatal', 'Minor injury'], 0)
+    first['crash_road'] = null_categorical
+    with geo_files.GeoFrameWriter(path) as writer:
+        writer.write(first)
+        writer.write(chunk(['Bruce Hwy', 'Gympie Rd'], ['Minor injury', 'Hospitalisation'], 2))
+        writer.write(chunk(['Bruce Hwy', None, 'Ipswich Mwy'], ['Fatal', 'Fatal', 'Medical treatment'], 4))
+
+    gdf = geo_files.read_frame(path)
+    assert isinstance(gdf['crash_road'].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_string_dtype(gdf['crash_road'].cat.categories)
+    assert gdf['crash_road'].astype(object).where(gdf['crash_road'].notna(), None).tolist() == [
+        None, None, 'Bruce Hwy', 'Gympie Rd', 'Bruce Hwy', None, 'Ipswich Mwy',
+    ]
+    assert gdf['crash_severity'].astype(str).tolist() == [
+        'Fatal', 'Minor injury', 'Minor injury', 'Hospitalisation', 'Fatal', 'Fatal', 'Medical treatment',
+    ]
+    assert gdf['crash_year'].tolist() == list(range(7))
+    assert shapely.get_x(gdf.geometry.values).tolist() == list(range(7))
+    assert geo_files.read_info(path)['features'] == 7
+
+
+def test_parquet_keeps_binary_geometry_after_empty_first_chunk(tmp_path):
+    path = str(tmp_path / 'crashes.parquet')
+    with geo_files.GeoFrameWriter(path) as writer:
+        writer.write(chunk([], [], 0))
+        writer.write(chunk(['Bruce Hwy'], ['Fatal'], 1))
+    gdf = geo_files.read_frame(path)
+    assert gdf['crash_road'].astype(str).tolist() == ['Bruce Hwy']
+    assert shapely.get_x(gdf.geometry.values).tolist() == [1.0]
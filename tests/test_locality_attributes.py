@@ -0,0 +1,143 @@
+import logging
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import download_data
+
+# =============================================================================
+# Reference: clean_locality_attributes as it was before it was vectorised. The current
+# implementation must produce exactly the same frame (dtypes, index, geometry and CRS included),
+# except that it no longer raises KeyError when no duplicate's admin area has a comma.
+# =============================================================================
+
+
+def reference_clean_locality_attributes(gdf):
+    log_prefix = "[Localities]"
+    gdf_cleaned = gdf.copy()
+    gdf_cleaned.columns = gdf_cleaned.columns.str.lower()
+
+    required_cols = ['locality', 'adminarean']
+    if not all(col in gdf_cleaned.columns for col in required_cols):
+        missing = [col for col in required_cols if col not in gdf_cleaned.columns]
+        logging.error(f"{log_prefix} GeoDataFrame missing required columns for cleaning: {missing}")
+        raise ValueError(f"Missing required columns for cleaning: {missing}")
+
+    original_null_or_empty_mask = gdf_cleaned['locality'].isna() | \
+                                  (gdf_cleaned['locality'].astype(str).str.strip() == '')
+
+    gdf_cleaned['locality'] = gdf_cleaned['locality'].fillna('').astype(str).str.strip()
+    gdf_cleaned['adminarean'] = gdf_cleaned['adminarean'].fillna('').astype(str).str.strip()
+
+    locality_counts = gdf_cleaned.groupby('locality')['locality'].transform('size')
+    duplicate_mask = (locality_counts > 1) & (gdf_cleaned['locality'] != '')
+    duplicate_indices = gdf_cleaned.index[duplicate_mask]
+
+    if len(duplicate_indices) > 0:
+        admin_part2 = gdf_cleaned.loc[duplicate_indices, 'adminarean'].str.split(',', n=1, expand=True)[1].fillna('').str.strip()
+        admin_part2_cleaned = admin_part2.str.replace(r'\s+\w+$', '', regex=True).str.strip()
+        admin_part2_title = admin_part2_cleaned.str.title()
+        locality_title = gdf_cleaned.loc[duplicate_indices, 'locality'].str.title()
+        new_locality_series = locality_title + ' - ' + admin_part2_title
+        new_locality_series[admin_part2_title == ''] = locality_title[admin_part2_title == '']
+        gdf_cleaned.loc[duplicate_indices, 'locality'] = new_locality_series
+
+    if original_null_or_empty_mask.sum() > 0:
+        gdf_cleaned.loc[original_null_or_empty_mask, 'locality'] = 'Gulf of Carpentaria'
+
+    return gdf_cleaned
+
+
+def localities_frame(names, admin_areas, index=None):
+    """Builds a frame shaped like the boundary shapefile (upper-case columns, one square per row)."""
+    geometry = shapely.box(np.arange(len(names)), 0, np.arange(len(names)) + 1, 1)
+    return gpd.GeoDataFrame(
+        {'LOCALITY': names, 'ADMINAREAN': admin_areas, 'LC_PLY_PID': np.arange(len(names))},
+        geometry=geometry, crs='EPSG:7844', index=index,
+    )
+
+
+# =============================================================================
+# Expected Output for Hand-Picked Names
+# =============================================================================
+CASES = [
+    # (LOCALITY, ADMINAREAN, expected locality)
+    ('SPRINGFIELD', 'X, IPSWICH CITY COUNCIL', 'Springfield - Ipswich City'), # Duplicate after stripping
+    (' SPRINGFIELD ', 'Y,  Logan City Council ', 'Springfield - Logan City'),
+    (None, 'A, Cook Shire Council', 'Gulf of Carpentaria'), # NULL name
+    ('   ', 'B, Cook Shire Council', 'Gulf of Carpentaria'), # Blank name
+    ('', None, 'Gulf of Carpentaria'),
+    ('café hill', 'Z, Noosa Shire Council', 'Café Hill - Noosa Shire'), # Non-ASCII, lower case
+    ('café hill', 'NoComma', 'Café Hill'), # Duplicate whose admin area has no comma
+    ("o'connor", 'C, Brisbane City Council', "O'Connor - Brisbane City"),
+    ("o'connor", 'D, Toowoomba Regional Council', "O'Connor - Toowoomba Regional"),
+    ('Twin', None, 'Twin'), # Duplicate with a NULL admin area
+    ('Twin', 'E, Douglas Shire Council', 'Twin - Douglas Shire'),
+    ('Twin', 'F,', 'Twin'), # Empty second part
+    ('Twin', 'G, Two, Commas Council', 'Twin - Two, Commas'),
+    ('mIxEd CaSe', 'H, Logan City Council', 'mIxEd CaSe'), # Unique names keep their case
+    ('Ünique', 'no comma at all', 'Ünique'),
+]
+
+
+def test_cleaned_names_match_expected_and_reference():
+    names, admin_areas, expected = map(list, zip(*CASES))
+    gdf = localities_frame(names, admin_areas, index=pd.RangeIndex(100, 100 + len(CASES)))
+    original = gdf.copy()
+
+    cleaned = download_data.clean_locality_attributes(gdf)
+
+    assert cleaned['locality'].tolist() == expected
+    assert list(cleaned.columns) == ['locality', 'adminarean', 'lc_ply_pid', 'geometry']
+    pd.testing.assert_frame_equal(cleaned, reference_clean_locality_attributes(gdf))
+    pd.testing.assert_frame_equal(gdf, original) # The input is left untouched
+    assert all(a is b for a, b in zip(cleaned.geometry.values, gdf.geometry.values)) # Geometry is shared, not copied
+
+
+def test_duplicates_without_any_comma_keep_title_cased_name():
+    gdf = localities_frame(['north end', 'north end', 'Solo'], ['Alpha Council', None, 'Beta Council'])
+
+    # The reference raised KeyError here (split(expand=True) produced no second column)
+    with pytest.raises(KeyError):
+        reference_clean_locality_attributes(gdf)
+
+    cleaned = download_data.clean_locality_attributes(gdf)
+    assert cleaned['locality'].tolist() == ['North End', 'North End', 'Solo']
+
+
+def test_missing_required_column_raises_value_error():
+    gdf = localities_frame(['A'], ['X, Y Council']).drop(columns='ADMINAREAN')
+    with pytest.raises(ValueError, match='adminarean'):
+        download_data.clean_locality_attributes(gdf)
+
+
+# =============================================================================
+# Randomised Equivalence with the Reference
+# =============================================================================
+NAME_POOL = [None, '', '  ', 'springfield', 'SPRINGFIELD', ' Springfield', 'café hill', "o'connor", 'Ünique', 'mount isa', 'Twin Peaks']
+ADMIN_POOL = [None, '', 'No Comma', 'A, Ipswich City Council', 'B,', 'C, Noosa Shire Council ', 'D, Two, Commas Council', 'e, lower case council', 'F, Ünïcode Regional Council']
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_random_frames_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 40))
+    names = [NAME_POOL[i] for i in rng.integers(0, len(NAME_POOL), rows)]
+    admin_areas = [ADMIN_POOL[i] for i in rng.integers(0, len(ADMIN_POOL), rows)]
+    index = pd.Index(rng.permutation(1000)[:rows]) if seed % 2 else None
+    gdf = localities_frame(names, admin_areas, index=index)
+
+    cleaned = download_data.clean_locality_attributes(gdf)
+    try:
+        expected = reference_clean_locality_attributes(gdf)
+    except KeyError:
+        # No duplicate has a comma: the reference failed; duplicates are just title-cased
+        locality = pd.Series(names, index=gdf.index).fillna('').astype(str).str.strip()
+        duplicated = locality.duplicated(keep=False) & (locality != '')
+        assert not gdf.loc[duplicated, 'ADMINAREAN'].fillna('').str.contains(',').any()
+        assert cleaned.loc[duplicated, 'locality'].tolist() == locality[duplicated].str.title().tolist()
+        return
+    pd.testing.assert_frame_equal(cleaned, expected)
@@ -0,0 +1,52 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+
+import run_metrics
+
+# =============================================================================
+# Run settings: handed to worker processes explicitly, dropped by finish_run()
+# =============================================================================
+
+
+def measured_stage(name):
+    with run_metrics.stage(name) as metrics:
+        metrics.count(rows_in=1, rows_out=1)
+    return os.getpid()
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spawned_worker_reports_to_the_run(tmp_path):
+    environ_before = dict(os.environ)
+    metrics_file = tmp_path / 'metrics.jsonl'
+    settings = run_metrics.start_run('test', str(metrics_file), profile_dir=str(tmp_path))
+    try:
+        measured_stage('parent')
+        # spawn starts from a fresh interpreter, so the worker only knows the run through init_worker
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=context, initializer=run_metrics.init_worker, initargs=(run_metrics.load_settings(),),
+        ) as executor:
+            worker_pid = executor.submit(measured_stage, 'worker').result()
+    finally:
+        run_metrics.finish_run(success=True)
+
+    assert worker_pid != os.getpid()
+    records = read_records(metrics_file)
+    assert [record['stage'] for record in records] == ['parent', 'worker']
+    assert {record['run_id'] for record in records} == {settings['run_id']}
+    assert dict(os.environ) == environ_before
+
+
+def test_finish_run_ends_the_run(tmp_path):
+    metrics_file = tmp_path / 'metrics.jsonl'
+    run_metrics.start_run('test', str(metrics_file), profile_dir=str(tmp_path))
+    run_metrics.finish_run(success=True)
+    assert run_metrics.load_settings() == {}
+    measured_stage('after_run')
+    assert not metrics_file.exists()
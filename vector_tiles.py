@@ -0,0 +1,208 @@
+import gzip
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyogrio
+
+import geo_files
+
+# =============================================================================
+# Mapbox Vector Tile (MBTiles) building blocks.
+#
+# GDAL's MBTiles driver does the MVT encoding, reprojection to Web Mercator and clipping,
+# but it writes a single layer per dataset. Each (layer, zoom range) is therefore written
+# to its own temporary MBTiles file and the files are merged tile by tile: an MVT tile is a
+# protobuf message whose layers are a repeated field, so concatenating two encoded tiles
+# yields one valid tile holding the layers of both.
+# =============================================================================
+
+# --- Configuration ---
+WEB_MERCATOR_RADIUS = 6_378_137.0 # Metres, EPSG:3857 sphere
+WEB_MERCATOR_MAX_LATITUDE = 85.0511287798 # Latitude where EPSG:3857 y reaches the world edge
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+# =============================================================================
+# Helper Function: Grid Clustering of Points for One Zoom Level
+# =============================================================================
+def cluster_points(lon, lat, zoom, cells_per_tile, categories=None):
+    """Aggregates points into square Web Mercator grid cells sized for one zoom level.
+
+    Each tile at zoom is split into cells_per_tile x cells_per_tile cells. Returns a dict of
+    NumPy arrays with one entry per non-empty cell: 'longitude'/'latitude' (mean position of
+    the cell's points, so a lone point keeps its exact location) and 'point_count'. If
+    categories is given (integer codes, -1 for missing) a per-code count is added under
+    'count_<code>'.
+    """
+    lat = np.clip(lat, -WEB_MERCATOR_MAX_LATITUDE, WEB_MERCATOR_MAX_LATITUDE)
+    x = np.radians(lon)
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    cells_per_side = (2 ** zoom) * cells_per_tile
+    cell_size = 2 * np.pi / cells_per_side
+    column = np.floor((x + np.pi) / cell_size).astype(np.int64)
+    row = np.floor((np.pi - y) / cell_size).astype(np.int64)
+    cell_ids, inverse, counts = np.unique(row * cells_per_side + column, return_inverse=True, return_counts=True)
+
+    clusters = {
+        'longitude': np.bincount(inverse, weights=lon, minlength=len(cell_ids)) / counts,
+        'latitude': np.bincount(inverse, weights=lat, minlength=len(cell_ids)) / counts,
+        'point_count': counts,
+    }
+    if categories is not None:
+        for code in np.unique(categories[categories >= 0]):
+            clusters[f'count_{code}'] = np.bincount(inverse, weights=categories == code, minlength=len(cell_ids)).astype(np.int64)
+    return clusters
+
+
+def slugify(value):
+    """Turns a category label into a lowercase identifier usable as an MVT attribute name."""
+    return re.sub(r'[^0-9a-z]+', '_', str(value).lower()).strip('_')
+
+
+# =============================================================================
+# Helper Function: Write One Layer to a Single-Layer MBTiles File
+# =============================================================================
+def write_tile_layer(gdf, path, layer_name, min_zoom, max_zoom):
+    """Encodes gdf as the MVT layer layer_name for zooms min_zoom..max_zoom into a new MBTiles file."""
+    if os.path.exists(path):
+        os.remove(path)
+    pyogrio.write_dataframe(
+        gdf, path, layer=layer_name, driver='MBTiles',
+        dataset_options={'MINZOOM': str(min_zoom), 'MAXZOOM': str(max_zoom), 'NAME': layer_name},
+    )
+
+
+def write_tile_layer_frames(frames, path, layer_name, min_zoom, max_zoom, geometry_type=None):
+    """Like write_tile_layer, but streams an iterable of GeoDataFrames into GDAL one at a time.
+
+    The frames must share columns and CRS; categorical columns are written as strings.
+    geometry_type (e.g. 'Point') defaults to the single type of the first frame. Nothing is
+    written if frames is empty. Returns the number of features written.
+    """
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return 0
+    if os.path.exists(path):
+        os.remove(path)
+    geometry_name = first.geometry.name
+    if geometry_type is None:
+        geometry_types = first.geometry.geom_type.dropna().unique()
+        geometry_type = geometry_types[0] if len(geometry_types) == 1 else 'Unknown'
+    written = 0
+
+    def to_table(gdf):
+        categorical = [col for col in gdf.columns if isinstance(gdf[col].dtype, pd.CategoricalDtype)]
+        return geo_files.frame_to_table(gdf.astype({col: object for col in categorical}))
+
+    schema = geo_files.normalized_schema(to_table(first))
+
+    def batches():
+        nonlocal written
+        for gdf in itertools.chain([first], frames):
+            for batch in to_table(gdf).cast(schema).to_batches():
+                written += batch.num_rows
+                yield batch
+
+    pyogrio.write_arrow(
+        pa.RecordBatchReader.from_batches(schema, batches()), path, layer=layer_name, driver='MBTiles',
+        geometry_name=geometry_name, geometry_type=geometry_type,
+        crs=first.crs.to_wkt() if first.crs is not None else None,
+        dataset_options={'MINZOOM': str(min_zoom), 'MAXZOOM': str(max_zoom), 'NAME': layer_name},
+    )
+    return written
+
+
+# =============================================================================
+# Helper Function: Merge Single-Layer MBTiles Files
+# =============================================================================
+def concat_tiles(existing, incoming):
+    """SQLite aggregate helper: concatenates two (optionally gzipped) MVT tiles, gzipping the result."""
+    def decode(tile):
+        return gzip.decompress(tile) if tile[:2] == GZIP_MAGIC else tile
+    return gzip.compress(decode(existing) + decode(incoming), mtime=0)
+
+
+def merge_vector_layers(layer_lists):
+    """Merges MBTiles 'vector_layers' metadata entries that share an id (zoom ranges and fields)."""
+    merged = {}
+    for layers in layer_lists:
+        for layer in layers:
+            entry = merged.setdefault(layer['id'], {'id': layer['id'], 'fields': {}, 'minzoom': layer['minzoom'], 'maxzoom': layer['maxzoom']})
+            entry['fields'].update(layer.get('fields', {}))
+            entry['minzoom'] = min(entry['minzoom'], layer['minzoom'])
+            entry['maxzoom'] = max(entry['maxzoom'], layer['maxzoom'])
+    return list(merged.values())
+
+
+def merge_mbtiles(source_paths, output_path, name, log_prefix="[Tiles]"):
+    """Merges single-layer MBTiles files into one multi-layer MBTiles file at output_path.
+
+    Tiles present in several sources are concatenated inside SQLite, so no source is ever held
+    in memory as a whole. The output is built next to output_path and moved into place at the
+    end, so a server reading the old file never sees a half-written one.
+    """
+    tmp_output = output_path + ".tmp"
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+    conn = sqlite3.connect(tmp_output)
+    try:
+        conn.create_function('concat_tiles', 2, concat_tiles)
+        conn.executescript("""
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        layer_lists, bounds, min_zooms, max_zooms = [], [], [], []
+        for path in source_paths:
+            conn.execute("ATTACH DATABASE ? AS src", (path,))
+            conn.execute("""
+                INSERT INTO tiles SELECT zoom_level, tile_column, tile_row, tile_data FROM src.tiles WHERE true
+                ON CONFLICT (zoom_level, tile_column, tile_row)
+                DO UPDATE SET tile_data = concat_tiles(tiles.tile_data, excluded.tile_data)
+            """)
+            metadata = dict(conn.execute("SELECT name, value FROM src.metadata").fetchall())
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+            layer_lists.append(json.loads(metadata.get('json', '{}')).get('vector_layers', []))
+            if metadata.get('bounds'):
+                bounds.append([float(v) for v in metadata['bounds'].split(',')])
+            min_zooms.append(int(metadata['minzoom']))
+            max_zooms.append(int(metadata['maxzoom']))
+
+        bounds = np.array(bounds) if bounds else np.array([[-180.0, -85.0, 180.0, 85.0]])
+        west, south = bounds[:, 0].min(), bounds[:, 1].min()
+        east, north = bounds[:, 2].max(), bounds[:, 3].max()
+        metadata = {
+            'name': name,
+            'format': 'pbf',
+            'type': 'overlay',
+            'version': '2',
+            'minzoom': str(min(min_zooms)),
+            'maxzoom': str(max(max_zooms)),
+            'bounds': f"{west:.7f},{south:.7f},{east:.7f},{north:.7f}",
+            'center': f"{(west + east) / 2:.7f},{(south + north) / 2:.7f},{min(min_zooms)}",
+            'json': json.dumps({'vector_layers': merge_vector_layers(layer_lists)}),
+        }
+        conn.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+        conn.commit()
+        tile_count = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+    finally:
+        conn.close()
+    os.replace(tmp_output, output_path)
+    logging.info(f"{log_prefix} Merged {len(source_paths)} layer files into {tile_count} tiles ({os.path.getsize(output_path) / 1_048_576:.1f} MiB): {output_path}")
+    return tile_count
+
+
+def points_frame(columns, crs):
+    """Builds a point GeoDataFrame from a dict of arrays holding 'longitude' and 'latitude'."""
+    attributes = {k: v for k, v in columns.items() if k not in ('longitude', 'latitude')}
+    return gpd.GeoDataFrame(attributes, geometry=gpd.points_from_xy(columns['longitude'], columns['latitude']), crs=crs)